@@ -7,7 +7,8 @@ import re
 import math
 import os
 
-from ._minhash import (MinHash, get_minhash_default_seed, get_minhash_max_hash)
+from ._minhash import (MinHash, MinHashGroup, get_minhash_default_seed,
+                       get_minhash_max_hash)
 from .signature import (load_signatures, load_one_signature, SourmashSignature,
                         save_signatures)
 from .sbtmh import load_sbt_index, search_sbt_index, create_sbt_index
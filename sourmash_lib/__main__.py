@@ -7,8 +7,8 @@ import argparse
 
 from .logging import notify, error, set_quiet
 
-from .commands import (categorize, compare, compute, dump, import_csv,
-                       gather, index, sbt_combine, search,
+from .commands import (archive, categorize, compare, compute, dump,
+                       import_csv, gather, index, sbt_combine, search,
                        plot, watch, info)
 
 
@@ -21,7 +21,8 @@ def main():
                 'index': index,
                 'categorize': categorize, 'gather': gather,
                 'watch': watch,
-                'sbt_combine': sbt_combine, 'info': info}
+                'sbt_combine': sbt_combine, 'archive': archive,
+                'info': info}
     parser = argparse.ArgumentParser(
         description='work with RNAseq signatures',
         usage='''sourmash <command> [<args>]
@@ -32,6 +33,7 @@ compute <filenames>         Compute MinHash signatures for sequences in files.
 compare <filenames.sig>     Compute similarity matrix for multiple signatures.
 search <query> <against>    Search a signature against a list of signatures.
 plot <matrix>               Plot a distance matrix made by 'compare'.
+archive <name> <sigs>       Collect signatures into one indexed archive file.
 
 Sequence Bloom Tree (SBT) utilities:
 
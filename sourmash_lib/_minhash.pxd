@@ -29,12 +29,23 @@ cdef extern from "kmer_min_hash.hh":
         CMinHashType mins;
 
         KmerMinHash(unsigned int, unsigned int, bool, uint32_t, HashIntoType)
+        void check_compatible(const KmerMinHash&) except +ValueError
         void add_hash(HashIntoType) except +ValueError
         void add_word(string word) except +ValueError
         void add_sequence(const char *, bool) except +ValueError
+        void add_protein(const char *) except +ValueError
+        void add_sequences(const vector[const char *]&, bool) nogil except +ValueError
+        void add_proteins(const vector[const char *]&) nogil except +ValueError
+        void add_many(const CMinHashType&) except +ValueError
+        void flush()
         void merge(const KmerMinHash&) except +ValueError
         unsigned int count_common(const KmerMinHash&) except +ValueError
+        size_t count_common_hashes(const KmerMinHash&)
+        double jaccard(const KmerMinHash&) except +ValueError
+        CMinHashType intersection(const KmerMinHash&, size_t&) except +ValueError
+        CMinHashType difference(const KmerMinHash&)
         unsigned long size()
+        string md5_input()
 
 
     cdef cppclass KmerMinAbundance(KmerMinHash):
@@ -44,15 +55,30 @@ cdef extern from "kmer_min_hash.hh":
         void add_hash(HashIntoType) except +ValueError
         void add_word(string word) except +ValueError
         void add_sequence(const char *, bool) except +ValueError
+        void set_abundances(const CMinHashType&, const CMinHashType&) except +ValueError
         void merge(const KmerMinAbundance&) except +ValueError
         void merge(const KmerMinHash&) except +ValueError
         unsigned int count_common(const KmerMinAbundance&) except +ValueError
+        double norm()
+        double cosine(const KmerMinAbundance&) except +ValueError
         unsigned long size()
 
 
+    void add_sequences_to_sketches(const vector[KmerMinHash*]&,
+                                   const vector[const char *]&,
+                                   bool) nogil except +ValueError
+    void add_proteins_to_sketches(const vector[KmerMinHash*]&,
+                                  const vector[const char *]&) nogil except +ValueError
+    double similarity(const KmerMinHash&, const KmerMinHash&,
+                      bool) nogil except +ValueError
+
+
 cdef class MinHash(object):
     cdef unique_ptr[KmerMinHash] _this
     cdef public bool track_abundance
+    cdef int _exports
+    cdef object _md5sum
 
+    cdef _check_mutable(self)
     cpdef get_mins(self, bool with_abundance=*)
-    cpdef set_abundances(self, dict)
+    cpdef set_abundances(self, values, abunds=*)
@@ -5,12 +5,19 @@ from __future__ import unicode_literals
 
 from cython.operator cimport dereference as deref, address
 
+from cpython.buffer cimport PyBUF_WRITABLE
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from cython.view cimport array as cvarray
 from libcpp cimport bool
 from libc.stdint cimport uint32_t
+from libcpp.string cimport string
+from libcpp.vector cimport vector
 
-from ._minhash cimport KmerMinHash, KmerMinAbundance, _hash_murmur
+from ._minhash cimport (KmerMinHash, KmerMinAbundance, _hash_murmur,
+                        add_sequences_to_sketches, add_proteins_to_sketches,
+                        similarity, HashIntoType, CMinHashType)
+import hashlib
 import math
-import copy
 
 
 # default MurmurHash seed
@@ -53,6 +60,17 @@ cdef bytes to_bytes(s):
     return s
 
 
+cdef vector[const char *] _as_char_pointers(list encoded):
+    # the pointers are only valid as long as 'encoded' is alive.
+    cdef vector[const char *] ptrs
+    cdef bytes s
+
+    ptrs.reserve(len(encoded))
+    for s in encoded:
+        ptrs.push_back(s)
+    return ptrs
+
+
 def hash_murmur(kmer, uint32_t seed=MINHASH_DEFAULT_SEED):
     "hash_murmur(string, [,seed])\n\n"
     "Compute a hash for a string, optionally using a seed (an integer). "
@@ -84,6 +102,163 @@ def dotproduct(a, b, normalize=True):
     return prod
 
 
+cdef class _HashArray(object):
+    """Read-only buffer over the 'mins' or 'abunds' vector of a MinHash.
+
+    While the buffer is exported the MinHash refuses to change, so that
+    the vector can't be reallocated out from under it.
+    """
+    cdef MinHash minhash
+    cdef CMinHashType *values
+    cdef Py_ssize_t shape[1]
+    cdef Py_ssize_t strides[1]
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        if flags & PyBUF_WRITABLE:
+            raise BufferError('MinHash arrays are read-only')
+
+        self.shape[0] = self.values.size()
+        self.strides[0] = sizeof(HashIntoType)
+
+        buffer.buf = self.values.data()
+        buffer.obj = self
+        buffer.len = self.shape[0] * sizeof(HashIntoType)
+        buffer.readonly = 1
+        buffer.itemsize = sizeof(HashIntoType)
+        buffer.format = 'Q'
+        buffer.ndim = 1
+        buffer.shape = self.shape
+        buffer.strides = self.strides
+        buffer.suboffsets = NULL
+        buffer.internal = NULL
+
+        self.minhash._exports += 1
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        self.minhash._exports -= 1
+
+
+cdef _as_array(MinHash minhash, CMinHashType *values):
+    import numpy
+
+    view = _HashArray()
+    view.minhash = minhash
+    view.values = values
+
+    # numpy keeps the memoryview (and so the export) alive with the array.
+    return numpy.asarray(memoryview(view)).view(numpy.uint64)
+
+
+cdef CMinHashType _as_hash_vector(values) except *:
+    "Convert a uint64 array, or any iterable of ints, to a vector of hashes."
+    cdef const uint64_t[:] array
+    cdef CMinHashType hashes
+    cdef Py_ssize_t i
+
+    try:
+        array = values
+    except (TypeError, ValueError):
+        hashes = values
+    else:
+        hashes.reserve(array.shape[0])
+        for i in range(array.shape[0]):
+            hashes.push_back(array[i])
+    return hashes
+
+
+def _pack_hashes(values, bool varint=False, bool delta=False):
+    """Pack uint64 'values' into little-endian bytes, 8 bytes each.
+
+    With 'varint', write each as a variable-length integer instead, 7 bits
+    to a byte; with 'delta' as well, write the gaps between the values,
+    which must be sorted.
+    """
+    cdef CMinHashType hashes = _as_hash_vector(values)
+    cdef bytearray out = bytearray(10 * hashes.size())
+    cdef unsigned char[:] buf = out
+    cdef Py_ssize_t i, pos = 0
+    cdef int shift
+    cdef uint64_t x, prev = 0
+
+    for i in range(hashes.size()):
+        x = hashes[i]
+        if not varint:
+            for shift in range(0, 64, 8):
+                buf[pos] = (x >> shift) & 0xff
+                pos += 1
+            continue
+
+        if delta:
+            x, prev = x - prev, x
+        while x >= 0x80:
+            buf[pos] = (x & 0x7f) | 0x80
+            x >>= 7
+            pos += 1
+        buf[pos] = x
+        pos += 1
+
+    return bytes(out[:pos])
+
+
+def _unpack_hashes(data, Py_ssize_t n, bool varint=False, bool delta=False):
+    """Unpack 'n' values packed by _pack_hashes; returns a uint64 memoryview.
+
+    The values are kept in a Cython array, which (unlike array('Q')) works
+    the same way on Python 2 and 3.
+    """
+    cdef const unsigned char[:] buf = data
+    cdef uint64_t[:] out = cvarray(shape=(max(n, 1),),
+                                   itemsize=sizeof(uint64_t), format='Q')
+    cdef Py_ssize_t i, pos = 0
+    cdef int shift
+    cdef uint64_t x, prev = 0
+
+    if not varint:
+        if len(buf) != 8 * n:
+            raise ValueError('expected {} bytes, got {}'.format(8 * n,
+                                                                len(buf)))
+        for i in range(n):
+            x = 0
+            for shift in range(0, 64, 8):
+                x |= <uint64_t>buf[pos] << shift
+                pos += 1
+            out[i] = x
+        return out[:n]
+
+    for i in range(n):
+        x = 0
+        shift = 0
+        while True:
+            if pos >= len(buf) or shift > 63:
+                raise ValueError('truncated or corrupt varint data')
+            x |= <uint64_t>(buf[pos] & 0x7f) << shift
+            shift += 7
+            pos += 1
+            if not buf[pos - 1] & 0x80:
+                break
+        if delta:
+            x += prev
+            prev = x
+        out[i] = x
+
+    if pos != len(buf):
+        raise ValueError('unexpected data after the last varint')
+    return out[:n]
+
+
+cdef _add_hashes_from(MinHash dest, MinHash source):
+    "Add the hashes in 'source', with their abundances, to 'dest'."
+    cdef KmerMinAbundance *mh = <KmerMinAbundance*>address(deref(source._this))
+    mh.flush()
+    dest._check_mutable()
+
+    if dest.track_abundance and source.track_abundance:
+        (<KmerMinAbundance*>address(deref(dest._this))).set_abundances(
+            mh.mins, mh.abunds)
+    else:
+        deref(dest._this).add_many(mh.mins)
+
+
 cdef class MinHash(object):
 
     def __init__(self, unsigned int n, unsigned int ksize,
@@ -110,7 +285,7 @@ cdef class MinHash(object):
 
         self._this.reset(mh)
 
-        if mins:
+        if mins is not None:
             if track_abundance:
                 self.set_abundances(mins)
             else:
@@ -140,6 +315,8 @@ cdef class MinHash(object):
         (n, ksize, is_protein, mins, _, track_abundance, max_hash, seed) =\
           tup
 
+        self._check_mutable()
+
         self.track_abundance = track_abundance
 
         cdef KmerMinHash *mh = NULL
@@ -174,39 +351,98 @@ cdef class MinHash(object):
                     deref(self._this).seed, deref(self._this).max_hash)
         return a
 
+    cdef _check_mutable(self):
+        if self._exports:
+            raise BufferError('cannot modify a MinHash while arrays of its '
+                              'hashes exist')
+        # every change to the sketch comes through here.
+        self._md5sum = None
+
+    def md5sum(self):
+        """Return the md5 hash of the ksize and hashes, as a hex string.
+
+        It's kept until the sketch changes.
+        """
+        cdef string data
+        if self._md5sum is None:
+            data = deref(self._this).md5_input()
+            data_bytes = PyBytes_FromStringAndSize(data.data(), data.size())
+            self._md5sum = hashlib.md5(data_bytes).hexdigest()
+        return self._md5sum
+
     def add_sequence(self, sequence, bool force=False):
+        self._check_mutable()
         deref(self._this).add_sequence(to_bytes(sequence), force)
 
+    def add_sequences(self, sequences, bool force=False):
+        """Add many DNA sequences into sketch at once.
+
+        The sequences are hashed in C++ with the GIL released, so sketches
+        can be built in parallel from multiple threads (as long as each
+        sketch is only used by one thread at a time).
+        """
+        self._check_mutable()
+        cdef KmerMinHash *mh = address(deref(self._this))
+        encoded = [ to_bytes(s) for s in sequences ]
+        cdef vector[const char *] seqs = _as_char_pointers(encoded)
+
+        with nogil:
+            mh.add_sequences(seqs, force)
+
     def add(self, kmer):
         "Add kmer into sketch."
         self.add_sequence(kmer)
 
     def add_many(self, hashes):
-        "Add many hashes in at once."
-        for hash in hashes:
-            self.add_hash(hash)
+        """Add many hashes in at once.
+
+        Arrays of uint64 (e.g. from get_mins_array) are read directly,
+        without making a Python int for each hash.
+        """
+        self._check_mutable()
+        deref(self._this).add_many(_as_hash_vector(hashes))
 
     def update(self, other):
         "Update this estimator from all the hashes from the other."
         self.add_many(other.get_mins())
 
     def __len__(self):
-        return deref(self._this).mins.size()
+        return deref(self._this).size()
 
     cpdef get_mins(self, bool with_abundance=False):
         cdef KmerMinAbundance *mh = <KmerMinAbundance*>address(deref(self._this))
+        mh.flush()
         if with_abundance and self.track_abundance:
             return dict(zip(mh.mins, mh.abunds))
         else:
-            return [it for it in sorted(deref(self._this).mins)]
+            # 'mins' is kept sorted.
+            return mh.mins
+
+    def get_mins_array(self):
+        """Return the hashes in the sketch as a read-only numpy uint64 array.
+
+        The array shares memory with the sketch, which can't be modified
+        while any array taken from it is still around.
+        """
+        deref(self._this).flush()
+        return _as_array(self, address(deref(self._this).mins))
+
+    def get_abunds_array(self):
+        """Return the abundances of the hashes in get_mins_array, as a
+        read-only numpy uint64 array that shares memory with the sketch.
+        """
+        cdef KmerMinAbundance *mh = <KmerMinAbundance*>address(deref(self._this))
+        if not self.track_abundance:
+            raise RuntimeError("Use track_abundance=True when constructing "
+                               "the MinHash to use get_abunds_array.")
+        mh.flush()
+        return _as_array(self, address(mh.abunds))
 
     def get_hashes(self):
         return self.get_mins()
 
-    def subtract_mins(self, other):
-        a = set(self.get_mins())
-        b = set(other.get_mins())
-        return a - b
+    def subtract_mins(self, MinHash other):
+        return set(deref(self._this).difference(deref(other._this)))
 
     @property
     def seed(self):
@@ -237,6 +473,7 @@ cdef class MinHash(object):
         return mm
 
     def add_hash(self, uint64_t h):
+        self._check_mutable()
         deref(self._this).add_hash(h)
 
     def count_common(self, MinHash other):
@@ -249,10 +486,7 @@ cdef class MinHash(object):
         a = MinHash(new_num, deref(self._this).ksize,
                     deref(self._this).is_protein, self.track_abundance,
                     deref(self._this).seed, 0)
-        if self.track_abundance:
-            a.set_abundances(self.get_mins(with_abundance=True))
-        else:
-            a.add_many(self.get_mins())
+        _add_hashes_from(a, self)
 
         return a
 
@@ -277,48 +511,29 @@ cdef class MinHash(object):
         a = MinHash(0, deref(self._this).ksize,
                     deref(self._this).is_protein, self.track_abundance,
                     deref(self._this).seed, new_max_hash)
-        if self.track_abundance:
-            a.set_abundances(self.get_mins(with_abundance=True))
-        else:
-            a.add_many(self.get_mins())
+        _add_hashes_from(a, self)
 
         return a
 
     def intersection(self, MinHash other):
+        cdef size_t union_size = 0
+
         if self.num != other.num:
             err = 'must have same num: {} != {}'.format(self.num,
                                                             other.num)
             raise TypeError(err)
-        else:
-            num = self.num
-
-        if self.track_abundance and other.track_abundance:
-            combined_mh = new KmerMinAbundance(num,
-                                          deref(self._this).ksize,
-                                          deref(self._this).is_protein,
-                                          deref(self._this).seed,
-                                          deref(self._this).max_hash)
-
-        else:
-            combined_mh = new KmerMinHash(num,
-                                          deref(self._this).ksize,
-                                          deref(self._this).is_protein,
-                                          deref(self._this).seed,
-                                          deref(self._this).max_hash)
-
-        combined_mh.merge(deref(self._this))
-        combined_mh.merge(deref(other._this))
-
-        common = set(self.get_mins())
-        common.intersection_update(other.get_mins())
-        common.intersection_update(combined_mh.mins)
 
-        return common, max(combined_mh.size(), 1)
+        common = deref(self._this).intersection(deref(other._this),
+                                                union_size)
+        return set(common), max(union_size, 1)
 
     def compare(self, MinHash other):
-        common, size = self.intersection(other)
-        n = len(common)
-        return n / size
+        if self.num != other.num:
+            err = 'must have same num: {} != {}'.format(self.num,
+                                                            other.num)
+            raise TypeError(err)
+
+        return deref(self._this).jaccard(deref(other._this))
 
     def jaccard(self, MinHash other):
         return self.compare(other)
@@ -338,20 +553,16 @@ cdef class MinHash(object):
 
         See https://en.wikipedia.org/wiki/Cosine_similarity
         """
+        cdef MinHash other_mh = other
 
         # if either signature is flat, calculate Jaccard only.
         if not (self.track_abundance and other.track_abundance) or \
           ignore_abundance:
             return self.jaccard(other)
         else:
-            # can we merge? if not, raise exception.
-            aa = copy.copy(self)
-            aa.merge(other)
-
-            a = self.get_mins(with_abundance=True)
-            b = other.get_mins(with_abundance=True)
-
-            prod = dotproduct(a, b)
+            # raises ValueError if the sketches can't be compared.
+            prod = (<KmerMinAbundance*>address(deref(self._this))).cosine(
+                deref(<KmerMinAbundance*>address(deref(other_mh._this))))
             prod = min(1.0, prod)
 
             distance = 2*math.acos(prod) / math.pi
@@ -361,22 +572,21 @@ cdef class MinHash(object):
         """\
         Calculate how much of self is contained by other.
         """
-        return self.count_common(other) / len(self.get_mins())
+        return self.count_common(other) / len(self)
 
     def similarity_ignore_maxhash(self, MinHash other):
-        a = set(self.get_mins())
-        if not a:
+        n = len(self)
+        if not n:
             return 0.0
 
-        b = set(other.get_mins())
-
-        overlap = a.intersection(b)
-        return float(len(overlap)) / float(len(a))
+        common = deref(self._this).count_common_hashes(deref(other._this))
+        return float(common) / float(n)
 
     def __iadd__(self, MinHash other):
         cdef KmerMinAbundance *mh = <KmerMinAbundance*>address(deref(self._this))
         cdef KmerMinAbundance *other_mh = <KmerMinAbundance*>address(deref(other._this))
 
+        self._check_mutable()
         if self.track_abundance and other.track_abundance:
             deref(mh).merge(deref(other_mh))
         else:
@@ -385,31 +595,40 @@ cdef class MinHash(object):
         return self
     merge = __iadd__
 
-    cpdef set_abundances(self, dict values):
+    cpdef set_abundances(self, values, abunds=None):
+        """Add hashes along with their abundances.
+
+        'values' is a dict of hash -> abundance, or an array of hashes
+        with the matching array of abundances in 'abunds'.
+        """
+        cdef KmerMinAbundance *mh = <KmerMinAbundance*>address(deref(self._this))
+
         if self.track_abundance:
-            added = 0
-
-            for k, v in sorted(values.items()):
-                if not self.max_hash or k <= self.max_hash:
-                    deref(self._this).mins.push_back(k)
-                    (<KmerMinAbundance*>address(deref(self._this))).abunds.push_back(v)
-                    added += 1
-                    if self.num > 0 and added >= self.num:
-                        break
+            self._check_mutable()
+            if abunds is None:
+                abunds = values.values()
+                values = values.keys()
+            mh.set_abundances(_as_hash_vector(values), _as_hash_vector(abunds))
         else:
             raise RuntimeError("Use track_abundance=True when constructing "
                                "the MinHash to use set_abundances.")
 
     def add_protein(self, sequence):
-        cdef uint32_t ksize = deref(self._this).ksize // 3
-        if len(sequence) < ksize:
-            return
+        self._check_mutable()
+        deref(self._this).add_protein(to_bytes(sequence))
 
-        if not deref(self._this).is_protein:
-            raise ValueError("cannot add amino acid sequence to DNA MinHash!")
+    def add_proteins(self, sequences):
+        """Add many amino acid sequences into sketch at once.
 
-        for i in range(0, len(sequence) - ksize + 1):
-            deref(self._this).add_word(to_bytes(sequence[i:i + ksize]))
+        Like add_sequences, this runs with the GIL released.
+        """
+        self._check_mutable()
+        cdef KmerMinHash *mh = address(deref(self._this))
+        encoded = [ to_bytes(s) for s in sequences ]
+        cdef vector[const char *] seqs = _as_char_pointers(encoded)
+
+        with nogil:
+            mh.add_proteins(seqs)
 
     def is_molecule_type(self, molecule):
         if molecule.upper() == 'DNA' and not self.is_protein:
@@ -417,3 +636,108 @@ cdef class MinHash(object):
         if molecule == 'protein' and self.is_protein:
             return True
         return False
+
+
+cdef class MinHashGroup(object):
+    """A group of MinHash sketches that are fed the same sequences.
+
+    Sketches of several k-mer sizes and molecule types are filled in from
+    a single pass over each sequence, sharing the DNA encoding and the
+    six-frame translation between them. The sketches are updated in
+    place; do not use them from another thread while adding sequences.
+    """
+    cdef vector[KmerMinHash*] _sketches
+    cdef readonly list minhashes
+
+    def __init__(self, minhashes):
+        cdef MinHash mh
+        self.minhashes = list(minhashes)
+        for mh in self.minhashes:
+            self._sketches.push_back(address(deref(mh._this)))
+
+    def add_sequence(self, sequence, bool force=False):
+        self.add_sequences([sequence], force)
+
+    cdef _check_mutable(self):
+        cdef MinHash mh
+        for mh in self.minhashes:
+            mh._check_mutable()
+
+    def add_sequences(self, sequences, bool force=False):
+        self._check_mutable()
+        encoded = [ to_bytes(s) for s in sequences ]
+        cdef vector[const char *] seqs = _as_char_pointers(encoded)
+
+        with nogil:
+            add_sequences_to_sketches(self._sketches, seqs, force)
+
+    def add_protein(self, sequence):
+        self.add_proteins([sequence])
+
+    def add_proteins(self, sequences):
+        self._check_mutable()
+        encoded = [ to_bytes(s) for s in sequences ]
+        cdef vector[const char *] seqs = _as_char_pointers(encoded)
+
+        with nogil:
+            add_proteins_to_sketches(self._sketches, seqs)
+
+
+cdef class PairwiseSimilarity(object):
+    """All-by-all similarities of a list of MinHash sketches.
+
+    The sketches must all be compatible, and can't be modified while in
+    use here. fill_tile() runs with the GIL released, so tiles of the
+    matrix can be computed in parallel from multiple threads.
+    """
+    cdef vector[KmerMinHash*] _sketches
+    cdef readonly list minhashes
+    cdef readonly bool ignore_abundance
+
+    def __init__(self, minhashes, bool ignore_abundance=False):
+        cdef MinHash mh
+        self.minhashes = list(minhashes)
+        self.ignore_abundance = ignore_abundance
+
+        for mh in self.minhashes:
+            if mh.num != self.minhashes[0].num:
+                err = 'must have same num: {} != {}'.format(
+                    self.minhashes[0].num, mh.num)
+                raise TypeError(err)
+            self._sketches.push_back(address(deref(mh._this)))
+            self._sketches[0].check_compatible(deref(mh._this))
+
+            # bring the sketches (and cached norms) up to date now, so
+            # fill_tile() only ever reads them.
+            if mh.track_abundance:
+                (<KmerMinAbundance*>address(deref(mh._this))).norm()
+            else:
+                deref(mh._this).flush()
+
+    def __len__(self):
+        return self._sketches.size()
+
+    def fill_tile(self, size_t row_start, size_t row_end,
+                  size_t col_start, size_t col_end, double[:, :] out):
+        """Compute the similarities of sketches row_start..row_end against
+        col_start..col_end into 'out', indexed from the tile's corner.
+
+        Only the upper triangle of the full matrix (j >= i) is computed;
+        other cells of 'out' are left alone.
+        """
+        cdef size_t n = self._sketches.size()
+        cdef size_t i, j
+
+        row_end = min(row_end, n)
+        col_end = min(col_end, n)
+        if row_end > row_start and col_end > col_start and \
+           (<size_t>out.shape[0] < row_end - row_start or
+            <size_t>out.shape[1] < col_end - col_start):
+            raise ValueError('tile is too small')
+
+        with nogil:
+            for i in range(row_start, row_end):
+                for j in range(max(i, col_start), col_end):
+                    out[i - row_start, j - col_start] = similarity(
+                        deref(self._sketches[i]), deref(self._sketches[j]),
+                        self.ignore_abundance)
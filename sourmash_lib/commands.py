@@ -2,16 +2,24 @@ from __future__ import print_function
 
 import argparse
 import csv
+import functools
+import itertools
+import multiprocessing
 import os
 import os.path
 import sys
-from collections import namedtuple
+import tempfile
+from collections import deque, namedtuple
 import random
 
 import screed
 import sourmash_lib
 from . import signature as sig
 from . import sourmash_args
+from .compare import compare_all_pairs
+from .gather import GatherCounts
+from .hashindex import HashIndex
+from ._minhash import MinHashGroup
 from .logging import notify, error, print_results, set_quiet
 
 from .sourmash_args import DEFAULT_LOAD_K
@@ -44,6 +52,238 @@ def info(args):
         notify('- loaded from path: {}', os.path.dirname(screed.__file__))
 
 
+ComputeParameters = namedtuple('ComputeParameters',
+                               'ksizes, seed, protein, dna, num_hashes, '
+                               'track_abundance, scaled, input_is_protein, '
+                               'check_sequence')
+
+# number of bases handed to each worker process at a time.
+DEFAULT_CHUNK_SIZE = 10000000
+
+# input files bigger than this (in bytes) are split into chunks even when
+# there are enough files to keep all of the worker processes busy.
+LARGE_FILE_SIZE = 1 << 30
+
+
+def make_minhashes(params):
+    "Build a group with one empty MinHash for each ksize/molecule type."
+    # one minhash for each ksize, all fed from a single pass over
+    # each sequence.
+    Elist = []
+    for k in params.ksizes:
+        if params.protein:
+            E = sourmash_lib.MinHash(ksize=k, n=params.num_hashes,
+                                     is_protein=True,
+                                     track_abundance=params.track_abundance,
+                                     scaled=params.scaled,
+                                     seed=params.seed)
+            Elist.append(E)
+        if params.dna:
+            E = sourmash_lib.MinHash(ksize=k, n=params.num_hashes,
+                                     is_protein=False,
+                                     track_abundance=params.track_abundance,
+                                     scaled=params.scaled,
+                                     seed=params.seed)
+            Elist.append(E)
+    return MinHashGroup(Elist)
+
+
+def add_seq(Elist, seq, params):
+    if params.input_is_protein:
+        Elist.add_protein(seq)
+    else:
+        Elist.add_sequence(seq, not params.check_sequence)
+
+
+def add_seqs(Elist, seqs, params):
+    if params.input_is_protein:
+        Elist.add_proteins(seqs)
+    else:
+        Elist.add_sequences(seqs, not params.check_sequence)
+
+
+def _compute_file(params, filename, progress=True):
+    """Sketch all of the sequences in 'filename'.
+
+    Returns the list of MinHashes, the number of sequences, and the name
+    of the first sequence. Used directly or in a worker process.
+    """
+    Elist = make_minhashes(params)
+
+    if progress:
+        notify('... reading sequences from {}', filename)
+    first_name = None
+    n = 0
+    for n, record in enumerate(screed.open(filename), 1):
+        if n == 1:
+            first_name = record.name
+        elif progress and n % 10000 == 1:
+            notify('\r...{} {}', filename, n - 1, end='')
+
+        add_seq(Elist, record.sequence, params)
+    if progress:
+        notify('')
+
+    return Elist.minhashes, n, first_name
+
+
+def _compute_records(params, filename):
+    "Sketch each record in 'filename' separately, for --singleton."
+    results = []
+    for record in screed.open(filename):
+        Elist = make_minhashes(params)
+        add_seq(Elist, record.sequence, params)
+        results.append((record.name, Elist.minhashes))
+    return results
+
+
+def _compute_chunk(params, chunk):
+    "Sketch one chunk of a file in a worker process."
+    Elist = make_minhashes(params)
+    add_seqs(Elist, chunk, params)
+    return Elist.minhashes
+
+
+def _compute_record_chunk(params, chunk):
+    "Sketch each (name, sequence) record in a chunk separately."
+    results = []
+    for name, sequence in chunk:
+        Elist = make_minhashes(params)
+        add_seq(Elist, sequence, params)
+        results.append((name, Elist.minhashes))
+    return results
+
+
+class _ChunkReader(object):
+    """Split the records in a sequence file into chunks of ~chunk_size bases.
+
+    Iterating yields lists of sequences, or of (name, sequence) tuples if
+    'singleton' is set; at least one (possibly empty) chunk is yielded.
+    Once iteration is done, 'n' and 'first_name' hold the number of
+    records read and the name of the first one.
+    """
+    def __init__(self, filename, chunk_size, singleton=False):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.singleton = singleton
+        self.n = 0
+        self.first_name = None
+
+    def __iter__(self):
+        notify('... reading sequences from {}', self.filename)
+        chunk = []
+        chunk_bp = 0
+        for n, record in enumerate(screed.open(self.filename), 1):
+            if n == 1:
+                self.first_name = record.name
+            elif n % 10000 == 1:
+                notify('\r...{} {}', self.filename, n - 1, end='')
+            self.n = n
+
+            if self.singleton:
+                chunk.append((record.name, record.sequence))
+            else:
+                chunk.append(record.sequence)
+            chunk_bp += len(record.sequence)
+
+            if chunk_bp >= self.chunk_size:
+                yield chunk
+                chunk = []
+                chunk_bp = 0
+        notify('')
+
+        if chunk or not self.n:
+            yield chunk
+
+
+def _imap_bounded(pool, tasks, max_pending):
+    """Like pool.imap, but keep at most 'max_pending' tasks in flight.
+
+    'tasks' yields (key, func, arg) triples; (key, func(arg)) pairs are
+    yielded back in the same order. Pool.imap reads all of its input as
+    fast as it can, which would pull a whole sequence file into memory.
+    """
+    pending = deque()
+    for key, func, arg in tasks:
+        pending.append((key, pool.apply_async(func, (arg,))))
+        if len(pending) >= max_pending:
+            key, result = pending.popleft()
+            yield key, result.get()
+
+    while pending:
+        key, result = pending.popleft()
+        yield key, result.get()
+
+
+def _split_file(filename, n_files, processes):
+    """Decide whether to split 'filename' into chunks across the worker
+    pool, rather than hand the whole file to one worker.
+
+    Chunking means the file is parsed in this process, so it's only worth
+    it when there are too few files to keep every worker busy, or for
+    files big enough to hold up one worker long after the others are done.
+    """
+    if n_files < processes:
+        return True
+    try:
+        return os.path.getsize(filename) > LARGE_FILE_SIZE
+    except OSError:                       # e.g. '-' for stdin
+        return False
+
+
+def _compute_files_parallel(params, filenames, pool, processes, chunk_size,
+                            singleton=False):
+    """Sketch files across a worker pool.
+
+    Each file is handed to a worker whole, or split into chunks that are
+    sketched separately (see _split_file). Yields (filename, result) in
+    input order, where result is what _compute_file (or _compute_records,
+    with 'singleton') would return: the partial sketches from each chunk
+    are merged back together.
+    """
+    filenames = list(filenames)
+    if singleton:
+        file_func = functools.partial(_compute_records, params)
+        chunk_func = functools.partial(_compute_record_chunk, params)
+    else:
+        file_func = functools.partial(_compute_file, params, progress=False)
+        chunk_func = functools.partial(_compute_chunk, params)
+
+    def tasks():
+        for pos, filename in enumerate(filenames):
+            if _split_file(filename, len(filenames), processes):
+                reader = _ChunkReader(filename, chunk_size, singleton)
+                for chunk in reader:
+                    yield (pos, filename, reader), chunk_func, chunk
+            else:
+                notify('... reading sequences from {}', filename)
+                yield (pos, filename, None), file_func, filename
+
+    results = _imap_bounded(pool, tasks(), 2 * processes)
+
+    # the reader is finished with a file by the time the chunks of the
+    # next one start coming back.
+    for (_, filename, reader), group in itertools.groupby(results,
+                                                          key=lambda x: x[0]):
+        if reader is None:                # sketched whole
+            _, result = next(group)
+            yield filename, result
+        elif singleton:
+            records = []
+            for _, chunk_records in group:
+                records += chunk_records
+            yield filename, records
+        else:
+            Elist = None
+            for _, chunk_Elist in group:
+                if Elist is None:
+                    Elist = chunk_Elist
+                else:
+                    for E, chunk_E in zip(Elist, chunk_Elist):
+                        E.merge(chunk_E)
+            yield filename, (Elist, reader.n, reader.first_name)
+
+
 def compute(args):
     """Compute the signature for one or more files.
 
@@ -96,6 +336,13 @@ def compute(args):
                         default=sourmash_lib.DEFAULT_SEED)
     parser.add_argument('--randomize', action='store_true',
                         help='shuffle the list of input filenames randomly')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of processes to use for sketching (default: %(default)i)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='with --processes, split input files into chunks of this many bases when there are fewer files than processes, or files are over 1 GiB (default: %(default)i)')
+    parser.add_argument('--binary', nargs='?', const='raw',
+                        choices=['raw', 'varint'],
+                        help='save signatures in the binary format, with the hashes stored raw or as varints (default: JSON)')
 
 
     args = parser.parse_args(args)
@@ -164,34 +411,13 @@ def compute(args):
         error("must specify -o with --merge")
         sys.exit(-1)
 
-    def make_minhashes():
-        seed = args.seed
-
-        # one minhash for each ksize
-        Elist = []
-        for k in ksizes:
-            if args.protein:
-                E = sourmash_lib.MinHash(ksize=k, n=args.num_hashes,
-                                            is_protein=True,
-                                    track_abundance=args.track_abundance,
-                                            scaled=args.scaled,
-                                            seed=seed)
-                Elist.append(E)
-            if args.dna:
-                E = sourmash_lib.MinHash(ksize=k, n=args.num_hashes,
-                                            is_protein=False,
-                                    track_abundance=args.track_abundance,
-                                            scaled=args.scaled,
-                                            seed=seed)
-                Elist.append(E)
-        return Elist
-
-    def add_seq(Elist, seq, input_is_protein, check_sequence):
-        for E in Elist:
-            if input_is_protein:
-                E.add_protein(seq)
-            else:
-                E.add_sequence(seq, not check_sequence)
+    params = ComputeParameters(ksizes=ksizes, seed=args.seed,
+                               protein=args.protein, dna=args.dna,
+                               num_hashes=args.num_hashes,
+                               track_abundance=args.track_abundance,
+                               scaled=args.scaled,
+                               input_is_protein=args.input_is_protein,
+                               check_sequence=args.check_sequence)
 
     def build_siglist(email, Elist, filename, name=None):
         return [ sig.SourmashSignature(email, E, filename=filename,
@@ -199,94 +425,108 @@ def compute(args):
 
     def save_siglist(siglist, output_fp, filename=None):
         # save!
+        if args.binary:
+            save = functools.partial(sig.save_signatures, binary=True,
+                                     compress=args.binary == 'varint')
+        else:
+            save = sig.save_signatures
+
         if output_fp:
-            sig.save_signatures(siglist, args.output)
+            if args.binary:
+                # write the bytes underneath the text-mode output file.
+                output_fp.flush()
+                output_fp = getattr(output_fp, 'buffer', output_fp)
+            save(siglist, output_fp)
         else:
             if filename is None:
                 raise Exception("internal error, filename is None")
-            with open(filename, 'w') as fp:
-                sig.save_signatures(siglist, fp)
+            with open(filename, 'wb' if args.binary else 'w') as fp:
+                save(siglist, fp)
 
     if args.track_abundance:
         notify('Tracking abundance of input k-mers.')
 
-    if not args.merge:
-        if args.output:
-            siglist = []
-
-        for filename in args.filenames:
-            sigfile = os.path.basename(filename) + '.sig'
-            if not args.output and os.path.exists(sigfile) and not \
-                args.force:
-                notify('skipping {} - already done', filename)
-                continue
+    # with --processes, files are sketched on a pool of workers - whole,
+    # or in chunks of sequence whose partial sketches are merged back.
+    pool = None
+    if args.processes > 1:
+        notify('using {} processes', args.processes)
+        pool = multiprocessing.Pool(args.processes)
+
+    def compute_files(filenames, singleton=False):
+        if pool is not None:
+            return _compute_files_parallel(params, filenames, pool,
+                                           args.processes, args.chunk_size,
+                                           singleton)
+        if singleton:
+            func = functools.partial(_compute_records, params)
+        else:
+            func = functools.partial(_compute_file, params)
+        return ( (filename, func(filename)) for filename in filenames )
 
-            if args.singleton:
+    try:
+        if not args.merge:
+            if args.output:
                 siglist = []
-                for n, record in enumerate(screed.open(filename)):
-                    # make minhashes for each sequence
-                    Elist = make_minhashes()
-                    add_seq(Elist, record.sequence,
-                            args.input_is_protein, args.check_sequence)
 
-                    siglist += build_siglist(args.email, Elist, filename,
-                                             name=record.name)
+            filenames = []
+            for filename in args.filenames:
+                sigfile = os.path.basename(filename) + '.sig'
+                if not args.output and os.path.exists(sigfile) and not \
+                    args.force:
+                    notify('skipping {} - already done', filename)
+                    continue
+                filenames.append(filename)
+
+            for filename, result in compute_files(filenames, args.singleton):
+                sigfile = os.path.basename(filename) + '.sig'
+
+                if args.singleton:
+                    sigs = []
+                    for name, Elist in result:
+                        sigs += build_siglist(args.email, Elist, filename,
+                                              name=name)
+                    n = len(result)
+                else:
+                    Elist, n, first_name = result
+
+                    name = None
+                    if args.name_from_first:
+                        name = first_name
+
+                    sigs = build_siglist(args.email, Elist, filename, name)
 
                 notify('calculated {} signatures for {} sequences in {}'.\
-                          format(len(siglist), n + 1, filename))
-            else:
-                # make minhashes for the whole file
-                Elist = make_minhashes()
+                          format(len(sigs), n, filename))
 
-                # consume & calculate signatures
-                notify('... reading sequences from {}', filename)
-                name = None
-                for n, record in enumerate(screed.open(filename)):
-                    if n % 10000 == 0:
-                        if n:
-                            notify('\r...{} {}', filename, n, end='')
-                        elif args.name_from_first:
-                            name = record.name
-
-                    s = record.sequence
-                    add_seq(Elist, record.sequence,
-                            args.input_is_protein, args.check_sequence)
-                notify('')
-
-                sigs = build_siglist(args.email, Elist, filename, name)
                 if args.output:
                     siglist += sigs
                 else:
-                    siglist = sigs
-
-                notify('calculated {} signatures for {} sequences in {}'.\
-                          format(len(siglist), n + 1, filename))
+                    save_siglist(sigs, args.output, sigfile)
 
-            if not args.output:
+            if args.output:
                 save_siglist(siglist, args.output, sigfile)
+        else:                             # single name specified - combine all
+            # sketch each file separately, and merge the sketches.
+            Elist = None
+            total = 0
+            for filename, (file_Elist, n, _) in compute_files(args.filenames):
+                total += n
+                if Elist is None:
+                    Elist = file_Elist
+                else:
+                    for E, file_E in zip(Elist, file_Elist):
+                        E.merge(file_E)
 
-        if args.output:
-            save_siglist(siglist, args.output, sigfile)
-    else:                             # single name specified - combine all
-        # make minhashes for the whole file
-        Elist = make_minhashes()
-
-        for filename in args.filenames:
-            # consume & calculate signatures
-            notify('... reading sequences from {}', filename)
-            for n, record in enumerate(screed.open(filename)):
-                if n % 10000 == 0 and n:
-                    notify('\r... {} {}', filename, n, end='')
-
-                add_seq(Elist, record.sequence,
-                        args.input_is_protein, args.check_sequence)
-
-        siglist = build_siglist(args.email, Elist, filename,
-                                name=args.merge)
-        notify('calculated {} signatures for {} sequences taken from {}'.\
-               format(len(siglist), n + 1, " ".join(args.filenames)))
-        # at end, save!
-        save_siglist(siglist, args.output)
+            siglist = build_siglist(args.email, Elist, filename,
+                                    name=args.merge)
+            notify('calculated {} signatures for {} sequences taken from {}'.\
+                   format(len(siglist), total, " ".join(args.filenames)))
+            # at end, save!
+            save_siglist(siglist, args.output)
+    finally:
+        if pool is not None:
+            pool.terminate()
 
 
 def compare(args):
@@ -302,6 +542,13 @@ def compare(args):
     sourmash_args.add_moltype_args(parser)
     parser.add_argument('--csv', type=argparse.FileType('w'),
                         help='save matrix in CSV format (with column headers)')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of threads to use for comparisons (default: %(default)i)')
+    parser.add_argument('--dtype', choices=['float64', 'float32'],
+                        default='float64',
+                        help='type of the values in the saved matrix (default: %(default)s)')
+    parser.add_argument('--upper-triangle', action='store_true',
+                        help='only fill in the upper triangle of the matrix; the lower triangle is left as zeros')
     parser.add_argument('-q', '--quiet', action='store_true',
                         help='suppress non-error output')
     args = parser.parse_args(args)
@@ -368,16 +615,31 @@ def compare(args):
 
     notify('')
 
-    # build the distance matrix
-    D = numpy.zeros([len(siglist), len(siglist)])
+    # build the distance matrix in a memory-mapped .npy file, so that it
+    # doesn't have to fit in RAM; if it isn't being saved (e.g. with only
+    # --csv), the file is a temporary one, removed as soon as it's mapped.
+    if args.output:
+        D = numpy.lib.format.open_memmap(args.output, mode='w+',
+                                         dtype=args.dtype,
+                                         shape=(len(siglist), len(siglist)))
+    else:
+        with tempfile.NamedTemporaryFile(suffix='.npy') as fp:
+            D = numpy.lib.format.open_memmap(fp.name, mode='w+',
+                                             dtype=args.dtype,
+                                             shape=(len(siglist),
+                                                    len(siglist)))
     numpy.set_printoptions(precision=3, suppress=True)
 
     # do all-by-all calculation
+    def report(done, total):
+        notify('\r...compared {} of {} pairs', done, total, end='')
+
+    compare_all_pairs(siglist, D, args.ignore_abundance, args.processes,
+                      progress=report, upper_triangle=args.upper_triangle)
+    notify('')
+
     labeltext = []
     for i, E in enumerate(siglist):
-        for j, E2 in enumerate(siglist):
-            D[i][j] = E.similarity(E2, args.ignore_abundance)
-
         if len(siglist) < 30:
             # for small matrices, pretty-print some output
             name_num = '{}-{}'.format(i, E.name())
@@ -387,7 +649,10 @@ def compare(args):
 
         labeltext.append(E.name())
 
-    print_results('min similarity in matrix: {:.3f}', numpy.min(D))
+    # go by rows of the upper triangle, which is all there is with
+    # --upper-triangle, and doesn't need another copy of the matrix.
+    min_sim = min(D[i, i:].min() for i in range(len(siglist)))
+    print_results('min similarity in matrix: {:.3f}', min_sim)
 
     # shall we output a matrix?
     if args.output:
@@ -397,19 +662,15 @@ def compare(args):
             fp.write("\n".join(labeltext))
 
         notify('saving distance matrix to: {}', args.output)
-        with open(args.output, 'wb') as fp:
-            numpy.save(fp, D)
+        D.flush()
 
-    # output CSV?
+    # output CSV? written a row at a time, straight from the matrix.
     if args.csv:
         w = csv.writer(args.csv)
         w.writerow(labeltext)
 
         for i in range(len(labeltext)):
-            y = []
-            for j in range(len(labeltext)):
-                y.append('{}'.format(D[i][j]))
-            args.csv.write(','.join(y) + '\n')
+            args.csv.write(','.join(map(str, D[i].tolist())) + '\n')
 
 
 def plot(args):
@@ -448,6 +709,10 @@ def plot(args):
     D = numpy.load(open(D_filename, 'rb'))
     labeltext = [ x.strip() for x in open(labelfilename) ]
 
+    # fill in the lower triangle of 'compare --upper-triangle' output.
+    if not numpy.tril(D, -1).any():
+        D = D + numpy.triu(D, 1).T
+
     # build filenames, decide on PDF/PNG output
     dendrogram_out = os.path.basename(D_filename) + '.dendro'
     if args.pdf:
@@ -596,6 +861,8 @@ def index(args):
                         help='add signatures to an existing SBT.')
     parser.add_argument('-x', '--bf-size', type=float, default=1e5,
                         help='Bloom filter size used for internal nodes.')
+    parser.add_argument('--hash-index', action='store_true',
+                        help='save an inverted hash index instead of an SBT.')
 
     sourmash_args.add_moltype_args(parser)
 
@@ -603,7 +870,12 @@ def index(args):
     set_quiet(args.quiet)
     moltype = sourmash_args.calculate_moltype(args)
 
-    if args.append:
+    if args.hash_index:
+        if args.append:
+            tree = HashIndex(HashIndex.load(args.sbt_name))
+        else:
+            tree = HashIndex()
+    elif args.append:
         tree = sourmash_lib.load_sbt_index(args.sbt_name)
     else:
         tree = sourmash_lib.create_sbt_index(args.bf_size)
@@ -628,8 +900,11 @@ def index(args):
             ksizes.add(ss.minhash.ksize)
             moltypes.add(sourmash_args.get_moltype(ss))
 
-            leaf = sourmash_lib.sbtmh.SigLeaf(ss.md5sum(), ss)
-            tree.add_node(leaf)
+            if args.hash_index:
+                tree.insert(ss)
+            else:
+                leaf = sourmash_lib.sbtmh.SigLeaf(ss.md5sum(), ss)
+                tree.add_node(leaf)
             n += 1
 
         # check to make sure we aren't loading incompatible signatures
@@ -645,12 +920,56 @@ def index(args):
         error('no signatures found to load into tree!? failing.')
         sys.exit(-1)
 
-    notify('loaded {} sigs; saving SBT under "{}"', n, args.sbt_name)
+    notify('loaded {} sigs; saving {} under "{}"', n,
+           'hash index' if args.hash_index else 'SBT', args.sbt_name)
     tree.save(args.sbt_name)
 
 
+def archive(args):
+    from sourmash_lib.signature_archive import save_signature_archive
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archive_name', help='name to save the archive into')
+    parser.add_argument('signatures', nargs='+',
+                        help='signatures to put into the archive')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='suppress non-error output')
+    parser.add_argument('-k', '--ksize', type=int, default=None,
+                        help='only archive signatures with this k-mer size.')
+    parser.add_argument('--traverse-directory', action='store_true',
+                        help='load all signatures underneath this directory.')
+    parser.add_argument('--compress', action='store_true',
+                        help='store the hashes as varints.')
+    sourmash_args.add_moltype_args(parser)
+
+    args = parser.parse_args(args)
+    set_quiet(args.quiet)
+    moltype = sourmash_args.calculate_moltype(args)
+
+    if args.traverse_directory:
+        inp_files = list(sourmash_args.traverse_find_sigs(args.signatures))
+    else:
+        inp_files = list(args.signatures)
+
+    siglist = []
+    for f in inp_files:
+        notify('loading {}', f, end='\r')
+        siglist.extend(sig.load_signatures(f, ksize=args.ksize,
+                                           select_moltype=moltype))
+    notify(' '*79, end='\r')
+
+    if not siglist:
+        error('no signatures found to archive!? failing.')
+        sys.exit(-1)
+
+    notify('saving {} signatures into archive "{}"', len(siglist),
+           args.archive_name)
+    with open(args.archive_name, 'wb') as fp:
+        save_signature_archive(siglist, fp, compress=args.compress)
+
+
 def search(args):
-    from sourmash_lib.sbtmh import search_minhashes, SearchMinHashesFindBest
+    from sourmash_lib.sbtmh import search_minhashes, score_minhashes
 
     parser = argparse.ArgumentParser()
     parser.add_argument('query', help='query signature')
@@ -664,6 +983,8 @@ def search(args):
                         help='output matching signatures to this file.')
     parser.add_argument('--best-only', action='store_true',
                         help='report only the best match (with greater speed).')
+    parser.add_argument('--top', action='store_true',
+                        help='find only the best -n matches (with greater speed).')
     parser.add_argument('-n', '--num-results', default=3, type=int,
                         help='number of results to report')
     parser.add_argument('--containment', action='store_true',
@@ -675,6 +996,7 @@ def search(args):
 
     sourmash_args.add_ksize_arg(parser, DEFAULT_LOAD_K)
     sourmash_args.add_moltype_args(parser)
+    sourmash_args.add_cache_arg(parser)
 
     args = parser.parse_args(args)
     set_quiet(args.quiet)
@@ -708,9 +1030,29 @@ def search(args):
     if args.containment:
         query_similarity = lambda x: query.contained_by(x, downsample=True)
 
+    # only the best few matches?
+    top_k = None
+    if args.best_only:
+        top_k = 1
+    elif args.top:
+        top_k = args.num_results
+
+    # neither Jaccard similarity nor containment can be higher than the
+    # fraction of the query in a node, so that can bound the similarity
+    # of the leaves below it. (Abundance-weighted similarity can.)
+    prune_top_k = top_k and (args.containment or
+                             not query.minhash.track_abundance)
+
+    def score_fn(node, query):
+        if isinstance(node, sourmash_lib.sbtmh.SigLeaf):
+            return query_similarity(node.data)
+        return score_minhashes(node, query)
+
     # set up the search databases
+    cache = sourmash_args.make_node_cache(args)
     databases = sourmash_args.load_sbts_and_sigs(args.databases,
-                                                 query_ksize, query_moltype)
+                                                 query_ksize, query_moltype,
+                                                 cache)
 
     if not len(databases):
         error('Nothing found to search!')
@@ -722,14 +1064,25 @@ def search(args):
     results = []
     found_md5 = set()
     for (sbt_or_siglist, filename, is_sbt) in databases:
-        if args.best_only:
-            search_fn = sourmash_lib.sbtmh.SearchMinHashesFindBest().search
-
         if is_sbt:
             tree = sbt_or_siglist
             notify('Searching SBT {}', filename)
-            for leaf in tree.find(search_fn, query, args.threshold):
-                similarity = query_similarity(leaf.data)
+
+            # the bound doesn't hold if the query is downsampled to match
+            # the leaves, which can leave a larger fraction of it in them.
+            prune = prune_top_k and \
+                sourmash_args.get_max_hash(tree) == query.minhash.max_hash
+            if prune:
+                # leaves come out best first; stop after the top k, as
+                # nothing left in the tree can beat them.
+                matches = tree.find_best_first(score_fn, query,
+                                               args.threshold)
+            else:
+                matches = ((leaf, query_similarity(leaf.data)) for leaf in
+                           tree.find(search_fn, query, args.threshold))
+
+            n_found = 0
+            for leaf, similarity in matches:
                 if similarity >= args.threshold and \
                        leaf.data.md5sum() not in found_md5:
                     sr = SearchResult(similarity=similarity,
@@ -740,8 +1093,17 @@ def search(args):
                     found_md5.add(sr.md5)
                     results.append(sr)
 
-        else: # list of signatures
-            for ss in sbt_or_siglist:
+                    n_found += 1
+                    if prune and n_found == top_k:
+                        break
+
+        else: # list or saved index of signatures
+            siglist = sbt_or_siglist
+            if args.threshold > 0 and isinstance(siglist, HashIndex):
+                # anything with no hashes in common has similarity 0.
+                siglist = (ss for ss, _ in siglist.candidates(query))
+
+            for ss in siglist:
                 similarity = query_similarity(ss)
                 if similarity >= args.threshold and \
                        ss.md5sum() not in found_md5:
@@ -753,11 +1115,13 @@ def search(args):
                     found_md5.add(sr.md5)
                     results.append(sr)
 
+    sourmash_args.report_node_cache(cache)
+
     # sort results on similarity (reverse)
     results.sort(key=lambda x: -x.similarity)
 
-    if args.best_only:
-        notify("(truncated search because of --best-only; only trust top result")
+    if top_k:
+        del results[top_k:]
 
     n_matches = len(results)
     if n_matches <= args.num_results:
@@ -801,10 +1165,12 @@ def categorize(args):
     parser.add_argument('-q', '--quiet', action='store_true',
                         help='suppress non-error output')
     parser.add_argument('-k', '--ksize', type=int, default=None)
-    parser.add_argument('--threshold', default=0.08, type=float)
+    parser.add_argument('--threshold', default=0.08, type=float,
+                        help='minimum fraction of the query found in a match; the match with the highest similarity is reported (default: %(default)s)')
     parser.add_argument('--traverse-directory', action="store_true")
 
     sourmash_args.add_moltype_args(parser)
+    sourmash_args.add_cache_arg(parser)
 
     parser.add_argument('--csv', type=argparse.FileType('at'))
     parser.add_argument('--load-csv', default=None)
@@ -820,7 +1186,12 @@ def categorize(args):
             for row in r:
                 already_names.add(row[0])
 
-    tree = sourmash_lib.load_sbt_index(args.sbt_name)
+    cache = sourmash_args.make_node_cache(args)
+    try:
+        tree = sourmash_lib.load_sbt_index(args.sbt_name, cache)
+    except (ValueError, EnvironmentError):
+        # not an SBT - try as a saved hash index
+        tree = HashIndex.load(args.sbt_name)
 
     if args.traverse_directory:
         inp_files = set(sourmash_args.traverse_find_sigs(args.queries))
@@ -834,17 +1205,53 @@ def categorize(args):
     loader = sourmash_args.LoadSingleSignatures(inp_files,
                                                 args.ksize, moltype)
 
+    # load all the queries first, so an SBT is walked once for all of them.
+    queries = []
     for queryfile, query, query_moltype, query_ksize in loader:
         notify('loaded query: {}... (k={}, {})', query.name()[:30],
                query_ksize, query_moltype)
+        queries.append((queryfile, query))
 
-        results = []
-        search_fn = sourmash_lib.sbtmh.SearchMinHashesFindBest().search
+    def is_self(leaf, query):
+        return leaf.data.md5sum() == query.md5sum()
 
+    def find_all(query):
+        # look at everything sharing enough hashes.
+        search_fn = sourmash_lib.sbtmh.search_minhashes
+        results = []
         for leaf in tree.find(search_fn, query, args.threshold):
-            if leaf.data.md5sum() != query.md5sum(): # ignore self.
+            if not is_self(leaf, query):
                 results.append((query.similarity(leaf.data), leaf.data))
+        return results
 
+    # walk an SBT once for all the queries, best similarity first. The
+    # abundance-weighted similarity isn't bounded by the fraction of the
+    # query in a node, so queries tracking abundance look at every match.
+    best_first = []
+    if not isinstance(tree, HashIndex):
+        best_first = [ i for i, (_, query) in enumerate(queries)
+                       if not query.minhash.track_abundance ]
+
+    all_results = [None] * len(queries)
+    if best_first:
+        score_fn = functools.partial(sourmash_lib.sbtmh.score_similarity,
+                                     threshold=args.threshold)
+        best = tree.find_best_many(score_fn,
+                                   [ queries[i][1] for i in best_first ],
+                                   exclude=is_self)
+        for i, match in zip(best_first, best):
+            all_results[i] = []
+            if match:
+                leaf, similarity = match
+                all_results[i].append((similarity, leaf.data))
+
+    for i, (queryfile, query) in enumerate(queries):
+        if all_results[i] is None:
+            all_results[i] = find_all(query)
+
+    sourmash_args.report_node_cache(cache)
+
+    for (queryfile, query), results in zip(queries, all_results):
         best_hit_sim = 0.0
         best_hit_query_name = ""
         if results:
@@ -887,6 +1294,7 @@ def gather(args):
 
     sourmash_args.add_ksize_arg(parser, DEFAULT_LOAD_K)
     sourmash_args.add_moltype_args(parser)
+    sourmash_args.add_cache_arg(parser)
 
     args = parser.parse_args(args)
     set_quiet(args.quiet)
@@ -919,8 +1327,10 @@ def gather(args):
         sys.exit(-1)
 
     # set up the search databases
+    cache = sourmash_args.make_node_cache(args)
     databases = sourmash_args.load_sbts_and_sigs(args.databases,
-                                                 query_ksize, query_moltype)
+                                                 query_ksize, query_moltype,
+                                                 cache)
 
     if not len(databases):
         error('Nothing found to search!')
@@ -932,35 +1342,6 @@ def gather(args):
     # calculate the band size/resolution R for the genome
     R_metagenome = orig_query.minhash.scaled
 
-    # define a function to do a 'best' search and get only top match.
-    def find_best(dblist, query):
-        results = []
-        for (sbt_or_siglist, filename, is_sbt) in dblist:
-            search_fn = sourmash_lib.sbtmh.SearchMinHashesFindBestIgnoreMaxHash().search
-
-            if is_sbt:
-                tree = sbt_or_siglist
-
-                for leaf in tree.find(search_fn, query, 0.0):
-                    leaf_e = leaf.data.minhash
-                    similarity = query.minhash.similarity_ignore_maxhash(leaf_e)
-                    if similarity > 0.0:
-                        results.append((similarity, leaf.data))
-            else:
-                for ss in sbt_or_siglist:
-                    similarity = query.minhash.similarity_ignore_maxhash(ss.minhash)
-                    if similarity > 0.0:
-                        results.append((similarity, ss))
-
-        if not results:
-            return None, None, None
-
-        # take the best result
-        results.sort(key=lambda x: -x[0])   # reverse sort on similarity
-        best_similarity, best_leaf = results[0]
-        return best_similarity, best_leaf, filename
-
-
     # define a function to build new signature object from set of mins
     def build_new_signature(mins, template_sig):
         e = template_sig.minhash.copy_and_clear()
@@ -988,10 +1369,14 @@ def gather(args):
     found = []
     GatherResult = namedtuple('GatherResult',
                                'intersect_bp, f_orig_query, f_match, f_unique_to_query, filename, name, md5, leaf')
+    # the databases are only searched once; each round then just updates
+    # the number of hashes each signature shares with the query.
+    counts = GatherCounts(databases, query)
     while 1:
-        best_similarity, best_leaf, filename = find_best(databases, query)
-        if not best_leaf:          # no matches at all!
+        best = counts.best()
+        if not best:               # no matches at all!
             break
+        _, best_leaf, filename = best
 
         # subtract found hashes from search hashes, construct new search
         query_mins = set(query.minhash.get_hashes())
@@ -1063,7 +1448,11 @@ def gather(args):
 
         # construct a new query, minus the previous one.
         query_mins -= set(found_mins)
+        removed = set(query.minhash.get_hashes()) - query_mins
         query = build_new_signature(query_mins, orig_query)
+        counts.remove(build_new_signature(removed, orig_query))
+
+    sourmash_args.report_node_cache(cache)
 
     # basic reporting
     print_results('\nfound {} matches total;', len(found))
@@ -1109,7 +1498,7 @@ def gather(args):
 
 def watch(args):
     "Build a signature from raw FASTA/FASTQ coming in on stdin, search."
-    from sourmash_lib.sbtmh import search_minhashes, SearchMinHashesFindBest
+    from sourmash_lib.sbtmh import score_similarity
 
     parser = argparse.ArgumentParser()
     parser.add_argument('sbt_name', help='name of SBT to search')
@@ -1168,15 +1557,13 @@ def watch(args):
     notify('Computing signature for k={}, {} from stdin',
            ksize, moltype)
 
-    def do_search():
-        search_fn = SearchMinHashesFindBest().search
-
-        results = []
-        for leaf in tree.find(search_fn, streamsig, args.threshold):
-            results.append((streamsig.similarity(leaf.data),
-                            leaf.data))
+    # leaves come out most similar first; only the best is needed.
+    score_fn = functools.partial(score_similarity, threshold=args.threshold)
 
-        return results
+    def do_search():
+        for leaf, similarity in tree.find_best_first(score_fn, streamsig):
+            return similarity, leaf.data
+        return None
 
     notify('reading sequences from stdin')
     screed_iter = screed.open(args.inp_file)
@@ -1198,12 +1585,11 @@ def watch(args):
         else:
             E.add_sequence(record.sequence, False)
 
-    results = do_search()
-    if not results:
+    result = do_search()
+    if result is None:
         notify('... read {} sequences, no matches found.', n)
     else:
-        results.sort(key=lambda x: -x[0])   # take best
-        similarity, found_sig = results[0]
+        similarity, found_sig = result
         print_results('FOUND: {}, at {:.3f}', found_sig.name(),
                similarity)
 
@@ -0,0 +1,83 @@
+"""
+All-by-all comparison of signatures, for 'sourmash compare'.
+"""
+from __future__ import division
+
+from multiprocessing.pool import ThreadPool
+
+from ._minhash import PairwiseSimilarity
+
+# largest tile of the matrix computed at once; a tile of doubles this size
+# takes 2 MB.
+TILE_SIZE = 512
+
+
+def _tiles(n, tile_size):
+    """Split the upper triangle of an n x n matrix into square tiles.
+
+    Yields (row_start, row_end, col_start, col_end) for tiles on or above
+    the diagonal."""
+    for row_start in range(0, n, tile_size):
+        row_end = min(row_start + tile_size, n)
+        for col_start in range(row_start, n, tile_size):
+            yield row_start, row_end, col_start, min(col_start + tile_size, n)
+
+
+def compare_all_pairs(siglist, D, ignore_abundance=False, processes=1,
+                      progress=None, upper_triangle=False):
+    """Fill in the similarity matrix D for the signatures in 'siglist'.
+
+    Only the upper triangle (and the diagonal) is computed, in tiles that
+    are then written into D and mirrored into the lower triangle, unless
+    'upper_triangle' is set. D can be any 2-d numpy array, including a
+    memory-mapped one. With 'processes' > 1 the tiles are split across a
+    pool of threads; the comparisons run in C++ without the GIL.
+    'progress', if given, is called with the number of cells done and the
+    total number after each tile.
+    """
+    import numpy
+
+    pairwise = PairwiseSimilarity([ s.minhash for s in siglist ],
+                                  ignore_abundance)
+    n = len(pairwise)
+    total = n * (n + 1) // 2
+
+    # enough tiles for every thread to have several to work on.
+    tile_size = min(TILE_SIZE, max(32, -(-n // (4 * processes))))
+
+    def fill(tile):
+        row_start, row_end, col_start, col_end = tile
+        out = numpy.zeros([row_end - row_start, col_end - col_start])
+        pairwise.fill_tile(row_start, row_end, col_start, col_end, out)
+
+        if row_start == col_start:        # on the diagonal
+            if not upper_triangle:
+                out += numpy.triu(out, 1).T
+            cells = out.shape[0] * (out.shape[0] + 1) // 2
+        else:
+            if not upper_triangle:
+                D[col_start:col_end, row_start:row_end] = out.T
+            cells = out.size
+        D[row_start:row_end, col_start:col_end] = out
+
+        return cells
+
+    tiles = list(_tiles(n, tile_size))
+
+    done = 0
+    if processes > 1:
+        pool = ThreadPool(processes)
+        try:
+            for cells in pool.imap_unordered(fill, tiles):
+                done += cells
+                if progress:
+                    progress(done, total)
+        finally:
+            pool.terminate()
+    else:
+        for cells in map(fill, tiles):
+            done += cells
+            if progress:
+                progress(done, total)
+
+    return D
@@ -0,0 +1,110 @@
+"""
+Bookkeeping of query overlaps, for 'sourmash gather'.
+"""
+import heapq
+from collections import defaultdict
+
+from .hashindex import HashIndex
+from .sbtmh import search_minhashes
+
+
+class _LeafSignatures(object):
+    """The signatures of a list of SBT leaves, loaded (through the tree's
+    node cache, if it has one) when asked for."""
+    def __init__(self, leaves):
+        self._leaves = leaves
+
+    def __len__(self):
+        return len(self._leaves)
+
+    def __getitem__(self, idx):
+        return self._leaves[idx].data
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class _QueryIndex(HashIndex):
+    """A HashIndex of 'signatures' restricted to the hashes of a query.
+
+    Only the query's hashes are indexed, by signature position, so this
+    costs one pass over the signatures - about what a linear scan would.
+    The signatures themselves are only looked up when a match needs them;
+    for SBT leaves, that leaves the tree's node cache free to unload them.
+    """
+    def __init__(self, signatures, query):
+        query_hashes = set(query.minhash.get_mins())
+
+        self.signatures = signatures
+        self._hash_to_ids = defaultdict(list)
+        for idx, ss in enumerate(signatures):
+            for h in ss.minhash.get_mins():
+                if h in query_hashes:
+                    self._hash_to_ids[h].append(idx)
+
+    def insert(self, ss):
+        raise TypeError('a query index is read-only')
+
+
+class GatherCounts(object):
+    """The number of hashes each database signature shares with a gather
+    query, kept up to date as hashes are removed from the query.
+
+    'databases' is a list of (SBT, HashIndex or list of signatures,
+    filename, is_sbt) as from sourmash_args.load_sbts_and_sigs. The databases are searched once, when
+    the counts are set up; after that, removing hashes only updates the
+    signatures that share those hashes. Only leaf positions and counts are
+    kept for SBT matches, so an SBT's node cache stays in charge of which
+    leaf signatures are in memory.
+    """
+    def __init__(self, databases, query):
+        self._databases = []
+        self._heap = []
+
+        n_query = len(query.minhash)
+        for db_pos, (sbt_or_siglist, filename, is_sbt) in enumerate(databases):
+            if is_sbt:
+                # only leaves sharing at least one hash can ever match.
+                leaves = sbt_or_siglist.find(search_minhashes, query,
+                                             1.0 / n_query)
+                index = _QueryIndex(_LeafSignatures(leaves), query)
+            elif isinstance(sbt_or_siglist, HashIndex):
+                index = sbt_or_siglist
+            else:
+                index = _QueryIndex(list(sbt_or_siglist), query)
+
+            counts = index.count_overlaps(query)
+            self._databases.append((index, filename, counts))
+            for idx, n in counts.items():
+                self._heap.append((-n, db_pos, idx))
+
+        # largest count first; on ties, the earliest database and signature.
+        heapq.heapify(self._heap)
+
+    def best(self):
+        """Return (n_shared, signature, filename) for the signature sharing
+        the most hashes with the query, or None if none share any."""
+        heap = self._heap
+        while heap:
+            neg_n, db_pos, idx = heap[0]
+            index, filename, counts = self._databases[db_pos]
+            if counts.get(idx) == -neg_n:
+                return -neg_n, index.signatures[idx], filename
+
+            # out of date; the current count is further down the heap.
+            heapq.heappop(heap)
+
+        return None
+
+    def remove(self, removed):
+        """Update the counts for the hashes in the signature 'removed'
+        having been taken out of the query."""
+        for db_pos, (index, _, counts) in enumerate(self._databases):
+            for idx, n in index.count_overlaps(removed).items():
+                count = counts[idx] - n
+                if count > 0:
+                    counts[idx] = count
+                    heapq.heappush(self._heap, (-count, db_pos, idx))
+                else:
+                    del counts[idx]
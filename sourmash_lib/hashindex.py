@@ -0,0 +1,238 @@
+"""
+An inverted index from hashes to the signatures containing them.
+
+Searching a list of signatures compares the query against every one of
+them; with a HashIndex only the signatures sharing at least one hash with
+the query are looked at, and the number of shared hashes is counted while
+walking the query's own hashes.
+
+An index can be saved to disk with HashIndex.save and loaded back with
+HashIndex.load. The saved index keeps the hashes, in sorted order, and
+the signature positions for each hash in flat numpy arrays; these are
+memory-mapped when loading, and the signatures themselves are only
+parsed when a query turns them up.
+"""
+import json
+import os
+from collections import defaultdict
+
+from . import signature_json
+from .signature import load_one_signature
+from .sbtmh import SigLeaf
+
+
+class HashIndex(object):
+    """A collection of signatures indexed by the hashes in their sketches.
+
+    Iterating over the index yields the signatures in insertion order.
+    """
+    def __init__(self, signatures=()):
+        self.signatures = []
+        self._hash_to_ids = defaultdict(list)
+        for ss in signatures:
+            self.insert(ss)
+
+    def insert(self, ss):
+        "Add the signature 'ss' to the index."
+        idx = len(self.signatures)
+        self.signatures.append(ss)
+
+        hash_to_ids = self._hash_to_ids
+        for h in ss.minhash.get_mins():
+            hash_to_ids[h].append(idx)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __iter__(self):
+        return iter(self.signatures)
+
+    def count_overlaps(self, query):
+        """Return a dict mapping the position of each signature that shares
+        hashes with the signature 'query' to the number of hashes shared."""
+        counts = defaultdict(int)
+        hash_to_ids = self._hash_to_ids
+        for h in query.minhash.get_mins():
+            for idx in hash_to_ids.get(h, ()):
+                counts[idx] += 1
+        return counts
+
+    def candidates(self, query):
+        """Yield (signature, n_shared) for each signature sharing at least
+        one hash with 'query', in insertion order.
+
+        Signatures that aren't yielded have nothing in common with the
+        query, so their similarity and containment are both 0.
+        """
+        counts = self.count_overlaps(query)
+        for idx in sorted(counts):
+            yield self.signatures[idx], counts[idx]
+
+    def find(self, search_fn, query, threshold):
+        """Yield a leaf for each signature for which 'search_fn' succeeds,
+        like SBT.find.
+
+        With a positive 'threshold', only the signatures sharing hashes
+        with the query are tried.
+        """
+        if threshold > 0:
+            siglist = (ss for ss, _ in self.candidates(query))
+        else:
+            siglist = self
+
+        for ss in siglist:
+            leaf = SigLeaf(ss.md5sum(), ss)
+            if search_fn(leaf, query, threshold):
+                yield leaf
+
+    def save(self, tag):
+        """Save the index under 'tag'; returns the name of the index file.
+
+        This writes 'tag.hidx.json' and, in the '.hidx.tag' directory next
+        to it, the hash arrays and the signatures.
+        """
+        import numpy
+
+        version = 1
+        basetag = os.path.basename(tag)
+        dirprefix = os.path.dirname(tag)
+        subdir = '.hidx.' + basetag
+        dirname = os.path.join(dirprefix, subdir)
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        info = {}
+        info['version'] = version
+        info['n_signatures'] = len(self)
+        if self.signatures:
+            minhash = self.signatures[0].minhash
+            info['ksize'] = minhash.ksize
+            info['moltype'] = 'protein' if minhash.is_protein else 'DNA'
+
+        # signatures, one JSON document after another; 'sig_offsets' holds
+        # where each one starts (and where the last one ends).
+        sig_offsets = [0]
+        with open(os.path.join(dirname, 'signatures'), 'wb') as fp:
+            for ss in self.signatures:
+                data = signature_json.save_signatures_json([ss], indent=None)
+                fp.write(data.encode('utf-8'))
+                sig_offsets.append(fp.tell())
+
+        # the postings for hashes[i] are postings[offsets[i]:offsets[i+1]].
+        hash_to_ids = self._hash_to_ids
+        hashes = sorted(hash_to_ids)
+        offsets = [0]
+        postings = []
+        for h in hashes:
+            postings.extend(hash_to_ids[h])
+            offsets.append(len(postings))
+
+        arrays = dict(hashes=numpy.array(hashes, dtype=numpy.uint64),
+                      offsets=numpy.array(offsets, dtype=numpy.uint64),
+                      postings=numpy.array(postings, dtype=numpy.uint32),
+                      sig_offsets=numpy.array(sig_offsets,
+                                              dtype=numpy.uint64))
+        for name, array in arrays.items():
+            numpy.save(os.path.join(dirname, name + '.npy'), array)
+        info['dirname'] = subdir
+
+        fn = tag + '.hidx.json'
+        with open(fn, 'w') as fp:
+            json.dump(info, fp)
+
+        return fn
+
+    @classmethod
+    def load(cls, name):
+        """Load an index saved with HashIndex.save; returns a read-only
+        MmapHashIndex."""
+        dirname = os.path.dirname(name)
+        fn = os.path.basename(name)
+        if not fn.endswith('.hidx.json'):
+            fn = fn + '.hidx.json'
+
+        with open(os.path.join(dirname, fn)) as fp:
+            info = json.load(fp)
+
+        if not isinstance(info, dict) or info.get('version') != 1:
+            raise ValueError("'{}' is not a hash index".format(name))
+
+        return MmapHashIndex(info, os.path.join(dirname, info['dirname']))
+
+
+class _SignatureFile(object):
+    "The signatures in a saved HashIndex, parsed when first asked for."
+    def __init__(self, filename, offsets):
+        self._fp = open(filename, 'rb')
+        self._offsets = offsets
+        self._loaded = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        try:
+            return self._loaded[idx]
+        except KeyError:
+            pass
+
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        self._fp.seek(start)
+        ss = load_one_signature(self._fp.read(end - start).decode('utf-8'))
+        self._loaded[idx] = ss
+        return ss
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class MmapHashIndex(HashIndex):
+    """A HashIndex loaded from disk, with its arrays memory-mapped.
+
+    Loading doesn't read the hashes or parse any signatures; the arrays
+    are paged in by the queries. It can't have signatures added; to add
+    more, make a new HashIndex from it.
+    """
+    def __init__(self, info, dirname):
+        import numpy
+
+        def load_array(name):
+            return numpy.load(os.path.join(dirname, name + '.npy'),
+                              mmap_mode='r')
+
+        self.ksize = info.get('ksize')
+        self.moltype = info.get('moltype')
+        self._hashes = load_array('hashes')
+        self._offsets = load_array('offsets')
+        self._postings = load_array('postings')
+        self.signatures = _SignatureFile(os.path.join(dirname, 'signatures'),
+                                         load_array('sig_offsets'))
+
+    def insert(self, ss):
+        raise TypeError('a loaded hash index is read-only')
+
+    def count_overlaps(self, query):
+        import numpy
+
+        hashes = self._hashes
+        query_hashes = numpy.array(query.minhash.get_mins(),
+                                   dtype=numpy.uint64)
+
+        # positions of the query hashes that are in the index.
+        pos = numpy.searchsorted(hashes, query_hashes)
+        found = pos < len(hashes)
+        found[found] = hashes[pos[found]] == query_hashes[found]
+        pos = pos[found]
+
+        # gather all of their postings into one array.
+        starts = self._offsets[pos].astype(numpy.int64)
+        lengths = self._offsets[pos + 1].astype(numpy.int64) - starts
+        skip = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths),
+                            lengths)
+        ids = self._postings[skip + numpy.arange(lengths.sum())]
+
+        counts = numpy.bincount(ids)
+        idx = numpy.flatnonzero(counts)
+        return dict(zip(idx.tolist(), counts[idx].tolist()))
@@ -2,11 +2,15 @@
 #define KMER_MIN_HASH_HH
 
 #include <algorithm>
+#include <cmath>
 #include <set>
 #include <map>
 #include <queue>
 #include <exception>
 #include <string>
+#include <cstring>
+#include <utility>
+#include <vector>
 
 #include "../third-party/smhasher/MurmurHash3.h"
 
@@ -15,14 +19,19 @@
   /*ABCDEFGHIJKLMNOPQRSTUVWXYZ      abcdefghijklmnopqrstuvwxyz    */\
   " TVGH FCD  M KN   YSAABW R       TVGH FCD  M KN   YSAABW R"
 
-uint64_t _hash_murmur(const std::string& kmer,
+uint64_t _hash_murmur(const char * kmer, const unsigned int len,
                       const uint32_t seed) {
     uint64_t out[2];
     out[0] = 0; out[1] = 0;
-    MurmurHash3_x64_128((void *)kmer.c_str(), kmer.size(), seed, &out);
+    MurmurHash3_x64_128((void *)kmer, len, seed, &out);
     return out[0];
 }
 
+uint64_t _hash_murmur(const std::string& kmer,
+                      const uint32_t seed) {
+    return _hash_murmur(kmer.c_str(), kmer.size(), seed);
+}
+
 typedef uint64_t HashIntoType;
 
 typedef std::vector<HashIntoType> CMinHashType;
@@ -43,6 +52,146 @@ protected:
     const std::string _msg;
 };
 
+// 2-bit codes for DNA bases: A=0, C=1, G=2, T=3, anything else is invalid.
+// The codes sort in the same order as the characters, so comparing two
+// encoded k-mers gives the same answer as comparing the strings.
+#define INVALID_BASE 4
+
+struct BaseCodes {
+    uint8_t code[256];
+
+    BaseCodes() {
+        std::fill(code, code + 256, INVALID_BASE);
+        code[(unsigned char)'A'] = 0;
+        code[(unsigned char)'C'] = 1;
+        code[(unsigned char)'G'] = 2;
+        code[(unsigned char)'T'] = 3;
+    }
+};
+
+static const BaseCodes _base_codes;
+
+
+// Amino acid for each codon, indexed by the 2-bit codes of its bases
+// (AAA, AAC, AAG, AAT, ACA, ...).
+static const char _codon_table[] =
+    "KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVV*Y*YSSSS*CWCLFLF";
+
+
+// A DNA sequence prepared for k-mer hashing. The 2-bit code of each base
+// and the reverse complement of the whole sequence are computed once, so
+// that any number of k-mer sizes can be walked over it, and canonical
+// k-mers can be handed out as pointers into either strand without
+// allocating a string per k-mer.
+class DNASequence
+{
+public:
+    const char * fwd;
+    const size_t length;
+    std::string rc;
+    std::vector<uint8_t> codes;
+
+    explicit DNASequence(const char * sequence)
+        : fwd(sequence), length(strlen(sequence)), rc(length, ' '),
+          codes(length) {
+        for (size_t i = 0; i < length; i++) {
+            const unsigned char c = fwd[i];
+            codes[i] = _base_codes.code[c];
+            if (c < sizeof(tbl)) {
+                rc[length - i - 1] = tbl[c];
+            }
+        }
+    }
+
+    // Call fn(kmer) with a pointer to the canonical form of each k-mer,
+    // in sequence order. Validity is tracked as the length of the current
+    // run of valid bases, and for k <= 32 both orientations are kept as
+    // rolling 2-bit encodings so picking the canonical strand is a single
+    // integer comparison.
+    //
+    // K-mers containing non-ACGT characters are skipped if force is
+    // set, otherwise a minhash_exception is thrown.
+    template <typename Fn>
+    void for_each_canonical_kmer(const unsigned int ksize, const bool force,
+                                 Fn fn) const {
+        if (ksize == 0 or length < ksize) {
+            return;
+        }
+
+        const bool rolling = ksize <= 32;
+        const unsigned int shift = 2 * (ksize - 1);
+        const uint64_t mask = ksize < 32 ? (1ULL << (2 * ksize)) - 1 : ~0ULL;
+
+        uint64_t fwd_code = 0, rc_code = 0;
+        size_t valid = 0;
+
+        for (size_t pos = 0; pos < length; pos++) {
+            const uint8_t c = codes[pos];
+
+            if (c == INVALID_BASE) {
+                if (!force) {
+                    // report the same character as a k-mer by k-mer scan
+                    // would: the last one of the first invalid k-mer.
+                    size_t start = pos + 1 < ksize ? 0 : pos + 1 - ksize;
+                    std::string msg = "invalid DNA character in input: ";
+                    msg += fwd[start + ksize - 1];
+                    throw minhash_exception(msg);
+                }
+                valid = 0;
+                continue;
+            }
+
+            valid++;
+            if (rolling) {
+                fwd_code = ((fwd_code << 2) | c) & mask;
+                rc_code = (rc_code >> 2) | ((uint64_t)(3 - c) << shift);
+            }
+
+            if (valid >= ksize) {
+                const size_t start = pos + 1 - ksize;
+                const char * kmer = fwd + start;
+                const char * rc_kmer = rc.data() + (length - start - ksize);
+
+                bool use_fwd;
+                if (rolling) {
+                    use_fwd = fwd_code < rc_code;
+                } else {
+                    use_fwd = memcmp(kmer, rc_kmer, ksize) < 0;
+                }
+
+                fn(use_fwd ? kmer : rc_kmer);
+            }
+        }
+    }
+
+    // Six-frame translation: frames 0-2 of the forward strand, then
+    // frames 0-2 of the reverse complement. Codons containing anything
+    // other than ACGT are dropped.
+    std::vector<std::string> translate() const {
+        std::vector<std::string> frames(6);
+        for (unsigned int i = 0; i < 3; i++) {
+            _translate(fwd, i, frames[i]);
+            _translate(rc.data(), i, frames[i + 3]);
+        }
+        return frames;
+    }
+
+private:
+    void _translate(const char * dna, size_t start, std::string& aa) const {
+        aa.reserve(length / 3);
+        for (size_t j = start; j + 3 <= length; j += 3) {
+            const uint8_t c1 = _base_codes.code[(unsigned char)dna[j]];
+            const uint8_t c2 = _base_codes.code[(unsigned char)dna[j + 1]];
+            const uint8_t c3 = _base_codes.code[(unsigned char)dna[j + 2]];
+            if (c1 != INVALID_BASE and c2 != INVALID_BASE and
+                c3 != INVALID_BASE) {
+                aa += _codon_table[(c1 << 4) | (c2 << 2) | c3];
+            }
+        }
+    }
+};
+
+
 // Looks like a iterator but all it does is counts push_backs
 struct Counter {
   struct value_type {
@@ -53,6 +202,10 @@ struct Counter {
 };
 
 
+// Smallest number of pending hashes that sketches collect before merging
+// them into 'mins'.
+#define MIN_PENDING_HASHES 1024
+
 class KmerMinHash
 {
 public:
@@ -61,7 +214,13 @@ public:
     const bool is_protein;
     const uint32_t seed;
     const HashIntoType max_hash;
-    CMinHashType mins;
+
+    // Sorted hashes in the sketch. New hashes are collected in 'pending'
+    // and only merged into 'mins' by flush(); call it before reading
+    // 'mins' directly. Both are mutable so that const sketches can be
+    // brought up to date.
+    mutable CMinHashType mins;
+    mutable CMinHashType pending;
 
     KmerMinHash(unsigned int n, unsigned int k, bool prot, uint32_t s,
                 HashIntoType mx)
@@ -75,7 +234,7 @@ public:
       }
     };
 
-    void check_compatible(const KmerMinHash& other) {
+    void check_compatible(const KmerMinHash& other) const {
         if (ksize != other.ksize) {
             throw minhash_exception("different ksizes cannot be compared");
         }
@@ -91,28 +250,24 @@ public:
     }
 
     virtual void add_hash(const HashIntoType h) {
-      if ((max_hash and h <= max_hash) or not max_hash) {
-        if (mins.size() == 0) {
-          mins.push_back(h);
-          return;
-        }
-        else if (h <= max_hash or mins.back() > h or mins.size() < num) {
-          auto pos = std::lower_bound(std::begin(mins), std::end(mins), h);
-
-          // must still be growing, we know the list won't get too long
-          if (pos == mins.cend()) {
-            mins.push_back(h);
-          }
-          // inserting somewhere in the middle, if this value isn't already
-          // in mins store it and shrink list if needed
-          else if (*pos != h) {
-            mins.insert(pos, h);
-            if (num and mins.size() > num) {
-              mins.pop_back();
-            }
+      if (num) {
+        // only hashes smaller than the current largest can make the cut;
+        // buffer them, so that each one doesn't cost an O(num) insert.
+        if (mins.size() < num or h < mins.back()) {
+          pending.push_back(h);
+          if (pending.size() >= _max_pending()) {
+            flush();
           }
         }
       }
+      else if (not max_hash or h <= max_hash) {
+        // scaled sketches keep every hash under max_hash, so just append
+        // and leave the sorting to flush().
+        pending.push_back(h);
+        if (pending.size() >= _max_pending()) {
+          flush();
+        }
+      }
     }
     void add_word(const std::string& word) {
         const HashIntoType hash = _hash_murmur(word, seed);
@@ -122,95 +277,95 @@ public:
         if (strlen(sequence) < ksize) {
             return;
         }
-        const std::string seq = sequence;
+        const DNASequence dna(sequence);
         if (!is_protein) {
-            for (unsigned int i = 0; i < seq.length() - ksize + 1; i++) {
-                const std::string kmer = seq.substr(i, ksize);
-                if (! _checkdna(kmer)) {
-                    if (force) {
-                        continue;
-                    } else {
-                        std::string msg = "invalid DNA character in input: ";
-                        msg += seq[i + ksize - 1];
-                        throw minhash_exception(msg);
-                    }
-                }
-
-                const std::string rc = _revcomp(kmer);
-
-                if (kmer < rc) {
-                    add_word(kmer);
-                } else {
-                    add_word(rc);
-                }
+            add_dna(dna, force);
+        } else {
+            add_translated(dna.translate());
+        }
+    }
+    void add_dna(const DNASequence& dna, bool force=false) {
+        dna.for_each_canonical_kmer(ksize, force,
+            [this](const char * kmer) {
+                add_hash(_hash_murmur(kmer, ksize, seed));
+            });
+    }
+    void add_translated(const std::vector<std::string>& frames) {
+        const unsigned int aa_ksize = ksize / 3;
+        for (auto& aa : frames) {
+            if (aa.length() < aa_ksize) {
+                continue;
             }
-        } else {                      // protein
-            std::string rc = _revcomp(seq);
-            for (unsigned int i = 0; i < 3; i++) {
-                std::string aa = _dna_to_aa(seq.substr(i, seq.length() - i));
-                unsigned int aa_ksize = int(ksize / 3);
-                std::string kmer;
-
-                for (unsigned int j = 0; j < aa.length() - aa_ksize + 1; j++) {
-                    kmer = aa.substr(j, aa_ksize);
-                    add_word(kmer);
-                }
-
-                aa = _dna_to_aa(rc.substr(i, rc.length() - i));
-                aa_ksize = int(ksize / 3);
-
-                for (unsigned int j = 0; j < aa.length() - aa_ksize + 1; j++) {
-                    kmer = aa.substr(j, aa_ksize);
-                    add_word(kmer);
-                }
+            for (size_t j = 0; j < aa.length() - aa_ksize + 1; j++) {
+                add_hash(_hash_murmur(aa.data() + j, aa_ksize, seed));
             }
         }
     }
-
-    std::string _dna_to_aa(const std::string& dna) {
-        std::string aa;
-        unsigned int dna_size = (dna.size() / 3) * 3; // floor it
-        for (unsigned int j = 0; j < dna_size; j += 3) {
-            std::string codon = dna.substr(j, 3);
-            aa += (_codon_table)[codon];
+    void add_protein(const char * sequence) {
+        const unsigned int aa_ksize = ksize / 3;
+        const size_t length = strlen(sequence);
+        if (length < aa_ksize) {
+            return;
+        }
+        if (!is_protein) {
+            throw minhash_exception("cannot add amino acid sequence to DNA MinHash!");
+        }
+        for (size_t i = 0; i < length - aa_ksize + 1; i++) {
+            add_hash(_hash_murmur(sequence + i, aa_ksize, seed));
         }
-        return aa;
     }
 
-    bool _checkdna(const std::string seq) const {
-
-        for (size_t i=0; i < seq.length(); ++i) {
-            switch(seq[i]) {
-            case 'A':
-            case 'C':
-            case 'G':
-            case 'T':
-                break;
-            default:
-                return false;
-            }
+    // Batch versions of add_sequence/add_protein; these don't touch any
+    // Python objects, so they can be called with the GIL released.
+    void add_sequences(const std::vector<const char *>& sequences,
+                       bool force=false) {
+        for (auto seq : sequences) {
+            add_sequence(seq, force);
+        }
+    }
+    void add_proteins(const std::vector<const char *>& sequences) {
+        for (auto seq : sequences) {
+            add_protein(seq);
         }
-        return true;
     }
 
-    std::string _revcomp(const std::string& kmer) const {
-        std::string out = kmer;
-
-        auto from = out.begin();
-        auto to = out.end();
+    // Merge any pending hashes into 'mins'.
+    virtual void flush() const {
+        if (pending.empty()) {
+            return;
+        }
+        std::sort(pending.begin(), pending.end());
+        pending.erase(std::unique(pending.begin(), pending.end()),
+                      pending.end());
 
-        char c;
-        for (to--; from <= to; from++, to--) {
-            c = tbl[(int)*from];
-            *from = tbl[(int)*to];
-            *to = c;
+        CMinHashType merged;
+        merged.reserve(mins.size() + pending.size());
+        std::set_union(mins.begin(), mins.end(),
+                       pending.begin(), pending.end(),
+                       std::back_inserter(merged));
+        if (num and merged.size() > num) {
+            merged.resize(num);
         }
+        mins.swap(merged);
+        pending.clear();
+    }
 
-        return out;
+    // Add many hashes at once; they're sorted and merged into 'mins' in
+    // one go, instead of one at a time.
+    void add_many(const CMinHashType& hashes) {
+        pending.reserve(pending.size() + hashes.size());
+        for (auto h : hashes) {
+            if (not max_hash or h <= max_hash) {
+                pending.push_back(h);
+            }
+        }
+        flush();
     }
 
     virtual void merge(const KmerMinHash& other) {
         check_compatible(other);
+        flush();
+        other.flush();
 
         CMinHashType merged;
         merged.reserve(other.mins.size() + mins.size());
@@ -225,8 +380,16 @@ public:
         }
     }
 
-    virtual unsigned int count_common(const KmerMinHash& other) {
+    virtual unsigned int count_common(const KmerMinHash& other) const {
         check_compatible(other);
+        return count_common_hashes(other);
+    }
+
+    // Number of hashes in both sketches, without checking that they are
+    // compatible.
+    size_t count_common_hashes(const KmerMinHash& other) const {
+        flush();
+        other.flush();
 
         Counter counter;
         std::set_intersection(mins.begin(), mins.end(),
@@ -235,134 +398,317 @@ public:
         return counter.count;
     }
 
+    // Jaccard similarity of the two sketches: the fraction of the hashes
+    // in their merged sketch that are in both.
+    double jaccard(const KmerMinHash& other) const {
+        check_compatible(other);
+
+        size_t common = 0;
+        const size_t union_size = _walk_union(other,
+            [&common](HashIntoType) { ++common; });
+        return union_size ? double(common) / union_size : 0.0;
+    }
+
+    // The hashes in the merged sketch of both that are in both; the size
+    // of the merged sketch is stored in 'union_size'.
+    CMinHashType intersection(const KmerMinHash& other,
+                              size_t& union_size) const {
+        check_compatible(other);
+
+        CMinHashType common;
+        union_size = _walk_union(other,
+            [&common](HashIntoType h) { common.push_back(h); });
+        return common;
+    }
+
+    // The hashes in this sketch that are not in 'other'.
+    CMinHashType difference(const KmerMinHash& other) const {
+        flush();
+        other.flush();
+
+        CMinHashType diff;
+        std::set_difference(mins.begin(), mins.end(),
+                            other.mins.begin(), other.mins.end(),
+                            std::back_inserter(diff));
+        return diff;
+    }
+
     virtual size_t size() {
+        flush();
         return mins.size();
     }
 
+    // The ksize and then each hash, in decimal and with no separators;
+    // a signature's md5sum is the md5 of this.
+    std::string md5_input() const {
+        flush();
+        std::string out = std::to_string(ksize);
+        out.reserve(out.size() + 20 * mins.size());
+
+        char buf[20];
+        char * const end = buf + sizeof(buf);
+        for (auto h : mins) {
+            char * p = end;
+            do {
+                *--p = '0' + h % 10;
+                h /= 10;
+            } while (h);
+            out.append(p, end - p);
+        }
+        return out;
+    }
+
     virtual ~KmerMinHash() throw() { }
 
-private:
-    std::map<std::string, std::string> _codon_table = {
-        {"TTT", "F"}, {"TTC", "F"},
-        {"TTA", "L"}, {"TTG", "L"},
+protected:
+    // Walk the hashes of this sketch and 'other' in order, as merging them
+    // would, calling 'on_common' for each hash found in both. For bounded
+    // sketches the walk stops after the 'num' smallest hashes, like the
+    // merge does. Returns the number of hashes walked, i.e. the size of
+    // the merged sketch.
+    template <typename F>
+    size_t _walk_union(const KmerMinHash& other, F on_common) const {
+        flush();
+        other.flush();
+
+        auto it1 = mins.cbegin();
+        auto it2 = other.mins.cbegin();
+        const auto end1 = mins.cend();
+        const auto end2 = other.mins.cend();
+
+        size_t n = 0;
+        for (; (it1 != end1 or it2 != end2) and (!num or n < num); ++n) {
+            if (it2 == end2 or (it1 != end1 and *it1 < *it2)) {
+                ++it1;
+            } else if (it1 == end1 or *it2 < *it1) {
+                ++it2;
+            } else {
+                on_common(*it1);
+                ++it1;
+                ++it2;
+            }
+        }
+        return n;
+    }
 
-        {"TCT", "S"}, {"TCC", "S"}, {"TCA", "S"}, {"TCG", "S"},
+    // Bounded sketches flush every num hashes; unbounded ones once the
+    // buffer is as big as 'mins', so each flush at least doubles the
+    // number of hashes handled and insertion stays amortized O(1).
+    size_t _max_pending() const {
+        return std::max(num ? (size_t)num : mins.size(),
+                        (size_t)MIN_PENDING_HASHES);
+    }
 
-        {"TAT", "Y"}, {"TAC", "Y"},
-        {"TAA", "*"}, {"TAG", "*"},
+};
 
-        {"TGT", "C"}, {"TGC", "C"},
-        {"TGA", "*"},
-        {"TGG", "W"},
+class KmerMinAbundance: public KmerMinHash {
+ public:
+    mutable CMinHashType abunds;
 
-        {"CTT", "L"}, {"CTC", "L"}, {"CTA", "L"}, {"CTG", "L"},
+    // Euclidean norm of 'abunds', or < 0 if it needs to be recomputed.
+    mutable double abunds_norm;
 
-        {"CCT", "P"}, {"CCC", "P"}, {"CCA", "P"}, {"CCG", "P"},
+    KmerMinAbundance(unsigned int n, unsigned int k, bool prot, uint32_t seed,
+                     HashIntoType mx) :
+        KmerMinHash(n, k, prot, seed, mx), abunds_norm(-1.0) { };
 
-        {"CAT", "H"}, {"CAC", "H"},
-        {"CAA", "Q"}, {"CAG", "Q"},
+    virtual void add_hash(HashIntoType h) {
+      if (num) {
+        // as for KmerMinHash, but a hash equal to the largest still
+        // counts towards its abundance.
+        if (mins.size() < num or h <= mins.back()) {
+          pending.push_back(h);
+          if (pending.size() >= _max_pending()) {
+            flush();
+          }
+        }
+      }
+      else if (not max_hash or h <= max_hash) {
+        pending.push_back(h);
+        if (pending.size() >= _max_pending()) {
+          flush();
+        }
+      }
+    }
 
-        {"CGT", "R"}, {"CGC", "R"}, {"CGA", "R"}, {"CGG", "R"},
+    // Merge any pending hashes into 'mins', adding the number of times
+    // each was seen to its abundance.
+    virtual void flush() const {
+        if (pending.empty()) {
+            return;
+        }
+        std::sort(pending.begin(), pending.end());
 
-        {"ATT", "I"}, {"ATC", "I"}, {"ATA", "I"},
-        {"ATG", "M"},
+        CMinHashType merged_mins;
+        CMinHashType merged_abunds;
+        merged_mins.reserve(mins.size() + pending.size());
+        merged_abunds.reserve(mins.size() + pending.size());
+
+        auto it_m = mins.begin();
+        auto it_a = abunds.begin();
+        auto it_p = pending.begin();
+        while (it_p != pending.end()) {
+            const HashIntoType h = *it_p;
+            HashIntoType count = 0;
+            for (; it_p != pending.end() and *it_p == h; ++it_p) {
+                ++count;
+            }
 
-        {"ACT", "T"}, {"ACC", "T"}, {"ACA", "T"}, {"ACG", "T"},
+            for (; it_m != mins.end() and *it_m < h; ++it_m, ++it_a) {
+                merged_mins.push_back(*it_m);
+                merged_abunds.push_back(*it_a);
+            }
+            if (it_m != mins.end() and *it_m == h) {
+                count += *it_a;
+                ++it_m; ++it_a;
+            }
+            merged_mins.push_back(h);
+            merged_abunds.push_back(count);
+        }
+        merged_mins.insert(merged_mins.end(), it_m, mins.end());
+        merged_abunds.insert(merged_abunds.end(), it_a, abunds.end());
 
-        {"AAT", "N"}, {"AAC", "N"},
-        {"AAA", "K"}, {"AAG", "K"},
+        if (num and merged_mins.size() > num) {
+            merged_mins.resize(num);
+            merged_abunds.resize(num);
+        }
+        mins.swap(merged_mins);
+        abunds.swap(merged_abunds);
+        pending.clear();
+        abunds_norm = -1.0;
+    }
 
-        {"AGT", "S"}, {"AGC", "S"},
-        {"AGA", "R"}, {"AGG", "R"},
+    // Add hashes along with their abundances, e.g. when loading a saved
+    // sketch. The hashes don't need to be sorted or distinct.
+    void set_abundances(const CMinHashType& hashes,
+                        const CMinHashType& values) {
+        if (hashes.size() != values.size()) {
+            throw minhash_exception("must have one abundance for each hash");
+        }
+        flush();
 
-        {"GTT", "V"}, {"GTC", "V"}, {"GTA", "V"}, {"GTG", "V"},
+        std::vector<std::pair<HashIntoType, HashIntoType>> items;
+        items.reserve(hashes.size());
+        for (size_t i = 0; i < hashes.size(); i++) {
+            if (not max_hash or hashes[i] <= max_hash) {
+                items.push_back(std::make_pair(hashes[i], values[i]));
+            }
+        }
+        std::sort(items.begin(), items.end());
+
+        CMinHashType new_mins;
+        CMinHashType new_abunds;
+        new_mins.reserve(items.size());
+        new_abunds.reserve(items.size());
+        for (auto& item : items) {
+            if (!new_mins.empty() and new_mins.back() == item.first) {
+                new_abunds.back() += item.second;
+            } else {
+                new_mins.push_back(item.first);
+                new_abunds.push_back(item.second);
+            }
+        }
 
-        {"GCT", "A"}, {"GCC", "A"}, {"GCA", "A"}, {"GCG", "A"},
+        if (mins.empty()) {
+            if (num and new_mins.size() > num) {
+                new_mins.resize(num);
+                new_abunds.resize(num);
+            }
+            mins.swap(new_mins);
+            abunds.swap(new_abunds);
+            abunds_norm = -1.0;
+        } else {
+            _merge(new_mins, new_abunds);
+        }
+    }
 
-        {"GAT", "D"}, {"GAC", "D"},
-        {"GAA", "E"}, {"GAG", "E"},
+    virtual void merge(const KmerMinAbundance& other) {
+        check_compatible(other);
+        flush();
+        other.flush();
 
-        {"GGT", "G"}, {"GGC", "G"}, {"GGA", "G"}, {"GGG", "G"}
-    };
-};
+        _merge(other.mins, other.abunds);
+    }
 
-class KmerMinAbundance: public KmerMinHash {
- public:
-    CMinHashType abunds;
+    // Euclidean norm of the abundances; cached until the sketch changes.
+    double norm() const {
+        flush();
+        if (abunds_norm < 0) {
+            double sum = 0.0;
+            for (auto a : abunds) {
+                sum += double(a) * double(a);
+            }
+            abunds_norm = std::sqrt(sum);
+        }
+        return abunds_norm;
+    }
 
-    KmerMinAbundance(unsigned int n, unsigned int k, bool prot, uint32_t seed,
-                     HashIntoType mx) :
-        KmerMinHash(n, k, prot, seed, mx) { };
+    // Cosine similarity of the abundances in the two sketches, walking
+    // their sorted hashes together.
+    double cosine(const KmerMinAbundance& other) const {
+        check_compatible(other);
 
-    virtual void add_hash(HashIntoType h) {
-      if ((max_hash and h <= max_hash) or not max_hash) {
-        // empty? add it, if within range / no range specified.
-        if (mins.size() == 0) {
-          mins.push_back(h);
-          abunds.push_back(1);
-          return;
-        } else if (h <= max_hash or mins.back() > h or mins.size() < num) {
-          // "good" hash - within range, smaller than current entry, or
-          // still space.
-          auto pos = std::lower_bound(std::begin(mins), std::end(mins), h);
-
-          // at end -- must still be growing, we know the list won't get too
-          // long
-          if (pos == mins.cend()) {
-            mins.push_back(h);
-            abunds.push_back(1);
-          } else if (*pos != h) {
-          // didn't find hash already in mins, so
-          // inserting somewhere in the middle; shrink list if needed.
-
-            // calculate distance for use w/abunds *before* insert, as
-            // 'mins.insert' may invalidate 'pos'.
-            size_t dist = std::distance(begin(mins), pos);
-            mins.insert(pos, h);
-            abunds.insert(begin(abunds) + dist, 1);
-
-            // now too big? if so, continue.
-            if (mins.size() > num and not max_hash) {
-              mins.pop_back();
-              abunds.pop_back();
+        const double norm_a = norm();
+        const double norm_b = other.norm();
+        if (norm_a == 0.0 or norm_b == 0.0) {
+            return 0.0;
+        }
+
+        double prod = 0.0;
+        auto it1_m = mins.cbegin();
+        auto it2_m = other.mins.cbegin();
+        while (it1_m != mins.cend() and it2_m != other.mins.cend()) {
+            if (*it1_m < *it2_m) {
+                ++it1_m;
+            } else if (*it2_m < *it1_m) {
+                ++it2_m;
+            } else {
+                const double a = abunds[it1_m - mins.cbegin()];
+                const double b = other.abunds[it2_m - other.mins.cbegin()];
+                prod += (a / norm_a) * (b / norm_b);
+                ++it1_m;
+                ++it2_m;
             }
-          } else { // *pos == h - hash value already there, increment count.
-            auto p = std::distance(begin(mins), pos);
-            abunds[p] += 1;
-          }
         }
-      }
+        return prod;
     }
 
-    virtual void merge(const KmerMinAbundance& other) {
-        check_compatible(other);
+    virtual size_t size() {
+        flush();
+        return mins.size();
+    }
 
+private:
+    // Merge sorted hashes and their abundances into 'mins' and 'abunds',
+    // adding up the abundances of hashes found in both.
+    void _merge(const CMinHashType& other_mins,
+                const CMinHashType& other_abunds) {
         CMinHashType merged_mins;
         CMinHashType merged_abunds;
-        size_t max_size = other.mins.size() + mins.size();
+        size_t max_size = other_mins.size() + mins.size();
 
         merged_mins.reserve(max_size);
         merged_abunds.reserve(max_size);
 
         auto it1_m = mins.begin();
-        auto it2_m = other.mins.begin();
+        auto it2_m = other_mins.begin();
         auto out_m = std::back_inserter(merged_mins);
 
         auto it1_a = abunds.begin();
-        auto it2_a = other.abunds.begin();
+        auto it2_a = other_abunds.begin();
         auto out_a = std::back_inserter(merged_abunds);
 
         for (; it1_m != mins.end(); ++out_m, ++out_a) {
-            if (it2_m == other.mins.end()) {
-                /* we reached the end of other.mins,
+            if (it2_m == other_mins.end()) {
+                /* we reached the end of other_mins,
                    so just copy the remainder of mins to the output */
                 std::copy(it1_m, mins.end(), out_m);
                 std::copy(it1_a, abunds.end(), out_a);
                 break;
             }
             if (*it2_m < *it1_m) {
-                /* other.mins is smaller than mins,
-                   so copy it to output and advance other.mins iterators */
+                /* other_mins is smaller than mins,
+                   so copy it to output and advance other_mins iterators */
                 *out_m = *it2_m;
                 *out_a = *it2_a;
                 ++it2_m;
@@ -375,7 +721,7 @@ class KmerMinAbundance: public KmerMinHash {
                 ++it1_m; ++it1_a;
                 ++it2_m; ++it2_a;
             } else {
-                /* mins is smaller than other.mins,
+                /* mins is smaller than other_mins,
                    so copy it to output and advance the mins iterators */
                 *out_m = *it1_m;
                 *out_a = *it1_a;
@@ -386,22 +732,70 @@ class KmerMinAbundance: public KmerMinHash {
         /* we reached the end of mins/abunds,
            so just copy the remainder of other to the output
            (other might already be at the end, in this case nothing happens) */
-        std::copy(it2_m, other.mins.end(), out_m);
-        std::copy(it2_a, other.abunds.end(), out_a);
+        std::copy(it2_m, other_mins.end(), out_m);
+        std::copy(it2_a, other_abunds.end(), out_a);
 
-        if (merged_mins.size() < num) {
+        if (merged_mins.size() < num or !num) {
           mins = merged_mins;
           abunds = merged_abunds;
         } else {
           mins = CMinHashType(std::begin(merged_mins), std::begin(merged_mins) + num);
           abunds = CMinHashType(std::begin(merged_abunds), std::begin(merged_abunds) + num);
         }
+        abunds_norm = -1.0;
     }
 
-    virtual size_t size() {
-        return mins.size();
+};
+
+// Add sequences to several sketches (e.g. multiple k-mer sizes, DNA and
+// protein) in one pass: the encoding and reverse complement of each read,
+// and its six-frame translation, are computed once and shared by all of
+// the sketches.
+void add_sequences_to_sketches(const std::vector<KmerMinHash*>& sketches,
+                               const std::vector<const char *>& sequences,
+                               bool force=false) {
+    for (auto sequence : sequences) {
+        const DNASequence dna(sequence);
+        std::vector<std::string> frames;
+
+        for (auto mh : sketches) {
+            if (dna.length < mh->ksize) {
+                continue;
+            }
+            if (!mh->is_protein) {
+                mh->add_dna(dna, force);
+            } else {
+                if (frames.empty()) {
+                    frames = dna.translate();
+                }
+                mh->add_translated(frames);
+            }
+        }
     }
+}
 
-};
+void add_proteins_to_sketches(const std::vector<KmerMinHash*>& sketches,
+                              const std::vector<const char *>& sequences) {
+    for (auto sequence : sequences) {
+        for (auto mh : sketches) {
+            mh->add_protein(sequence);
+        }
+    }
+}
+
+// The similarity used by 'sourmash compare': the angular similarity of the
+// abundances if both sketches track them (and 'ignore_abundance' is not
+// set), otherwise the Jaccard similarity.
+double similarity(const KmerMinHash& a, const KmerMinHash& b,
+                  bool ignore_abundance=false) {
+    auto a_abund = dynamic_cast<const KmerMinAbundance*>(&a);
+    auto b_abund = dynamic_cast<const KmerMinAbundance*>(&b);
+
+    if (a_abund and b_abund and not ignore_abundance) {
+        const double prod = std::min(1.0, a_abund->cosine(*b_abund));
+        return 1.0 - 2 * std::acos(prod) / M_PI;
+    }
+    return a.jaccard(b);
+}
 
 #endif // KMER_MIN_HASH_HH
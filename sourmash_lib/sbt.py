@@ -47,8 +47,9 @@ then define a search function, ::
 
 from __future__ import print_function, unicode_literals, division
 
-from collections import namedtuple, Mapping, defaultdict
+from collections import namedtuple, Mapping, defaultdict, deque, OrderedDict
 from copy import copy
+import heapq
 import json
 import math
 import os
@@ -71,11 +72,24 @@ def GraphFactory(ksize, starting_size, n_tables):
 
 class SBT(object):
 
-    def __init__(self, factory, d=2):
+    def __init__(self, factory, d=2, cache=None):
         self.factory = factory
         self.nodes = defaultdict(lambda: None)
         self.d = d
         self.max_node = 0
+        self.cache = cache
+
+    @property
+    def cache(self):
+        "The NodeCache told about every use of the nodes' data, or None."
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache):
+        self._cache = cache
+        for node in self.nodes.values():
+            if node is not None:
+                node.cache = cache
 
     def new_node_pos(self, node):
         while self.nodes[self.max_node] is not None:
@@ -83,10 +97,12 @@ class SBT(object):
         return self.max_node
 
     def add_node(self, node):
+        node.cache = self._cache
         pos = self.new_node_pos(node)
 
         if pos == 0:  # empty tree; initialize w/node.
             n = Node(self.factory, name="internal." + str(pos))
+            n.cache = self._cache
             self.nodes[0] = n
             pos = self.new_node_pos(node)
 
@@ -103,6 +119,7 @@ class SBT(object):
             # Create a new internal node
             # node and parent are children of new internal node
             n = Node(self.factory, name="internal." + str(p.pos))
+            n.cache = self._cache
             self.nodes[p.pos] = n
 
             c1, c2 = self.children(p.pos)[:2]
@@ -117,6 +134,7 @@ class SBT(object):
             node.update(p.node)
         elif p.node is None:
             n = Node(self.factory, name="internal." + str(p.pos))
+            n.cache = self._cache
             self.nodes[p.pos] = n
             c1 = self.children(p.pos)[0]
             self.nodes[c1.pos] = node
@@ -130,9 +148,9 @@ class SBT(object):
 
     def find(self, search_fn, *args, **kwargs):
         matches = []
-        visited, queue = set(), [0]
+        visited, queue = set(), deque([0])
         while queue:
-            node_p = queue.pop(0)
+            node_p = queue.popleft()
             node_g = self.nodes[node_p]
             if node_g is None:
                 continue
@@ -145,11 +163,85 @@ class SBT(object):
                     elif isinstance(node_g, Node):
                         if kwargs.get('dfs', True):  # defaults search to dfs
                             for c in self.children(node_p):
-                                queue.insert(0, c.pos)
+                                queue.appendleft(c.pos)
                         else: # bfs
                             queue.extend(c.pos for c in self.children(node_p))
         return matches
 
+    def find_best_first(self, score_fn, query, threshold=0.0):
+        """Yield (leaf, score) for the leaves scoring above 0 and at least
+        'threshold', highest score first.
+
+        'score_fn(node, query)' must score each internal node at least as
+        high as any leaf below it, as the fraction of the query found in
+        a node's Bloom filter does. Nodes are then visited highest score
+        first, so the best leaves come out early and the subtrees that
+        can't beat them are never scored.
+        """
+        queue = []
+
+        def push(pos, node):
+            score = score_fn(node, query)
+            if score > 0 and score >= threshold:
+                heapq.heappush(queue, (-score, pos))
+
+        if self.nodes[0] is not None:
+            push(0, self.nodes[0])
+
+        while queue:
+            neg_score, node_p = heapq.heappop(queue)
+            node_g = self.nodes[node_p]
+
+            if isinstance(node_g, Leaf):
+                yield node_g, -neg_score
+            else:
+                for c in self.children(node_p):
+                    if c.node is not None:
+                        push(c.pos, c.node)
+
+    def find_best_many(self, score_fn, queries, threshold=0.0, exclude=None):
+        """For each of 'queries', find the leaf that find_best_first would
+        yield first; returns a list of (leaf, score), or None, per query.
+
+        The tree is walked once for all of the queries. Each node is scored
+        only for the queries still active at its parent, and a query stays
+        active in a subtree only while the node's score could still match
+        the best leaf found for it so far. Leaves for which
+        'exclude(leaf, query)' is true are skipped.
+        """
+        best = [None] * len(queries)        # (score, pos, leaf) per query
+
+        stack = [(0, list(range(len(queries))))]
+        while stack:
+            node_p, active = stack.pop()
+            node_g = self.nodes[node_p]
+            if node_g is None:
+                continue
+
+            still_active = []
+            for i in active:
+                score = score_fn(node_g, queries[i])
+                if score <= 0 or score < threshold:
+                    continue
+                if best[i] is not None and score < best[i][0]:
+                    continue
+
+                if isinstance(node_g, Leaf):
+                    if exclude is not None and exclude(node_g, queries[i]):
+                        continue
+                    # on ties, find_best_first yields the lowest position.
+                    if best[i] is None or score > best[i][0] or \
+                           node_p < best[i][1]:
+                        best[i] = (score, node_p, node_g)
+                else:
+                    still_active.append(i)
+
+            if still_active:
+                for c in self.children(node_p):
+                    stack.append((c.pos, still_active))
+
+        return [ (b[2], b[0]) if b is not None else None for b in best ]
+
     def parent(self, pos):
         if pos == 0:
             return None
@@ -202,7 +294,12 @@ class SBT(object):
         return fn
 
     @classmethod
-    def load(cls, sbt_name, leaf_loader=None):
+    def load(cls, sbt_name, leaf_loader=None, cache=None):
+        """Load the SBT saved under 'sbt_name'.
+
+        The data of the nodes is loaded from disk when first needed; with a
+        NodeCache as 'cache', searches unload it again as the cache fills.
+        """
         dirname = os.path.dirname(sbt_name)
         sbt_name = os.path.basename(sbt_name)
 
@@ -232,7 +329,9 @@ class SBT(object):
         if isinstance(jnodes, Mapping):
             version = jnodes['version']
 
-        return loaders[version](jnodes, leaf_loader, dirname)
+        tree = loaders[version](jnodes, leaf_loader, dirname)
+        tree.cache = cache
+        return tree
 
     @staticmethod
     def _load_v1(jnodes, leaf_loader, dirname):
@@ -370,9 +469,71 @@ class SBT(object):
 
         # TODO: do we want to return a new tree, or merge into this one?
         self.nodes = new_nodes
+        self.cache = self._cache
         return self
 
 
+class NodeCache(object):
+    """A least-recently-used cache for the data of SBT nodes.
+
+    Searching an SBT loads the data of each node it visits from disk, and
+    without a cache keeps it. With one, once more than 'max_nodes' nodes
+    or 'max_bytes' bytes of data are loaded (either can be None, for no
+    limit), the nodes used longest ago are unloaded, to be loaded again
+    if they are needed. 'hits' counts the uses of nodes whose data was
+    already loaded, and 'misses' those that had to load it.
+
+    The nodes of a tree with a cache report every use of their data to it,
+    including those after a search, such as reading the signatures of the
+    leaves it found.
+
+    Only data that can be loaded again from disk is unloaded; nodes made
+    or changed in memory keep theirs.
+    """
+    def __init__(self, max_nodes=None, max_bytes=None):
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.n_bytes = 0
+        self._sizes = OrderedDict()         # node -> size, oldest first
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def touch(self, node):
+        "Note a use of the data of 'node', loading it if need be."
+        if node._data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        size = self._sizes.pop(node, None)
+        if size is None:
+            size = node.data_size()
+            self.n_bytes += size
+        self._sizes[node] = size              # now the most recent.
+
+        self._evict()
+
+    def _evict(self):
+        while len(self._sizes) > 1 and \
+              ((self.max_nodes is not None and
+                len(self._sizes) > self.max_nodes) or
+               (self.max_bytes is not None and
+                self.n_bytes > self.max_bytes)):
+            node, size = self._sizes.popitem(last=False)
+            self.n_bytes -= size
+            node.unload()
+
+    def clear(self):
+        "Unload the data of all the nodes in the cache."
+        for node in self._sizes:
+            node.unload()
+        self._sizes.clear()
+        self.n_bytes = 0
+
+
 class Node(object):
     "Internal node of SBT."
 
@@ -381,6 +542,7 @@ class Node(object):
         self._factory = factory
         self._data = None
         self._filename = fullpath
+        self.cache = None
 
     def __str__(self):
         return '*Node:{name} [occupied: {nb}, fpr: {fpr:.2}]'.format(
@@ -392,6 +554,12 @@ class Node(object):
 
     @property
     def data(self):
+        if self.cache is not None:
+            self.cache.touch(self)
+        return self._load_data()
+
+    def _load_data(self):
+        "Return the data, loading it if need be, without using the cache."
         if self._data is None:
             if self._filename is None:
                 self._data = self._factory()
@@ -402,6 +570,16 @@ class Node(object):
     @data.setter
     def data(self, new_data):
         self._data = new_data
+        self._filename = None           # no longer what's on disk.
+
+    def unload(self):
+        "Drop the data, if it can be loaded from disk again."
+        if self._filename is not None:
+            self._data = None
+
+    def data_size(self):
+        "Return the approximate size of the data in bytes."
+        return sum(self._load_data().hashsizes()) // 8
 
     @staticmethod
     def load(info, dirname):
@@ -411,6 +589,7 @@ class Node(object):
 
     def update(self, parent):
         parent.data.update(self.data)
+        parent._filename = None
 
 
 class Leaf(object):
@@ -421,6 +600,7 @@ class Leaf(object):
         self.name = name
         self._data = data
         self._filename = fullpath
+        self.cache = None
 
     def __str__(self):
         return '**Leaf:{name} [occupied: {nb}, fpr: {fpr:.2}] -> {metadata}'.format(
@@ -430,6 +610,12 @@ class Leaf(object):
 
     @property
     def data(self):
+        if self.cache is not None:
+            self.cache.touch(self)
+        return self._load_data()
+
+    def _load_data(self):
+        "Return the data, loading it if need be, without using the cache."
         if self._data is None:
             # TODO: what if self._filename is None?
             self._data = khmer.load_nodegraph(self._filename)
@@ -438,12 +624,23 @@ class Leaf(object):
     @data.setter
     def data(self, new_data):
         self._data = new_data
+        self._filename = None           # no longer what's on disk.
+
+    def unload(self):
+        "Drop the data, if it can be loaded from disk again."
+        if self._filename is not None:
+            self._data = None
+
+    def data_size(self):
+        "Return the approximate size of the data in bytes."
+        return sum(self._load_data().hashsizes()) // 8
 
     def save(self, filename):
         self.data.save(filename)
 
     def update(self, parent):
         parent.data.update(self.data)
+        parent._filename = None
 
     @classmethod
     def load(cls, info, dirname):
@@ -5,9 +5,9 @@ from .sbt import Leaf, SBT, GraphFactory
 from . import _minhash, MinHash
 
 
-def load_sbt_index(filename):
-    "Load and return an SBT index."
-    return SBT.load(filename, leaf_loader=SigLeaf.load)
+def load_sbt_index(filename, cache=None):
+    "Load and return an SBT index; 'cache' is an optional NodeCache."
+    return SBT.load(filename, leaf_loader=SigLeaf.load, cache=cache)
 
 
 def create_sbt_index(bloom_filter_size=1e5):
@@ -51,18 +51,67 @@ class SigLeaf(Leaf):
     def update(self, parent):
         for v in self.data.minhash.get_mins():
             parent.data.count(v)
+        parent._filename = None
 
-    @property
-    def data(self):
+    def _load_data(self):
         if self._data is None:
             from sourmash_lib import signature
             it = signature.load_signatures(self._filename)
             self._data, = list(it)              # should only be one signature
         return self._data
 
-    @data.setter
-    def data(self, new_data):
-        self._data = new_data
+    def data_size(self):
+        "Return the approximate size of the data in bytes."
+        minhash = self._load_data().minhash
+        if minhash.track_abundance:
+            return 16 * len(minhash)
+        return 8 * len(minhash)
+
+
+def score_minhashes(node, sig, downsample=True):
+    """Return the fraction of the hashes in 'sig' found in 'node'.
+
+    For internal nodes this is at least the score of any leaf below them,
+    as SBT.find_best_first needs.
+    """
+    mins = sig.minhash.get_mins()
+    if not len(mins):
+        return 0.
+
+    if isinstance(node, SigLeaf):
+        try:
+            matches = node.data.minhash.count_common(sig.minhash)
+        except Exception as e:
+            if 'mismatch in max_hash' in str(e) and downsample:
+                xx = sig.minhash.downsample_max_hash(node.data.minhash)
+                yy = node.data.minhash.downsample_max_hash(sig.minhash)
+
+                matches = yy.count_common(xx)
+            else:
+                raise
+
+    else:  # Node or Leaf, Nodegraph by minhash comparison
+        graph = node.data
+        matches = sum(1 for value in mins if graph.get(value))
+
+    return float(matches) / len(mins)
+
+
+def score_similarity(node, sig, threshold=0.0):
+    """Score leaves by their similarity to 'sig', and other nodes by the
+    fraction of the hashes in 'sig' found in them.
+
+    That fraction is at least the Jaccard similarity of any leaf below a
+    node, so SBT.find_best_first yields the most similar leaves first;
+    abundance-weighted similarities aren't bounded by it. Nodes holding
+    less than 'threshold' of 'sig' score 0.
+    """
+    score = score_minhashes(node, sig)
+    if score < threshold:
+        return 0.
+    if isinstance(node, SigLeaf):
+        return sig.similarity(node.data)
+    return score
 
 
 def search_minhashes(node, sig, threshold, results=None, downsample=True):
@@ -81,7 +130,8 @@ def search_minhashes(node, sig, threshold, results=None, downsample=True):
                 raise
 
     else:  # Node or Leaf, Nodegraph by minhash comparison
-        matches = sum(1 for value in mins if node.data.get(value))
+        graph = node.data
+        matches = sum(1 for value in mins if graph.get(value))
 
     if results is not None:
         results[node.name] = float(matches) / len(mins)
@@ -111,7 +161,8 @@ class SearchMinHashesFindBest(object):
                 else:
                     raise
         else:  # Node or Leaf, Nodegraph by minhash comparison
-            matches = sum(1 for value in mins if node.data.get(value))
+            graph = node.data
+        matches = sum(1 for value in mins if graph.get(value))
 
         score = 0
         if len(mins):
@@ -145,7 +196,8 @@ class SearchMinHashesFindBestIgnoreMaxHash(object):
             mh2 = sig.minhash.downsample_scaled(max_scaled)
             matches = mh1.count_common(mh2)
         else:  # Node or Leaf, Nodegraph by minhash comparison
-            matches = sum(1 for value in mins if node.data.get(value))
+            graph = node.data
+        matches = sum(1 for value in mins if graph.get(value))
 
         score = 0
         if not len(mins):
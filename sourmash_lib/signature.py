@@ -4,9 +4,10 @@ Save and load MinHash sketches in a JSON format, along with some metadata.
 """
 from __future__ import print_function
 import sys
-import hashlib
 import sourmash_lib
 from . import signature_json
+from . import signature_binary
+from . import signature_archive
 from .logging import notify, error
 
 import io
@@ -44,11 +45,7 @@ class SourmashSignature(object):
 
     def md5sum(self):
         "Calculate md5 hash of the bottom sketch, specifically."
-        m = hashlib.md5()
-        m.update(str(self.minhash.ksize).encode('ascii'))
-        for k in self.minhash.get_mins():
-            m.update(str(k).encode('utf-8'))
-        return m.hexdigest()
+        return self.minhash.md5sum()
 
     def __eq__(self, other):
         for k in self.d:
@@ -178,6 +175,11 @@ def load_signatures(data, ksize=None, select_moltype=None,
                     ignore_md5sum=False):
     """Load a JSON string with signatures into classes.
 
+    Files, file handles and bytes in the binary format written by
+    save_signatures(..., binary=True) are recognized and loaded too, as
+    are signature archives; for those, only the signatures matching
+    'ksize' and 'select_moltype' are read.
+
     Returns list of SourmashSignature objects.
 
     Note, the order is not necessarily the same as what is in the source file.
@@ -189,7 +191,10 @@ def load_signatures(data, ksize=None, select_moltype=None,
         return
 
     is_fp = False
-    if hasattr(data, 'find') and data.find('sourmash_signature') == -1:   # filename
+    if isinstance(data, bytes) and \
+           data.startswith((signature_binary.MAGIC, signature_archive.MAGIC)):
+        data = io.BytesIO(data)             # as returned by save_signatures
+    elif hasattr(data, 'find') and data.find('sourmash_signature') == -1:   # filename
         try:                                  # is it a file handle?
             data.read
             is_fp = True
@@ -198,9 +203,20 @@ def load_signatures(data, ksize=None, select_moltype=None,
             is_fp = True
 
     try:
-        # JSON format
-        for sig in signature_json.load_signatures_json(data,
-                                                     ignore_md5sum=ignore_md5sum):
+        if hasattr(data, 'read') and \
+               signature_archive.is_signature_archive(data):
+            loader = signature_archive.load_signature_archive
+        elif hasattr(data, 'read') and \
+               signature_binary.is_signature_binary(data):
+            loader = signature_binary.load_signatures_binary
+        else:
+            # JSON format
+            loader = signature_json.load_signatures_json
+
+        # the loaders skip signatures with the wrong ksize/moltype early,
+        # without building their MinHashes.
+        for sig in loader(data, ignore_md5sum=ignore_md5sum, ksize=ksize,
+                          select_moltype=select_moltype):
             if not ksize or ksize == sig.minhash.ksize:
                 if not select_moltype or \
                      sig.minhash.is_molecule_type(select_moltype):
@@ -232,6 +248,14 @@ def load_one_signature(data, ksize=None, select_moltype=None,
     raise ValueError("expected to load exactly one signature")
 
 
-def save_signatures(siglist, fp=None):
-    "Save multiple signatures into a JSON string (or into file handle 'fp')"
+def save_signatures(siglist, fp=None, binary=False, compress=False):
+    """Save multiple signatures into a JSON string (or into file handle 'fp').
+
+    With 'binary', save them in the binary format instead, as bytes (or
+    into the binary file handle 'fp'); 'compress' stores the hashes as
+    varints.
+    """
+    if binary:
+        return signature_binary.save_signatures_binary(siglist, fp,
+                                                       compress=compress)
     return signature_json.save_signatures_json(siglist, fp)
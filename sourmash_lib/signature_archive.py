@@ -0,0 +1,139 @@
+"""
+An archive of many signatures in a single file, with a table of contents.
+
+The file starts with MAGIC, a version number and the size of the table
+of contents, packed as HEADER, followed by the table of contents itself
+as UTF-8 JSON. That is a list with one entry per signature:
+
+    {"name": ..., "filename": ..., "md5sum": ..., "ksize": ...,
+     "moltype": "DNA" or "protein", "num": ..., "scaled": ...,
+     "offset": ..., "size": ...}
+
+The signatures follow, each one in the binary format of signature_binary;
+'offset' counts from the end of the table of contents. Readers can pick
+out the signatures they want from the table of contents and seek straight
+to them, without parsing the others.
+"""
+import io
+import json
+import struct
+
+from . import signature_binary
+from ._minhash import get_scaled_for_max_hash
+
+MAGIC = b'\x89SMARC\r\n'
+
+HEADER = struct.Struct('<IQ')
+VERSION = 1
+
+
+def is_signature_archive(fp):
+    "Check whether the binary file handle 'fp' starts with MAGIC."
+    return signature_binary.is_signature_binary(fp, MAGIC)
+
+
+def _toc_entry(sig):
+    minhash = sig.minhash
+    return dict(name=sig.name(), filename=sig.d.get('filename'),
+                md5sum=sig.md5sum(), ksize=minhash.ksize,
+                moltype='protein' if minhash.is_protein else 'DNA',
+                num=minhash.num,
+                scaled=get_scaled_for_max_hash(minhash.max_hash))
+
+
+def save_signature_archive(siglist, fp=None, compress=False):
+    """Save signatures as an archive to the binary file handle 'fp', or
+    return the archive as bytes.
+
+    With 'compress', the hashes are stored as varints.
+    """
+    toc = []
+    records = []
+    offset = 0
+    for sig in siglist:
+        data = signature_binary.save_signatures_binary([sig],
+                                                       compress=compress)
+        entry = _toc_entry(sig)
+        entry['offset'] = offset
+        entry['size'] = len(data)
+        toc.append(entry)
+        records.append(data)
+        offset += len(data)
+
+    toc = json.dumps(toc, separators=(',', ':')).encode('utf-8')
+
+    out = fp
+    if fp is None:
+        out = io.BytesIO()
+
+    out.write(MAGIC)
+    out.write(HEADER.pack(VERSION, len(toc)))
+    out.write(toc)
+    for data in records:
+        out.write(data)
+
+    if fp is None:
+        return out.getvalue()
+
+
+def _read(fp, n):
+    data = fp.read(n)
+    if len(data) != n:
+        raise ValueError('truncated signature archive')
+    return data
+
+
+def load_archive_toc(fp):
+    """Read the header and table of contents of an archive from the binary
+    file handle 'fp', leaving it at the start of the signatures.
+
+    Returns the list of table of contents entries.
+    """
+    if _read(fp, len(MAGIC)) != MAGIC:
+        raise ValueError('not a signature archive')
+
+    version, toc_size = HEADER.unpack(_read(fp, HEADER.size))
+    if version != VERSION:
+        raise ValueError('unknown signature archive version {}'.format(version))
+
+    return json.loads(_read(fp, toc_size).decode('utf-8'))
+
+
+def select_toc(toc, ksize=None, select_moltype=None):
+    "Return the table of contents entries matching 'ksize' and the moltype."
+    if select_moltype:
+        select_moltype = 'DNA' if select_moltype.upper() == 'DNA' \
+                         else select_moltype
+    return [ entry for entry in toc
+             if (not ksize or entry['ksize'] == ksize) and
+                (not select_moltype or entry['moltype'] == select_moltype) ]
+
+
+def load_signature_archive(fp, ksize=None, select_moltype=None,
+                           ignore_md5sum=False):
+    """Load the signatures matching 'ksize' and 'select_moltype' from the
+    archive in the binary file handle 'fp'.
+
+    Yields SourmashSignature objects; the others are skipped over unparsed.
+    """
+    toc = load_archive_toc(fp)
+    entries = sorted(select_toc(toc, ksize, select_moltype),
+                     key=lambda entry: entry['offset'])
+
+    seekable = hasattr(fp, 'seekable') and fp.seekable()
+    start = fp.tell() if seekable else 0
+
+    pos = 0
+    for entry in entries:
+        if seekable:
+            fp.seek(start + entry['offset'])
+        else:
+            # stream - read our way forward to the signature.
+            while pos < entry['offset']:
+                pos += len(_read(fp, min(entry['offset'] - pos, 1 << 20)))
+        data = _read(fp, entry['size'])
+        pos = entry['offset'] + entry['size']
+
+        for sig in signature_binary.load_signatures_binary(
+                io.BytesIO(data), ignore_md5sum=ignore_md5sum):
+            yield sig
@@ -0,0 +1,170 @@
+"""
+A compact binary format for signatures.
+
+A file starts with MAGIC and is followed by one record per signature:
+
+    a header, packed as HEADER:
+        ksize, num, max_hash, seed, molecule (0 for DNA, 1 for protein),
+        flags (FLAG_ABUNDANCE, FLAG_VARINT), the number of hashes, and the
+        sizes in bytes of the packed hashes and abundances
+    email, name, filename and md5sum, each as a uint32 length and UTF-8
+    the hashes
+    the abundances, for signatures that track them
+
+All numbers are little-endian. The hashes and abundances are 8 bytes
+each, or with FLAG_VARINT variable-length integers: the gaps between the
+sorted hashes, and the abundances themselves.
+"""
+import struct
+
+import sourmash_lib
+from ._minhash import _pack_hashes, _unpack_hashes
+
+MAGIC = b'\x89SMSIG\r\n'
+
+HEADER = struct.Struct('<IIQQBBQQQ')
+LENGTH = struct.Struct('<I')
+
+FLAG_ABUNDANCE = 1
+FLAG_VARINT = 2
+
+
+def is_signature_binary(fp, magic=MAGIC):
+    """Check whether the binary file handle 'fp' starts with 'magic', without
+    moving it; handles that can neither peek nor seek are taken as JSON."""
+    try:
+        if hasattr(fp, 'peek'):
+            start = fp.peek(len(magic))
+        elif hasattr(fp, 'seekable') and fp.seekable():
+            pos = fp.tell()
+            start = fp.read(len(magic))
+            fp.seek(pos)
+        else:
+            return False
+    except (TypeError, ValueError, EnvironmentError):
+        return False
+    return isinstance(start, bytes) and start.startswith(magic)
+
+
+def _read(fp, n):
+    data = fp.read(n)
+    if len(data) != n:
+        raise ValueError('truncated binary signature file')
+    return data
+
+
+def _skip(fp, n):
+    if hasattr(fp, 'seekable') and fp.seekable():
+        fp.seek(n, 1)
+    else:
+        while n:
+            n -= len(_read(fp, min(n, 1 << 20)))
+
+
+def _read_string(fp):
+    n, = LENGTH.unpack(_read(fp, LENGTH.size))
+    return _read(fp, n).decode('utf-8')
+
+
+def _write_string(fp, s):
+    data = (s or '').encode('utf-8')
+    fp.write(LENGTH.pack(len(data)))
+    fp.write(data)
+
+
+def load_signatures_binary(fp, ignore_md5sum=False, ksize=None,
+                           select_moltype=None):
+    """Load signatures from the binary file handle 'fp'.
+
+    Yields SourmashSignature objects; the hashes of signatures not matching
+    'ksize' and 'select_moltype' are skipped over without being read.
+    """
+    from .signature import SourmashSignature
+    from .signature_json import sketch_matches
+
+    if _read(fp, len(MAGIC)) != MAGIC:
+        raise ValueError('not a binary signature file')
+
+    while True:
+        header = fp.read(HEADER.size)
+        if not header:
+            break
+        if len(header) != HEADER.size:
+            raise ValueError('truncated binary signature file')
+
+        (sig_ksize, num, max_hash, seed, molecule, flags, n_hashes,
+         mins_size, abunds_size) = HEADER.unpack(header)
+        email = _read_string(fp)
+        name = _read_string(fp)
+        filename = _read_string(fp)
+        md5sum = _read_string(fp)
+
+        if molecule not in (0, 1):
+            raise ValueError('unknown molecule type: {}'.format(molecule))
+
+        header = dict(ksize=sig_ksize, molecule=('DNA', 'protein')[molecule])
+        if not sketch_matches(header, ksize, select_moltype):
+            _skip(fp, mins_size + abunds_size)
+            continue
+
+        track_abundance = bool(flags & FLAG_ABUNDANCE)
+        varint = bool(flags & FLAG_VARINT)
+
+        mins = _unpack_hashes(_read(fp, mins_size), n_hashes, varint, varint)
+
+        e = sourmash_lib.MinHash(ksize=sig_ksize, n=num,
+                                 is_protein=bool(molecule),
+                                 track_abundance=track_abundance,
+                                 max_hash=max_hash, seed=seed)
+        if track_abundance:
+            abunds = _unpack_hashes(_read(fp, abunds_size), n_hashes, varint)
+            e.set_abundances(mins, abunds)
+        else:
+            e.add_many(mins)
+
+        sig = SourmashSignature(email, e, name=name, filename=filename)
+        if not ignore_md5sum and md5sum != sig.md5sum():
+            raise ValueError('error loading - md5 of minhash does not match')
+
+        yield sig
+
+
+def save_signatures_binary(siglist, fp=None, compress=False):
+    """Save signatures in the binary format to the binary file handle 'fp',
+    or return them as bytes.
+
+    With 'compress', the hashes and abundances are stored as varints.
+    """
+    import io
+
+    out = fp
+    if fp is None:
+        out = io.BytesIO()
+
+    out.write(MAGIC)
+    for sig in siglist:
+        minhash = sig.minhash
+
+        flags = FLAG_VARINT if compress else 0
+        if minhash.track_abundance:
+            flags |= FLAG_ABUNDANCE
+            values = minhash.get_mins(with_abundance=True)
+            mins = sorted(values)
+            abunds = _pack_hashes([ values[h] for h in mins ], compress)
+        else:
+            mins = minhash.get_mins()
+            abunds = b''
+        mins = _pack_hashes(mins, compress, compress)
+
+        out.write(HEADER.pack(minhash.ksize, minhash.num, minhash.max_hash,
+                              minhash.seed, 1 if minhash.is_protein else 0,
+                              flags, len(minhash), len(mins), len(abunds)))
+        _write_string(out, sig.d.get('email'))
+        _write_string(out, sig.d.get('name'))
+        _write_string(out, sig.d.get('filename'))
+        _write_string(out, sig.md5sum())
+        out.write(mins)
+        out.write(abunds)
+
+    if fp is None:
+        return out.getvalue()
@@ -11,9 +11,32 @@ import sourmash_lib
 
 import io
 import json
+from collections import OrderedDict
 import ijson
 from .logging import notify
 
+# files up to this size are decoded in one go with the json module, rather
+# than event by event with ijson.
+JSON_BULK_MAX_SIZE = 32 * 1024 * 1024
+
+
+def _fastest_ijson():
+    """Return the fastest ijson backend available.
+
+    Older ijson versions default to the pure Python backend even when one
+    wrapping the yajl C library can be imported.
+    """
+    import importlib
+    for name in ('yajl2_c', 'yajl2_cffi', 'yajl2'):
+        try:
+            return importlib.import_module('ijson.backends.' + name)
+        except (ImportError, OSError):
+            pass
+    return ijson
+
+ijson = _fastest_ijson()
+
+
 def _json_next_atomic_array(iterable, prefix_item = 'item', ijson = ijson):
     """
     - iterable: iterator as returned by ijson.parse
@@ -32,13 +55,49 @@ def _json_next_atomic_array(iterable, prefix_item = 'item', ijson = ijson):
     return tuple(l)
 
 
+def _json_skip_atomic_array(iterable):
+    """
+    - iterable: iterator as returned by ijson.parse
+
+    Like _json_next_atomic_array, but throw the values away.
+    """
+    prefix, event, value = next(iterable)
+    while event != 'start_array':
+        prefix, event, value = next(iterable)
+    prefix, event, value = next(iterable)
+    while event != 'end_array':
+        prefix, event, value = next(iterable)
+
+
+def sketch_matches(d, ksize=None, select_moltype=None, partial=False):
+    """Check the 'ksize' and 'molecule' of the signature block 'd' against
+    'ksize' and 'select_moltype'; like MinHash.is_molecule_type, 'DNA'
+    matches in any case. Blocks without a 'molecule' are DNA.
+
+    With 'partial', 'd' may still be missing keys; only the keys already
+    in it can make it fail to match.
+    """
+    if ksize and 'ksize' in d and d['ksize'] != ksize:
+        return False
+    if select_moltype:
+        if partial and 'molecule' not in d:
+            return True
+        molecule = d.get('molecule', 'DNA')
+        if select_moltype.upper() == 'DNA':
+            return molecule.upper() == 'DNA'
+        return molecule == select_moltype
+    return True
+
+
 def _json_next_signature(iterable,
                          email = None,
                          name = None,
                          filename = None,
                          ignore_md5sum=False,
                          prefix_item='abundances.item',
-                         ijson = ijson):
+                         ijson = ijson,
+                         ksize=None,
+                         select_moltype=None):
     """Helper function to unpack and check one signature block only.
     - iterable: an iterable such the one returned by ijson.parse()
     - email:
@@ -47,16 +106,26 @@ def _json_next_signature(iterable,
     - ignore_md5sum:
     - prefix_item: required when parsing nested JSON structures
     - ijson: ijson backend to use.
+    - ksize, select_moltype: only build the signature if it matches these
+
+    Returns None for a block not matching 'ksize' and 'select_moltype'; its
+    'mins' and 'abundances' are skipped over without being kept if a
+    mismatching 'ksize' or 'molecule' is seen before them. save_signatures_json
+    writes them last, but in older files with plainly sorted keys
+    'abundances' comes before 'ksize' and 'mins' before 'molecule', and
+    those hashes are kept until the block can be checked.
     """
-    from .signature import SourmashSignature
-
     d = dict()
     prefix, event, value = next(iterable)
     if event == 'start_map':
         prefix, event, value = next(iterable)
     while event != 'end_map':
         key = value
-        if key == 'mins':
+        if key in ('mins', 'abundances') and \
+               not sketch_matches(d, ksize, select_moltype, partial=True):
+            _json_skip_atomic_array(iterable)
+            value = None
+        elif key == 'mins':
             value = _json_next_atomic_array(iterable,
                                             prefix_item=prefix_item, ijson=ijson)
         elif key == 'abundances':
@@ -67,6 +136,24 @@ def _json_next_signature(iterable,
         d[key] = value
         prefix, event, value = next(iterable)
 
+    if not sketch_matches(d, ksize, select_moltype):
+        return None
+
+    return _signature_from_dict(d, email=email, name=name, filename=filename,
+                                ignore_md5sum=ignore_md5sum)
+
+
+def _signature_from_dict(d, email=None, name=None, filename=None,
+                         ignore_md5sum=False):
+    """Build a signature from one decoded signature block 'd'.
+    - d: dict with the 'ksize', 'num', 'mins', etc. of one sketch
+    - email:
+    - name:
+    - filename:
+    - ignore_md5sum:
+    """
+    from .signature import SourmashSignature
+
     ksize = d['ksize']
     mins = d['mins']
     n = d['num']
@@ -92,11 +179,10 @@ def _json_next_signature(iterable,
                                 max_hash=max_hash, seed=seed)
 
     if not track_abundance:
-        for m in mins:
-            e.add_hash(m)
+        e.add_many(mins)
     else:
         abundances = list(map(int, d['abundances']))
-        e.set_abundances(dict(zip(mins, abundances)))
+        e.set_abundances(mins, abundances)
 
     sig = SourmashSignature(email, e)
 
@@ -115,12 +201,15 @@ def _json_next_signature(iterable,
 def load_signature_json(iterable,
                         ignore_md5sum=False,
                         prefix_item='signatures.item.mins.item',
-                        ijson = ijson):
+                        ijson = ijson,
+                        ksize=None,
+                        select_moltype=None):
     """
     - iterable:  an iterable such as the one returned by `ijson.parse()`
     - ignore_md5sum:
     - prefix_item: prefix required to parse nested JSON structures
     - ijson: ijson backend to use
+    - ksize, select_moltype: only keep the signatures matching these
     """
     d = dict()
     prefix, event, value = next(iterable)
@@ -142,8 +231,11 @@ def load_signature_json(iterable,
                                            filename = None,
                                            ignore_md5sum=ignore_md5sum,
                                            prefix_item=prefix_item,
-                                           ijson=ijson)
-                signatures.append(sig)
+                                           ijson=ijson,
+                                           ksize=ksize,
+                                           select_moltype=select_moltype)
+                if sig is not None:
+                    signatures.append(sig)
                 prefix, event, value = next(iterable)
             value = signatures
         else:
@@ -162,12 +254,14 @@ def load_signature_json(iterable,
     return d
 
 
-def load_signatureset_json_iter(data, ksize=None, ignore_md5sum=False, ijson=ijson):
+def load_signatureset_json_iter(data, ksize=None, ignore_md5sum=False, ijson=ijson,
+                                select_moltype=None):
     """
     - data: file handle (or file handle-like) object
     - ksize:
     - ignore_md5sum:
     - ijson: ijson backend
+    - select_moltype:
     """
 
     parser = ijson.parse(data)
@@ -182,9 +276,10 @@ def load_signatureset_json_iter(data, ksize=None, ignore_md5sum=False, ijson=ijs
             sig = load_signature_json(parser,
                                       prefix_item = 'item.signatures.item.mins.item',
                                       ignore_md5sum=ignore_md5sum,
-                                      ijson=ijson)
-            if not ksize or ksize == sig.minhash.ksize:
-                yield sig
+                                      ijson=ijson,
+                                      ksize=ksize,
+                                      select_moltype=select_moltype)
+            yield sig
         except ValueError:
             # possible end of the array of signatures
             prefix, event, value = next(parser)
@@ -192,24 +287,90 @@ def load_signatureset_json_iter(data, ksize=None, ignore_md5sum=False, ijson=ijs
             break
         n += 1
 
-def load_signatures_json(data, ksize=None, ignore_md5sum=True, ijson=ijson):
+def load_signatureset_json_bulk(text, ignore_md5sum=False, ksize=None,
+                                select_moltype=None):
+    """
+    - text: a whole JSON document, as a string or bytes
+    - ignore_md5sum:
+    - ksize, select_moltype: only keep the signatures matching these
+
+    Decode 'text' with the json module and yield each record, like
+    load_signatureset_json_iter.
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+
+    for record in json.loads(text):
+        signatures = []
+        for d in record['signatures']:
+            if not sketch_matches(d, ksize, select_moltype):
+                continue
+            sig = _signature_from_dict(d, ignore_md5sum=ignore_md5sum)
+            sig.d['email'] = record['email']
+            if 'name' in record:
+                sig.d['name'] = record['name']
+            if 'filename' in record:
+                sig.d['filename'] = record['filename']
+            signatures.append(sig)
+
+        record['signatures'] = signatures
+        yield record
+
+
+class _PrefixedReader(object):
+    "A file handle that reads 'prefix' before the rest of 'fp'."
+    def __init__(self, prefix, fp):
+        self.prefix = prefix
+        self.fp = fp
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.fp.read(size)
+        if size is None or size < 0:
+            data = self.prefix + self.fp.read()
+            self.prefix = self.prefix[:0]
+            return data
+
+        data = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        return data
+
+
+def load_signatures_json(data, ksize=None, ignore_md5sum=True, ijson=ijson,
+                         select_moltype=None):
     """
     - data: file handle (or file handle-like) object
     - ksize:
     - ignore_md5sum:
     - ijson: ijson backend
+    - select_moltype:
+
+    Signatures not matching 'ksize' and 'select_moltype' are skipped
+    before their hashes are loaded.
+
+    Documents of up to JSON_BULK_MAX_SIZE are decoded in one go; larger
+    ones are parsed incrementally with ijson.
     """
     n = 0
 
-    if isinstance(data, str):
-        # Required for compatibility with Python 2
+    if not hasattr(data, 'read'):
+        # Required for compatibility with Python 2, where this may be
+        # either a str or a unicode string.
         if sys.version_info[0] < 3:
             data = unicode(data)
         data = io.StringIO(data)
 
-    it = load_signatureset_json_iter(data, ksize=ksize,
-                                     ignore_md5sum=ignore_md5sum,
-                                     ijson=ijson)
+    text = data.read(JSON_BULK_MAX_SIZE + 1)
+    if len(text) <= JSON_BULK_MAX_SIZE:
+        it = load_signatureset_json_bulk(text, ignore_md5sum=ignore_md5sum,
+                                         ksize=ksize,
+                                         select_moltype=select_moltype)
+    else:
+        it = load_signatureset_json_iter(_PrefixedReader(text, data),
+                                         ksize=ksize,
+                                         ignore_md5sum=ignore_md5sum,
+                                         ijson=ijson,
+                                         select_moltype=select_moltype)
 
     for n, sigset in enumerate(it):
         if n > 0 and n % 100 == 0:
@@ -221,12 +382,24 @@ def load_signatures_json(data, ksize=None, ignore_md5sum=True, ijson=ijson):
         notify('\r...sig loading {:,}', n, flush=True)
 
 
+def _sketch_hashes_last(sketch):
+    """Order the keys of the signature block 'sketch' by name, except for
+    'mins' and 'abundances', which go last: _json_next_signature can then
+    check the 'ksize' and 'molecule' before reaching the hashes.
+    """
+    hashes = ('mins', 'abundances')
+    keys = sorted(k for k in sketch if k not in hashes)
+    keys.extend(k for k in hashes if k in sketch)
+    return OrderedDict((k, sketch[k]) for k in keys)
+
+
 def save_signatures_json(siglist, fp=None, indent=4, sort_keys=True):
     """ Save multiple signatures into a JSON string (or into file handle 'fp')
     - siglist: sequence of SourmashSignature objects
     - fp:
     - indent: indentation spaces (an integer) or if None no indentation
-    - sort_keys: sort the keys in mappings before writting to JSON
+    - sort_keys: sort the keys in mappings before writting to JSON, with
+      the hashes of each signature block after its other keys
     """
     from .signature import SIGNATURE_VERSION
 
@@ -256,11 +429,16 @@ def save_signatures_json(siglist, fp=None, indent=4, sort_keys=True):
         record['type'] = 'mrnaseq'
         record['hash_function'] = '0.murmur64'
 
+        if sort_keys:
+            record['signatures'] = [ _sketch_hashes_last(sketch)
+                                     for sketch in sketches ]
+            record = OrderedDict(sorted(record.items()))
+
         records.append(record)
 
     if fp:
-        s = json.dump(records, fp, indent=indent, sort_keys=sort_keys)
+        s = json.dump(records, fp, indent=indent)
     else:
-        s = json.dumps(records, indent=indent, sort_keys=sort_keys)
+        s = json.dumps(records, indent=indent)
 
     return s
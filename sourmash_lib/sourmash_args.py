@@ -7,8 +7,9 @@ from . import signature
 from .logging import notify, error
 
 from . import signature as sig
-from sourmash_lib.sbt import SBT
+from sourmash_lib.sbt import SBT, NodeCache
 from sourmash_lib.sbtmh import SigLeaf
+from sourmash_lib.hashindex import HashIndex
 
 DEFAULT_LOAD_K=31
 
@@ -50,6 +51,34 @@ def add_ksize_arg(parser, default):
                         help='k-mer size (default: {d})'.format(d=default))
 
 
+def add_cache_arg(parser):
+    parser.add_argument('--sbt-cache-size', type=float, default=None,
+                        help='keep at most this many bytes of SBT node data '
+                        'in memory (default: no limit)')
+    parser.add_argument('--sbt-cache-nodes', type=int, default=None,
+                        help='keep the data of at most this many SBT nodes '
+                        'in memory (default: no limit)')
+
+
+def make_node_cache(args):
+    """Return a NodeCache as asked for with --sbt-cache-size and
+    --sbt-cache-nodes, or None."""
+    if args.sbt_cache_size is None and args.sbt_cache_nodes is None:
+        return None
+
+    max_bytes = None
+    if args.sbt_cache_size is not None:
+        max_bytes = int(args.sbt_cache_size)
+    return NodeCache(max_nodes=args.sbt_cache_nodes, max_bytes=max_bytes)
+
+
+def report_node_cache(cache):
+    "Report the hits and misses of a NodeCache from make_node_cache."
+    if cache is not None:
+        notify('SBT node cache: {} hits, {} misses', cache.hits,
+               cache.misses)
+
+
 def get_moltype(sig, require=False):
     if sig.minhash.is_molecule_type('DNA'):
         moltype = 'DNA'
@@ -160,13 +189,21 @@ def get_ksize(tree):
             return node.data.minhash.ksize
 
 
-def load_sbts_and_sigs(filenames, query_ksize, query_moltype):
+def get_max_hash(tree):
+    """Walk nodes in `tree` to find out max_hash"""
+    for node in tree.nodes.values():
+        if isinstance(node, SigLeaf):
+            return node.data.minhash.max_hash
+
+
+def load_sbts_and_sigs(filenames, query_ksize, query_moltype, cache=None):
     n_signatures = 0
     n_databases = 0
     databases = []
     for sbt_or_sigfile in filenames:
         try:
-            tree = SBT.load(sbt_or_sigfile, leaf_loader=SigLeaf.load)
+            tree = SBT.load(sbt_or_sigfile, leaf_loader=SigLeaf.load,
+                            cache=cache)
             ksize = get_ksize(tree)
             if ksize != query_ksize:
                 error("ksize on tree '{}' is {};", sbt_or_sigfile, ksize)
@@ -177,14 +214,33 @@ def load_sbts_and_sigs(filenames, query_ksize, query_moltype):
             notify('loaded SBT {}', sbt_or_sigfile, end='\r')
             n_databases += 1
         except (ValueError, EnvironmentError):
-            # not an SBT - try as a .sig
+            # not an SBT - try as a saved hash index
+            try:
+                index = HashIndex.load(sbt_or_sigfile)
+            except (ValueError, EnvironmentError):
+                index = None
+
+            if index is not None:
+                if index.ksize != query_ksize or \
+                       index.moltype != query_moltype:
+                    error("hash index '{}' is k={}, {};", sbt_or_sigfile,
+                          index.ksize, index.moltype)
+                    error('this is different from query k={}, {}.',
+                          query_ksize, query_moltype)
+                    sys.exit(-1)
+
+                databases.append((index, sbt_or_sigfile, False))
+                notify('loaded hash index {}', sbt_or_sigfile, end='\r')
+                n_databases += 1
+                continue
 
+            # not an index either - try as a .sig
             try:
                 siglist = sig.load_signatures(sbt_or_sigfile,
                                               ksize=query_ksize,
                                               select_moltype=query_moltype)
                 siglist = list(siglist)
-                databases.append((list(siglist), sbt_or_sigfile, False))
+                databases.append((siglist, sbt_or_sigfile, False))
                 notify('loaded {} signatures from {}', len(siglist),
                        sbt_or_sigfile, end='\r')
                 n_signatures += len(siglist)
@@ -6,6 +6,7 @@ import os
 import tempfile
 import shutil
 import subprocess
+from glob import glob
 
 import pkg_resources
 from pkg_resources import Requirement, resource_filename, ResolutionError
@@ -136,6 +137,42 @@ def get_test_data(filename):
     return filepath
 
 
+def load_gather_sigs(ksize=None):
+    "Load the signatures in test-data/gather/GCF*.sig, in filename order."
+    from sourmash_lib import signature
+
+    sigs = []
+    for filename in sorted(glob(get_test_data('gather/GCF*.sig'))):
+        sigs.extend(signature.load_signatures(filename, ksize=ksize))
+    return sigs
+
+
+def make_signature(name, hashes, ksize=21, scaled=1):
+    "Build a scaled signature named 'name' that holds exactly 'hashes'."
+    from sourmash_lib import MinHash, signature
+
+    mh = MinHash(n=0, ksize=ksize, scaled=scaled)
+    mh.add_many(hashes)
+    return signature.SourmashSignature('', mh, name=name)
+
+
+def save_signature(location, ss, filename=None):
+    "Save 'ss' into 'location' as 'filename' (default <name>.sig)."
+    from sourmash_lib import signature
+
+    filename = filename or ss.name() + '.sig'
+    with open(os.path.join(location, filename), 'wb') as fp:
+        fp.write(signature.save_signatures([ss]).encode('utf-8'))
+    return filename
+
+
+def index_signatures(location, siglist, sbt_name='zzz', ksize=21):
+    "Save each signature in 'siglist' and index them, in order, as 'sbt_name'."
+    filenames = [ save_signature(location, ss) for ss in siglist ]
+    args = ['index', sbt_name, '-k', str(ksize)] + filenames
+    return runscript('sourmash', args, in_directory=location)
+
+
 class TempDirectory(object):
     def __init__(self):
         self.tempdir = tempfile.mkdtemp(prefix='sourmashtest_')
@@ -40,7 +40,8 @@ import pickle
 
 import pytest
 
-from sourmash_lib._minhash import (MinHash, hash_murmur, dotproduct,
+from sourmash_lib._minhash import (MinHash, MinHashGroup, hash_murmur,
+                                   dotproduct,
                                    get_scaled_for_max_hash,
                                    get_max_hash_for_scaled)
 import math
@@ -111,6 +112,115 @@ def test_protein_short(track_abundance):
     assert len(mh.get_mins()) == 0, mh.get_mins()
 
 
+def test_add_sequences(track_abundance):
+    # batch add_sequences must give the same sketch as one at a time
+    seqs = ['TGCCGCCCAGCACCGGGTGACTAGGTTGAGCCATGATTAACCTGCAATGA',
+            'GGTTGAGCCATGATTAACCTGCAATGA', 'ATG',
+            b'ACTAGGTTGAGCCATGATTAACCTGCAATGATGCCGCCCAGCACCGG']
+
+    for is_protein in (False, True):
+        a = MinHash(20, 9, is_protein, track_abundance=track_abundance)
+        b = MinHash(20, 9, is_protein, track_abundance=track_abundance)
+        for seq in seqs:
+            a.add_sequence(seq)
+        b.add_sequences(seqs)
+
+        assert len(a.get_mins()) > 0
+        assert a.get_mins(with_abundance=True) == \
+            b.get_mins(with_abundance=True)
+
+
+def test_add_sequences_bad(track_abundance):
+    mh = MinHash(20, 4, track_abundance=track_abundance)
+
+    with pytest.raises(ValueError) as e:
+        mh.add_sequences(['ATGC', 'ATGR'])
+
+    assert 'invalid DNA character in input: R' in str(e)
+
+    mh.add_sequences(['ATGC', 'ATGR', 'AATGN'], force=True)
+    assert len(mh.get_mins()) == 2
+
+
+def test_add_proteins(track_abundance):
+    a = MinHash(10, 6, True, track_abundance=track_abundance)
+    b = MinHash(10, 6, True, track_abundance=track_abundance)
+    a.add_protein('AGYYG')
+    a.add_protein('AG')
+    b.add_proteins(['AGYYG', u'AG'])
+
+    assert len(b.get_mins()) == 4
+    assert a.get_mins() == b.get_mins()
+
+    with pytest.raises(ValueError):
+        MinHash(10, 6, track_abundance=track_abundance).add_proteins(['YYYY'])
+
+
+def test_minhash_group(track_abundance):
+    # sketching through a group must match sketching each one separately
+    seqs = ['TGCCGCCCAGCACCGGGTGACTAGGTTGAGCCATGATTAACCTGCAATGA',
+            'GGTTGAGCCATGATTAACCTGCAATGA', 'ATGNNNATG',
+            'ACTAGGTTGAGCCATGATTAACCTGCAATGATGCCGCCCAGCACCGG']
+
+    def make_minhashes():
+        return [ MinHash(0, k, is_protein, track_abundance=track_abundance,
+                         scaled=1)
+                 for k in (9, 21, 33) for is_protein in (False, True) ]
+
+    group = MinHashGroup(make_minhashes())
+    group.add_sequences(seqs[:2], force=True)
+    group.add_sequence(seqs[2], force=True)
+    group.add_sequence(seqs[3], force=True)
+
+    expected = make_minhashes()
+    for mh in expected:
+        for seq in seqs:
+            mh.add_sequence(seq, True)
+
+    for mh, mh2 in zip(group.minhashes, expected):
+        assert len(mh) > 0
+        assert mh.get_mins(with_abundance=True) == \
+            mh2.get_mins(with_abundance=True)
+
+
+def test_minhash_group_proteins(track_abundance):
+    group = MinHashGroup([ MinHash(0, k, True, scaled=1,
+                                   track_abundance=track_abundance)
+                           for k in (6, 9) ])
+    group.add_proteins(['AGYYG', 'MMMMMW'])
+
+    for mh in group.minhashes:
+        expected = MinHash(0, mh.ksize, True, scaled=1,
+                           track_abundance=track_abundance)
+        expected.add_protein('AGYYG')
+        expected.add_protein('MMMMMW')
+        assert mh.get_mins() == expected.get_mins()
+
+    with pytest.raises(ValueError):
+        MinHashGroup([ MinHash(10, 6) ]).add_protein('YYYY')
+
+
+def test_add_sequences_threads(track_abundance):
+    # add_sequences releases the GIL; one sketch per thread is safe.
+    import threading
+
+    seqs = ['TGCCGCCCAGCACCGGGTGACTAGGTTGAGCCATGATTAACCTGCAATGA'] * 100
+    sketches = [ MinHash(0, k, track_abundance=track_abundance, scaled=1)
+                 for k in (11, 21, 31) ]
+    threads = [ threading.Thread(target=mh.add_sequences, args=(seqs,))
+                for mh in sketches ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for mh in sketches:
+        expected = MinHash(0, mh.ksize, track_abundance=track_abundance,
+                           scaled=1)
+        expected.add_sequence(seqs[0])
+        assert mh.get_mins() == expected.get_mins()
+
+
 def test_size_limit(track_abundance):
     # test behavior with size limit of 3
     mh = MinHash(3, 4, track_abundance=track_abundance)
@@ -215,6 +325,31 @@ def test_basic_dna_bad_force_2(track_abundance):
     assert len(mh.get_mins()) == 2       # (only 2 hashes should be there)
 
 
+def _revcomp(seq):
+    return seq[::-1].translate({ord('A'): 'T', ord('C'): 'G',
+                                ord('G'): 'C', ord('T'): 'A'})
+
+
+@pytest.mark.parametrize('ksize', [1, 4, 21, 31, 32, 33, 51])
+def test_add_sequence_matches_hash_murmur(ksize, track_abundance):
+    # canonical k-mers must hash exactly as hashing the k-mer strings would,
+    # including across the 32-mer boundary of the 2-bit encoding.
+    seq = 'TGCCGCCCAGCACCGGGTGACTAGGTTGAGCCATGATTAACCTGCAATGAN' * 3
+    seq += 'GGTTGAGCCATGATTAACCTGCAATGATGCCGCCCAGCACCGGGTGACTA'
+
+    mh = MinHash(0, ksize, track_abundance=track_abundance, scaled=1)
+    mh.add_sequence(seq, force=True)
+
+    expected = set()
+    for i in range(len(seq) - ksize + 1):
+        kmer = seq[i:i + ksize]
+        if 'N' in kmer:
+            continue
+        expected.add(hash_murmur(min(kmer, _revcomp(kmer))))
+
+    assert set(mh.get_mins()) == expected
+
+
 def test_compare_1(track_abundance):
     a = MinHash(20, 10, track_abundance=track_abundance)
     b = MinHash(20, 10, track_abundance=track_abundance)
@@ -407,6 +542,206 @@ def test_mh_asymmetric(track_abundance):
     assert b.compare(a) == 0.5
 
 
+@pytest.mark.parametrize('num', [1, 10, 2000])
+def test_add_hash_bounded_many(num):
+    # enough hashes (with repeats) to go through several flushes of the
+    # pending buffer; compare against the num smallest distinct hashes.
+    import random
+    rng = random.Random(num)
+    hashes = [ rng.randint(1, 2**64 - 1) for _ in range(5000) ]
+    hashes += rng.sample(hashes, 3000)
+
+    a = MinHash(num, 4)
+    b = MinHash(num, 4, track_abundance=True)
+    for h in hashes:
+        a.add_hash(h)
+        b.add_hash(h)
+
+    expected = sorted(set(hashes))[:num]
+    assert a.get_mins() == expected
+    assert b.get_mins() == expected
+    assert len(a) == num
+
+    abunds = b.get_mins(with_abundance=True)
+    for h in expected:
+        assert abunds[h] == hashes.count(h)
+
+
+def test_add_hash_scaled_many():
+    # scaled sketches keep every hash <= max_hash, with their abundances.
+    import random
+    rng = random.Random(1)
+    max_hash = 2**62
+    hashes = [ rng.randint(1, 2**64 - 1) for _ in range(20000) ]
+    hashes += rng.sample(hashes, 5000)
+
+    a = MinHash(0, 4, max_hash=max_hash)
+    b = MinHash(0, 4, max_hash=max_hash, track_abundance=True)
+    for h in hashes:
+        a.add_hash(h)
+        b.add_hash(h)
+
+    expected = sorted(set([ h for h in hashes if h <= max_hash ]))
+    assert a.get_mins() == expected
+    assert b.get_mins() == expected
+    assert len(b) == len(expected)
+
+    abunds = b.get_mins(with_abundance=True)
+    counts = {}
+    for h in hashes:
+        counts[h] = counts.get(h, 0) + 1
+    assert abunds == dict((h, counts[h]) for h in expected)
+
+
+def test_add_hash_bounded_abundance_of_largest():
+    # repeats of the largest hash in a full sketch still count.
+    a = MinHash(2, 4, track_abundance=True)
+    for h in (5, 10, 10, 20, 10, 5):
+        a.add_hash(h)
+
+    assert a.get_mins(with_abundance=True) == {5: 2, 10: 3}
+
+
+def test_get_mins_array(track_abundance):
+    numpy = pytest.importorskip('numpy')
+
+    a = MinHash(20, 10, track_abundance=track_abundance)
+    for i in range(0, 40, 2):
+        a.add_hash(i)
+    a.add_hash(4)
+
+    mins = a.get_mins_array()
+    assert mins.dtype == numpy.uint64
+    assert list(mins) == a.get_mins()
+    assert not mins.flags.writeable
+
+    if track_abundance:
+        abunds = a.get_abunds_array()
+        assert list(abunds[:4]) == [1, 1, 2, 1]
+    else:
+        with pytest.raises(RuntimeError):
+            a.get_abunds_array()
+
+
+def test_get_mins_array_blocks_changes():
+    a = MinHash(20, 10)
+    a.add_hash(5)
+
+    mins = a.get_mins_array()
+    with pytest.raises(BufferError):
+        a.add_hash(6)
+    with pytest.raises(BufferError):
+        a.add_sequence('ATGCATGCATGC')
+    with pytest.raises(BufferError):
+        a.merge(MinHash(20, 10))
+
+    # reading (and merging into other sketches) is fine.
+    b = MinHash(20, 10)
+    b.merge(a)
+    assert b.get_mins() == [5]
+
+    del mins
+    a.add_hash(6)
+    assert a.get_mins() == [5, 6]
+
+
+def test_add_many_array(track_abundance):
+    pytest.importorskip('numpy')
+
+    a = MinHash(20, 10, track_abundance=track_abundance)
+    for i in range(0, 40, 3):
+        a.add_hash(i)
+
+    b = MinHash(20, 10, track_abundance=track_abundance)
+    b.add_many(a.get_mins_array())
+    assert b.get_mins() == a.get_mins()
+
+
+def test_set_abundances_arrays():
+    numpy = pytest.importorskip('numpy')
+
+    a = MinHash(3, 10, track_abundance=True)
+    hashes = numpy.array([9, 5, 5, 1, 9, 12], dtype=numpy.uint64)
+    abunds = numpy.array([1, 2, 3, 4, 5, 6], dtype=numpy.uint64)
+    a.set_abundances(hashes, abunds)
+    assert a.get_mins(with_abundance=True) == {1: 4, 5: 5, 9: 6}
+
+    b = MinHash(3, 10, track_abundance=True)
+    b.set_abundances(a.get_mins_array(), a.get_abunds_array())
+    assert b.get_mins(with_abundance=True) == {1: 4, 5: 5, 9: 6}
+
+    c = MinHash(3, 10, track_abundance=True)
+    c.set_abundances([9, 5, 1], [1, 2, 3])
+    assert c.get_mins(with_abundance=True) == {1: 3, 5: 2, 9: 1}
+
+    with pytest.raises(ValueError):
+        c.set_abundances([1, 2], [1])
+
+
+def test_set_abundances_merges_existing():
+    a = MinHash(0, 10, track_abundance=True, max_hash=100)
+    a.add_hash(5)
+    a.add_hash(10)
+    a.set_abundances({10: 2, 50: 3, 500: 1})
+
+    assert a.get_mins(with_abundance=True) == {5: 1, 10: 3, 50: 3}
+
+
+def test_downsample_keeps_abundances():
+    a = MinHash(0, 10, track_abundance=True, max_hash=2**63)
+    a.set_abundances({1: 5, 2: 1, 2**62 + 1000: 3, 2**63 - 1: 2, 2**63: 7})
+
+    b = a.downsample_scaled(4)
+    assert b.get_mins(with_abundance=True) == {1: 5, 2: 1}
+
+    c = MinHash(2, 10, track_abundance=True)
+    c.set_abundances({9: 1, 1: 5, 2: 1})
+    d = c.downsample_n(1)
+    assert d.get_mins(with_abundance=True) == {1: 5}
+
+
+@pytest.mark.parametrize('num,max_hash', [(0, 2**63), (20, 0), (500, 0)])
+def test_set_operations_match_sets(track_abundance, num, max_hash):
+    # the merge-walk implementations should give the same answers as
+    # working with Python sets of the hashes.
+    import random
+    rng = random.Random(num)
+    shared = [ rng.randint(1, 2**64 - 1) for _ in range(200) ]
+
+    a = MinHash(num, 10, track_abundance=track_abundance, max_hash=max_hash)
+    b = MinHash(num, 10, track_abundance=track_abundance, max_hash=max_hash)
+    for h in shared + [ rng.randint(1, 2**64 - 1) for _ in range(300) ]:
+        a.add_hash(h)
+    for h in shared + [ rng.randint(1, 2**64 - 1) for _ in range(100) ]:
+        b.add_hash(h)
+
+    mins_a = set(a.get_mins())
+    mins_b = set(b.get_mins())
+    merged = set(a.get_mins() + b.get_mins())
+    if num:
+        merged = set(sorted(merged)[:num])
+    common = mins_a & mins_b & merged
+
+    assert a.intersection(b) == (common, len(merged))
+    assert a.compare(b) == float(len(common)) / len(merged)
+    assert a.jaccard(b) == b.jaccard(a)
+    assert a.count_common(b) == len(mins_a & mins_b)
+    assert a.contained_by(b) == float(len(mins_a & mins_b)) / len(mins_a)
+    assert a.similarity_ignore_maxhash(b) == \
+        float(len(mins_a & mins_b)) / len(mins_a)
+    assert a.subtract_mins(b) == mins_a - mins_b
+    assert b.subtract_mins(a) == mins_b - mins_a
+
+
+def test_set_operations_empty():
+    a = MinHash(20, 10)
+    b = MinHash(20, 10)
+    assert a.compare(b) == 0.0
+    assert a.intersection(b) == (set(), 1)
+    assert a.similarity_ignore_maxhash(b) == 0.0
+    assert a.subtract_mins(b) == set()
+
+
 def test_mh_merge(track_abundance):
     # test merging two identically configured minhashes
     a = MinHash(20, 10, track_abundance=track_abundance)
@@ -786,6 +1121,43 @@ def test_dotproduct_1():
     assert dotproduct(a, e, normalize=True) == 0.0
 
 
+def test_similarity_matches_dotproduct():
+    import random
+    rng = random.Random(5)
+
+    a = MinHash(0, 10, track_abundance=True, max_hash=2**63)
+    b = MinHash(0, 10, track_abundance=True, max_hash=2**63)
+    for i in range(2000):
+        a.add_hash(rng.randint(1, 2**63) // 1000)
+        b.add_hash(rng.randint(1, 2**63) // 1000)
+
+    def angular(a, b):
+        prod = dotproduct(a.get_mins(with_abundance=True),
+                          b.get_mins(with_abundance=True))
+        return 1.0 - 2 * math.acos(min(1.0, prod)) / math.pi
+
+    assert round(a.similarity(b), 10) == round(angular(a, b), 10)
+    assert round(a.similarity(a), 10) == round(angular(a, a), 10)
+
+    # the cached norm is updated when the sketch changes.
+    for h in b.get_mins()[:100]:
+        a.add_hash(h)
+    assert round(a.similarity(b), 10) == round(angular(a, b), 10)
+
+    a.merge(b)
+    assert round(a.similarity(b), 10) == round(angular(a, b), 10)
+
+
+def test_similarity_incompatible():
+    a = MinHash(20, 10, track_abundance=True)
+    b = MinHash(20, 11, track_abundance=True)
+    a.add_hash(1)
+    b.add_hash(1)
+
+    with pytest.raises(ValueError):
+        a.similarity(b)
+
+
 def test_dotproduct_zeroes():
     a = {'x': 1}
     b = {}
@@ -916,6 +1288,26 @@ def test_minhash_abund_capacity_increase():
         a.add_hash(i)
 
 
+def test_minhash_abund_merge_scaled():
+    # merging scaled sketches with abundance should keep all hashes
+    # and sum the abundances.
+    a = MinHash(0, 10, track_abundance=True, max_hash=5000)
+    b = MinHash(0, 10, track_abundance=True, max_hash=5000)
+
+    for i in range(0, 10, 2):
+        a.add_hash(i)
+
+    for j in range(0, 10, 3):
+        b.add_hash(j)
+
+    a.merge(b)
+    abunds = a.get_mins(with_abundance=True)
+    assert sorted(abunds) == [0, 2, 3, 4, 6, 8, 9]
+    assert abunds[0] == 2
+    assert abunds[6] == 2
+    assert abunds[3] == 1
+
+
 def test_minhash_abund_merge_flat():
     # this targets a segfault caused by trying to compute similarity
     # of a signature with abundance and a signature without abundance.
@@ -949,3 +1341,46 @@ def test_minhash_abund_merge_flat_2():
         b.add_hash(i)
 
     a.merge(b)
+
+
+def _slow_md5sum(mh):
+    import hashlib
+    m = hashlib.md5()
+    m.update(str(mh.ksize).encode('ascii'))
+    for k in mh.get_mins():
+        m.update(str(k).encode('utf-8'))
+    return m.hexdigest()
+
+
+def test_md5sum(track_abundance):
+    a = MinHash(0, 21, track_abundance=track_abundance, scaled=1)
+    assert a.md5sum() == _slow_md5sum(a)
+
+    a.add_many([0, 9, 10, 2**63, 2**64 - 1])
+    assert a.md5sum() == _slow_md5sum(a)
+
+    a.add_sequence('ATGGCAGTGACGATGCCAG')
+    assert a.md5sum() == _slow_md5sum(a)
+
+
+def test_md5sum_changes_with_sketch(track_abundance):
+    a = MinHash(20, 10, track_abundance=track_abundance)
+    a.add_sequence('TGCCGCCCAGCACCGGGTGACTAGGTTGAGCCATGATTAACCTGCAATGA')
+    before = a.md5sum()
+
+    a.add_hash(1)
+    after_add = a.md5sum()
+    assert after_add != before
+    assert after_add == _slow_md5sum(a)
+
+    b = MinHash(20, 10, track_abundance=track_abundance)
+    b.add_hash(0)
+    a.merge(b)
+    assert a.md5sum() != after_add
+    assert a.md5sum() == _slow_md5sum(a)
+
+    c = MinHash(20, 10, track_abundance=track_abundance)
+    c_before = c.md5sum()
+    MinHashGroup([c]).add_sequence('GCCGCCCAGCACCGGGTGACTAGGTTGAGCCATGATTAAC')
+    assert c.md5sum() != c_before
+    assert c.md5sum() == _slow_md5sum(c)
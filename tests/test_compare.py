@@ -0,0 +1,117 @@
+from __future__ import print_function, unicode_literals
+
+import random
+
+import pytest
+
+import sourmash_lib
+from sourmash_lib.signature import SourmashSignature
+from sourmash_lib.compare import compare_all_pairs, _tiles
+
+
+def _make_siglist(track_abundance, n=12):
+    rng = random.Random(n)
+    shared = [ rng.randint(1, 2**63) for _ in range(300) ]
+
+    siglist = []
+    for i in range(n):
+        e = sourmash_lib.MinHash(n=0, ksize=21, max_hash=2**63,
+                                 track_abundance=track_abundance)
+        for h in rng.sample(shared, rng.randint(1, 300)):
+            for _ in range(rng.randint(1, 3)):
+                e.add_hash(h)
+        siglist.append(SourmashSignature('', e, name=str(i)))
+
+    return siglist
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+@pytest.mark.parametrize('ignore_abundance', [False, True])
+def test_compare_all_pairs(track_abundance, processes, ignore_abundance):
+    numpy = pytest.importorskip('numpy')
+
+    siglist = _make_siglist(track_abundance)
+    D = numpy.zeros([len(siglist), len(siglist)])
+    compare_all_pairs(siglist, D, ignore_abundance, processes)
+
+    for i, E in enumerate(siglist):
+        for j, E2 in enumerate(siglist):
+            assert D[i][j] == E.similarity(E2, ignore_abundance)
+
+
+def test_compare_all_pairs_progress():
+    numpy = pytest.importorskip('numpy')
+
+    siglist = _make_siglist(False, n=50)
+    D = numpy.zeros([50, 50])
+    reports = []
+    compare_all_pairs(siglist, D, processes=2,
+                      progress=lambda done, total: reports.append((done, total)))
+
+    assert len(reports) > 1
+    assert reports[-1] == (50 * 51 // 2, 50 * 51 // 2)
+    assert [ done for done, _ in reports ] == \
+        sorted(done for done, _ in reports)
+
+
+def test_compare_all_pairs_incompatible():
+    numpy = pytest.importorskip('numpy')
+
+    a = sourmash_lib.MinHash(n=20, ksize=21)
+    b = sourmash_lib.MinHash(n=20, ksize=31)
+    c = sourmash_lib.MinHash(n=10, ksize=21)
+    D = numpy.zeros([2, 2])
+
+    with pytest.raises(ValueError):
+        compare_all_pairs([SourmashSignature('', a),
+                           SourmashSignature('', b)], D)
+    with pytest.raises(TypeError):
+        compare_all_pairs([SourmashSignature('', a),
+                           SourmashSignature('', c)], D)
+
+
+def test_compare_all_pairs_upper_triangle():
+    numpy = pytest.importorskip('numpy')
+
+    siglist = _make_siglist(True, n=80)
+    D = numpy.zeros([80, 80])
+    compare_all_pairs(siglist, D, processes=2, upper_triangle=True)
+
+    full = numpy.zeros([80, 80])
+    compare_all_pairs(siglist, full)
+
+    assert (D == numpy.triu(full)).all()
+    assert (full == full.T).all()
+
+
+def test_compare_all_pairs_float32_memmap(tmpdir):
+    numpy = pytest.importorskip('numpy')
+
+    siglist = _make_siglist(False, n=40)
+    filename = str(tmpdir.join('D.npy'))
+    D = numpy.lib.format.open_memmap(filename, mode='w+', dtype='float32',
+                                     shape=(40, 40))
+    compare_all_pairs(siglist, D, processes=3)
+    D.flush()
+    del D
+
+    full = numpy.zeros([40, 40])
+    compare_all_pairs(siglist, full)
+
+    saved = numpy.load(filename)
+    assert saved.dtype == numpy.float32
+    assert (saved == full.astype(numpy.float32)).all()
+
+
+@pytest.mark.parametrize('n', [1, 2, 7, 100])
+def test_tiles(n):
+    for tile_size in (1, 3, 32, 512):
+        cells = set()
+        for row_start, row_end, col_start, col_end in _tiles(n, tile_size):
+            assert col_start >= row_start
+            for i in range(row_start, row_end):
+                for j in range(col_start, col_end):
+                    cells.add((i, j))
+
+        # every cell of the upper triangle is in a tile.
+        assert all((i, j) in cells for i in range(n) for j in range(i, n))
@@ -0,0 +1,111 @@
+from __future__ import print_function, unicode_literals
+
+from . import sourmash_tst_utils as utils
+from sourmash_lib import signature
+from sourmash_lib.gather import GatherCounts
+from sourmash_lib.hashindex import HashIndex
+from sourmash_lib.sbt import NodeCache
+from sourmash_lib.sbtmh import SigLeaf, create_sbt_index, load_sbt_index
+
+
+def _load_query():
+    return signature.load_one_signature(
+        utils.get_test_data('gather/combined.sig'), ksize=21)
+
+
+def _run_gather(counts, query):
+    "Take out the best match until none are left, like 'sourmash gather'."
+    remaining = set(query.minhash.get_mins())
+    found = []
+    while True:
+        best = counts.best()
+        if best is None:
+            break
+        n, ss, filename = best
+        found.append((n, ss.md5sum(), filename))
+
+        removed = remaining.intersection(ss.minhash.get_mins())
+        remaining -= removed
+
+        removed_mh = query.minhash.copy_and_clear()
+        removed_mh.add_many(removed)
+        counts.remove(signature.SourmashSignature('', removed_mh))
+    return found
+
+
+def _expected_gather(databases, query):
+    "The same as _run_gather, by comparing each signature every round."
+    remaining = set(query.minhash.get_mins())
+    found = []
+    while True:
+        best = None
+        for db, filename, _ in databases:
+            for ss in db:
+                n = len(remaining.intersection(ss.minhash.get_mins()))
+                # on ties, the first signature in the first database.
+                if n and (best is None or n > best[0]):
+                    best = (n, ss, filename)
+        if best is None:
+            break
+        n, ss, filename = best
+        found.append((n, ss.md5sum(), filename))
+        remaining -= set(ss.minhash.get_mins())
+    return found
+
+
+def test_gather_counts():
+    sigs = utils.load_gather_sigs(ksize=21)
+    query = _load_query()
+    databases = [(HashIndex(sigs[:5]), 'db1', False),
+                 (HashIndex(sigs[5:]), 'db2', False)]
+
+    found = _run_gather(GatherCounts(databases, query), query)
+    assert len(found) == len(sigs)
+    assert found == _expected_gather(databases, query)
+
+
+def test_gather_counts_siglist():
+    # plain .sig databases are loaded as lists, without a HashIndex.
+    sigs = utils.load_gather_sigs(ksize=21)
+    query = _load_query()
+    databases = [(sigs[:5], 'db1', False),
+                 (sigs[5:], 'db2', False)]
+
+    found = _run_gather(GatherCounts(databases, query), query)
+    assert len(found) == len(sigs)
+    assert found == _expected_gather(databases, query)
+
+
+def test_gather_counts_ties():
+    sigs = utils.load_gather_sigs(ksize=21)
+    query = _load_query()
+
+    # every signature is in both databases; the first copy always wins.
+    databases = [(HashIndex(sigs), 'db1', False),
+                 (HashIndex(sigs), 'db2', False)]
+
+    found = _run_gather(GatherCounts(databases, query), query)
+    assert found == _expected_gather(databases[:1], query)
+    assert set(filename for _, _, filename in found) == set(['db1'])
+
+
+def test_gather_counts_sbt_cache(tmpdir):
+    sigs = utils.load_gather_sigs(ksize=21)
+    query = _load_query()
+
+    tree = create_sbt_index()
+    for ss in sigs:
+        tree.add_node(SigLeaf(ss.md5sum(), ss))
+    tree.save(str(tmpdir.join('tree')))
+
+    cache = NodeCache(max_nodes=2)
+    tree = load_sbt_index(str(tmpdir.join('tree.sbt.json')), cache=cache)
+    counts = GatherCounts([(tree, 'tree', True)], query)
+
+    # the counts don't keep the leaf signatures in memory.
+    loaded = [ node for node in tree.nodes.values()
+               if node is not None and node._data is not None ]
+    assert len(loaded) <= 2
+
+    expected = _expected_gather([(sigs, 'tree', False)], query)
+    assert _run_gather(counts, query) == expected
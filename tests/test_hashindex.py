@@ -0,0 +1,84 @@
+from __future__ import print_function, unicode_literals
+
+import pytest
+
+from . import sourmash_tst_utils as utils
+from sourmash_lib import signature
+from sourmash_lib.hashindex import HashIndex, MmapHashIndex
+
+
+def _empty_query(ss):
+    "A signature like 'ss', with no hashes."
+    return signature.SourmashSignature('', ss.minhash.copy_and_clear())
+
+
+def test_hashindex_iter():
+    sigs = utils.load_gather_sigs(31)
+    index = HashIndex(sigs)
+
+    assert len(index) == len(sigs)
+    assert list(index) == sigs
+
+
+def test_hashindex_candidates():
+    sigs = utils.load_gather_sigs(21)
+    index = HashIndex()
+    for ss in sigs:
+        index.insert(ss)
+
+    query = signature.load_one_signature(
+        utils.get_test_data('gather/combined.sig'), ksize=21)
+    expected = [ (ss, query.minhash.count_common(ss.minhash))
+                 for ss in sigs ]
+    expected = [ (ss, n) for ss, n in expected if n ]
+    assert len(expected) > 1
+    assert list(index.candidates(query)) == expected
+    assert dict(index.count_overlaps(query)) == \
+        dict((sigs.index(ss), n) for ss, n in expected)
+
+    assert list(index.candidates(_empty_query(query))) == []
+
+
+def test_hashindex_matches_linear_scan():
+    sigs = utils.load_gather_sigs(31)
+    assert len(sigs) > 1
+    index = HashIndex(sigs)
+
+    for query in sigs:
+        shared = dict((id(ss), n) for ss, n in index.candidates(query))
+        for ss in sigs:
+            n = query.minhash.count_common(ss.minhash)
+            assert shared.get(id(ss), 0) == n
+
+
+def test_hashindex_save_load(tmpdir):
+    pytest.importorskip('numpy')
+
+    sigs = utils.load_gather_sigs(21)
+    index = HashIndex(sigs)
+
+    fn = index.save(str(tmpdir.join('idx')))
+    assert fn.endswith('idx.hidx.json')
+
+    loaded = HashIndex.load(str(tmpdir.join('idx')))
+    assert isinstance(loaded, MmapHashIndex)
+    assert loaded.ksize == 21
+    assert loaded.moltype == 'DNA'
+    assert len(loaded) == len(sigs)
+    assert [ ss.md5sum() for ss in loaded ] == [ ss.md5sum() for ss in sigs ]
+
+    for query in sigs[:3] + [_empty_query(sigs[0])]:
+        assert loaded.count_overlaps(query) == dict(index.count_overlaps(query))
+
+        expected = [ (ss.md5sum(), n) for ss, n in index.candidates(query) ]
+        got = [ (ss.md5sum(), n) for ss, n in loaded.candidates(query) ]
+        assert got == expected
+
+    with pytest.raises(TypeError):
+        loaded.insert(sigs[0])
+
+
+def test_hashindex_load_not_an_index(tmpdir):
+    tmpdir.join('x.hidx.json').write('[]')
+    with pytest.raises(ValueError):
+        HashIndex.load(str(tmpdir.join('x')))
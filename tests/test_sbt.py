@@ -5,8 +5,8 @@ import os
 
 from . import sourmash_tst_utils as utils
 from sourmash_lib import signature
-from sourmash_lib.sbt import SBT, GraphFactory, Leaf
-from sourmash_lib.sbtmh import SigLeaf, search_minhashes
+from sourmash_lib.sbt import SBT, GraphFactory, Leaf, NodeCache
+from sourmash_lib.sbtmh import SigLeaf, search_minhashes, score_minhashes
 
 
 def test_simple(n_children):
@@ -144,6 +144,103 @@ def test_tree_v1_load():
     assert len(results_v1) == 4
 
 
+def test_tree_node_cache():
+    testdata1 = utils.get_test_data(utils.SIG_FILES[0])
+    to_search = next(signature.load_signatures(testdata1))
+
+    tree = SBT.load(utils.get_test_data('v2.sbt.json'),
+                    leaf_loader=SigLeaf.load)
+    expected = {str(s) for s in tree.find(search_minhashes, to_search, 0.1)}
+
+    cache = NodeCache(max_nodes=3)
+    tree = SBT.load(utils.get_test_data('v2.sbt.json'),
+                    leaf_loader=SigLeaf.load, cache=cache)
+
+    results = {str(s) for s in tree.find(search_minhashes, to_search, 0.1)}
+    assert results == expected
+    assert len(cache) == 3
+    assert cache.hits == 0
+    n_loaded = cache.misses
+    assert n_loaded > 3
+
+    # only the nodes still in the cache have their data loaded.
+    loaded = [ node for node in tree.nodes.values()
+               if node is not None and node._data is not None ]
+    assert len(loaded) == 3
+
+    # a cache big enough for everything serves the second search.
+    cache = NodeCache(max_nodes=100)
+    tree.cache = cache
+    for i in range(2):
+        results = {str(s) for s in tree.find(search_minhashes, to_search,
+                                             0.1)}
+        assert results == expected
+    assert cache.hits + cache.misses == 2 * n_loaded
+    assert cache.hits >= n_loaded
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.n_bytes == 0
+    assert all(node._data is None for node in tree.nodes.values()
+               if node is not None)
+
+
+def test_tree_node_cache_after_search():
+    testdata1 = utils.get_test_data(utils.SIG_FILES[0])
+    to_search = next(signature.load_signatures(testdata1))
+
+    cache = NodeCache(max_nodes=2)
+    tree = SBT.load(utils.get_test_data('v2.sbt.json'),
+                    leaf_loader=SigLeaf.load, cache=cache)
+    leaves = tree.find(search_minhashes, to_search, 0.1)
+    assert len(leaves) == 4
+
+    # reading the matches once the search is done goes through the
+    # cache too, so they don't all stay loaded.
+    misses = cache.misses
+    for leaf in leaves:
+        assert leaf.data.minhash.count_common(to_search.minhash)
+    assert cache.misses > misses
+
+    loaded = [ node for node in tree.nodes.values()
+               if node is not None and node._data is not None ]
+    assert len(loaded) == 2
+    assert len(cache) == 2
+
+
+def test_tree_node_cache_max_bytes():
+    testdata1 = utils.get_test_data(utils.SIG_FILES[0])
+    to_search = next(signature.load_signatures(testdata1))
+
+    cache = NodeCache(max_bytes=1)
+    tree = SBT.load(utils.get_test_data('v2.sbt.json'),
+                    leaf_loader=SigLeaf.load, cache=cache)
+
+    results = {str(s) for s in tree.find(search_minhashes, to_search, 0.1)}
+    assert len(results) == 4
+
+    # the most recently used node is always kept.
+    assert len(cache) == 1
+
+
+def test_tree_node_cache_keeps_changed_nodes(n_children):
+    factory = GraphFactory(31, 1e5, 4)
+    tree = SBT(factory, d=n_children, cache=NodeCache(max_nodes=1))
+
+    for f in utils.SIG_FILES:
+        sig = next(signature.load_signatures(utils.get_test_data(f)))
+        tree.add_node(SigLeaf(os.path.basename(f), sig))
+
+    to_search = next(signature.load_signatures(
+                        utils.get_test_data(utils.SIG_FILES[0])))
+
+    # nothing here was loaded from disk, so nothing can be unloaded.
+    results = {str(s) for s in tree.find(search_minhashes, to_search, 0.1)}
+    assert len(results) == 4
+    assert all(node._data is not None for node in tree.nodes.values()
+               if node is not None)
+
+
 def test_tree_save_load(n_children):
     factory = GraphFactory(31, 1e5, 4)
     tree = SBT(factory, d=n_children)
@@ -203,6 +300,68 @@ def test_binary_nary_tree():
     assert results[5] == results[10]
 
 
+def test_sbt_find_best_first(n_children):
+    factory = GraphFactory(31, 1e5, 4)
+    tree = SBT(factory, d=n_children)
+
+    leaves = []
+    for f in utils.SIG_FILES:
+        sig = next(signature.load_signatures(utils.get_test_data(f)))
+        leaf = SigLeaf(os.path.basename(f), sig)
+        tree.add_node(leaf)
+        leaves.append(leaf)
+
+    for to_search in leaves:
+        found = list(tree.find_best_first(score_minhashes, to_search.data))
+        scores = [ score for _, score in found ]
+        assert scores == sorted(scores, reverse=True)
+
+        # every leaf with anything in common comes out, with its own score.
+        expected = {}
+        for leaf in leaves:
+            score = score_minhashes(leaf, to_search.data)
+            if score > 0:
+                expected[str(leaf)] = score
+        assert { str(leaf): score for leaf, score in found } == expected
+
+        best_leaf, best_score = found[0]
+        assert best_score == 1.0
+
+        # the threshold cuts off the search.
+        found = list(tree.find_best_first(score_minhashes, to_search.data,
+                                          0.5))
+        assert all(score >= 0.5 for _, score in found)
+        assert (best_leaf, best_score) in found
+
+
+def test_sbt_find_best_many(n_children):
+    factory = GraphFactory(31, 1e5, 4)
+    tree = SBT(factory, d=n_children)
+
+    queries = []
+    for f in utils.SIG_FILES:
+        sig = next(signature.load_signatures(utils.get_test_data(f)))
+        tree.add_node(SigLeaf(os.path.basename(f), sig))
+        queries.append(sig)
+
+    def is_self(leaf, query):
+        return leaf.data.md5sum() == query.md5sum()
+
+    for threshold, exclude in ((0.0, None), (0.0, is_self), (0.1, is_self)):
+        found = tree.find_best_many(score_minhashes, queries, threshold,
+                                    exclude=exclude)
+        assert len(found) == len(queries)
+
+        for query, match in zip(queries, found):
+            expected = None
+            for leaf, score in tree.find_best_first(score_minhashes, query,
+                                                    threshold):
+                if exclude is None or not exclude(leaf, query):
+                    expected = (leaf, score)
+                    break
+            assert match == expected
+
+
 def test_sbt_combine(n_children):
     factory = GraphFactory(31, 1e5, 4)
     tree = SBT(factory, d=n_children)
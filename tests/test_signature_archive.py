@@ -0,0 +1,59 @@
+from __future__ import print_function, unicode_literals
+
+import io
+
+import pytest
+
+from . import sourmash_tst_utils as utils
+from sourmash_lib import signature
+from sourmash_lib.signature_archive import (save_signature_archive,
+                                            load_archive_toc,
+                                            load_signature_archive)
+
+
+def test_archive_toc():
+    sigs = utils.load_gather_sigs()
+    data = save_signature_archive(sigs)
+
+    toc = load_archive_toc(io.BytesIO(data))
+    assert len(toc) == len(sigs)
+    for entry, ss in zip(toc, sigs):
+        assert entry['md5sum'] == ss.md5sum()
+        assert entry['name'] == ss.name()
+        assert entry['ksize'] == ss.minhash.ksize
+        assert entry['moltype'] == 'DNA'
+        assert entry['scaled'] == 10000
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_archive_roundtrip(compress):
+    sigs = utils.load_gather_sigs()
+    data = save_signature_archive(sigs, compress=compress)
+
+    assert list(load_signature_archive(io.BytesIO(data))) == sigs
+
+    k21 = [ ss for ss in sigs if ss.minhash.ksize == 21 ]
+    assert 0 < len(k21) < len(sigs)
+    loaded = load_signature_archive(io.BytesIO(data), ksize=21,
+                                    select_moltype='dna')
+    assert list(loaded) == k21
+    assert list(signature.load_signatures(data, ksize=21)) == k21
+
+    assert not list(load_signature_archive(io.BytesIO(data),
+                                           select_moltype='protein'))
+
+
+def test_archive_load_signatures(tmpdir):
+    sigs = utils.load_gather_sigs()
+    fn = str(tmpdir.join('all.sig'))
+    with open(fn, 'wb') as fp:
+        save_signature_archive(sigs, fp)
+
+    loaded = list(signature.load_signatures(fn, ksize=31))
+    assert loaded == [ ss for ss in sigs if ss.minhash.ksize == 31 ]
+
+
+def test_archive_truncated():
+    data = save_signature_archive(utils.load_gather_sigs())
+    with pytest.raises(ValueError):
+        list(load_signature_archive(io.BytesIO(data[:-10])))
@@ -2,6 +2,7 @@ import sys
 import io
 import json
 import ijson
+import pytest
 import sourmash_lib
 from sourmash_lib.signature import SourmashSignature
 from sourmash_lib.signature_json import (_json_next_atomic_array,
@@ -131,3 +132,131 @@ def test_save_load_multisig_json():
     assert sig1 in y                      # order not guaranteed, note.
     assert sig2 in y
     assert sig1 != sig2
+
+
+def test_load_signatures_json_bulk_matches_streaming(monkeypatch):
+    import sourmash_lib.signature_json as signature_json
+
+    e1 = sourmash_lib.MinHash(n=0, ksize=20, max_hash=2**64 - 1,
+                              track_abundance=True)
+    e1.add_many([2**64 - 1, 2**63 + 1, 2**63, 5])
+    sig1 = SourmashSignature('lalala@land.org', e1, name='one',
+                             filename='one.fa')
+
+    e2 = sourmash_lib.MinHash(n=3, ksize=21, is_protein=True)
+    e2.add_protein('MRVLKFGGTSVANAERFLRV')
+    sig2 = SourmashSignature('lalala2@land.org', e2)
+
+    x = save_signatures_json([sig1, sig2])
+    bulk = list(load_signatures_json(x, ignore_md5sum=False))
+
+    monkeypatch.setattr(signature_json, 'JSON_BULK_MAX_SIZE', 10)
+    streamed = list(load_signatures_json(x, ignore_md5sum=False))
+
+    expected = sorted([sig1, sig2], key=lambda s: s.md5sum())
+    assert sorted(bulk, key=lambda s: s.md5sum()) == expected
+    assert sorted(streamed, key=lambda s: s.md5sum()) == expected
+    for sigs in (bulk, streamed):
+        loaded = [ s for s in sigs if s.name() == 'one' ][0]
+        assert loaded.d['filename'] == 'one.fa'
+        assert loaded.minhash.get_mins(with_abundance=True) == \
+            {2**64 - 1: 1, 2**63 + 1: 1, 2**63: 1, 5: 1}
+
+
+def test_fastest_ijson_parses_big_ints():
+    from sourmash_lib.signature_json import ijson as backend
+
+    s = json.dumps([2**64 - 1, 2**63])
+    events = list(backend.parse(io.BytesIO(s.encode('utf-8'))))
+    assert [ value for _, event, value in events if event == 'number' ] == \
+        [2**64 - 1, 2**63]
+
+
+def test_load_signatures_json_skips_unselected(monkeypatch):
+    import sourmash_lib.signature_json as signature_json
+
+    sigs = []
+    for ksize in (21, 31):
+        for is_protein in (False, True):
+            e = sourmash_lib.MinHash(n=5, ksize=ksize, is_protein=is_protein)
+            e.add_many([1, 2, 3, ksize, 100 + is_protein])
+            sigs.append(SourmashSignature('lalala@land.org', e))
+
+    # break the md5sum of every sketch but the k=21 DNA one: only the
+    # sketches that are selected get built and checked.
+    records = json.loads(save_signatures_json(sigs))
+    for record in records:
+        for d in record['signatures']:
+            if d['ksize'] != 21 or d['molecule'] != 'DNA':
+                d['md5sum'] = 'xxx'
+    x = json.dumps(records, sort_keys=True)
+
+    for bulk_size in (signature_json.JSON_BULK_MAX_SIZE, 10):
+        monkeypatch.setattr(signature_json, 'JSON_BULK_MAX_SIZE', bulk_size)
+        y = list(load_signatures_json(x, ksize=21, select_moltype='dna',
+                                      ignore_md5sum=False))
+        assert y == [sigs[0]]
+
+        with pytest.raises(Exception):
+            list(load_signatures_json(x, ksize=31, ignore_md5sum=False))
+
+
+def test_save_signatures_json_hashes_last(monkeypatch):
+    # the hashes of a newly saved block come after its 'ksize' and
+    # 'molecule', so the streaming parser never keeps unselected ones.
+    import sourmash_lib.signature_json as signature_json
+
+    sigs = []
+    for ksize in (21, 31):
+        for is_protein in (False, True):
+            e = sourmash_lib.MinHash(n=5, ksize=ksize, is_protein=is_protein,
+                                     track_abundance=True)
+            e.add_many([1, 2, 3, ksize, 100 + is_protein])
+            sigs.append(SourmashSignature('lalala@land.org', e))
+
+    x = save_signatures_json(sigs)
+    keys = [ line.strip().split('"')[1] for line in x.splitlines()
+             if line.strip().startswith('"') ]
+    assert keys.index('ksize') < keys.index('abundances')
+    assert keys.index('molecule') < keys.index('mins')
+
+    kept = []
+    next_atomic_array = signature_json._json_next_atomic_array
+    def tracked(*args, **kwargs):
+        kept.append(next_atomic_array(*args, **kwargs))
+        return kept[-1]
+    monkeypatch.setattr(signature_json, '_json_next_atomic_array', tracked)
+    monkeypatch.setattr(signature_json, 'JSON_BULK_MAX_SIZE', 10)
+
+    y = list(load_signatures_json(x, ksize=31, select_moltype='protein'))
+    assert y == [sigs[3]]
+    assert len(kept) == 2                 # its 'abundances' and 'mins'
+
+
+def test_load_signatures_json_streaming_select_protein(monkeypatch):
+    # older files with plainly sorted keys put 'mins' before 'molecule':
+    # the hashes have to be kept until the molecule type is known.
+    import sourmash_lib.signature_json as signature_json
+    from . import sourmash_tst_utils as utils
+
+    filename = utils.get_test_data('genome-s10+s11.sig')
+    with io.open(filename, 'rt') as fp:
+        x = fp.read()
+
+    bulk = list(load_signatures_json(x, select_moltype='protein',
+                                     ignore_md5sum=False))
+    assert len(bulk) == 2
+    assert all(sig.minhash.is_protein for sig in bulk)
+
+    records = list(load_signatureset_json_iter(io.StringIO(x),
+                                               select_moltype='protein'))
+    streamed = [ sig for record in records for sig in record['signatures'] ]
+    assert streamed == bulk
+
+    monkeypatch.setattr(signature_json, 'JSON_BULK_MAX_SIZE', 10)
+    assert list(load_signatures_json(x, select_moltype='protein',
+                                     ignore_md5sum=False)) == bulk
+    dna = list(load_signatures_json(x, select_moltype='DNA',
+                                    ignore_md5sum=False))
+    assert len(dna) == 2
+    assert not any(sig.minhash.is_protein for sig in dna)
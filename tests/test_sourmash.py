@@ -67,6 +67,60 @@ def test_do_sourmash_compute():
         assert sig.name().endswith('short.fa')
 
 
+def test_do_sourmash_compute_binary():
+    with utils.TempDirectory() as location:
+        testdata1 = utils.get_test_data('short.fa')
+        status, out, err = utils.runscript('sourmash',
+                                           ['compute', '-k', '21,31',
+                                            testdata1],
+                                           in_directory=location)
+        jsonsigs = list(signature.load_signatures(
+            os.path.join(location, 'short.fa.sig')))
+
+        for binary in ('raw', 'varint'):
+            sigfile = os.path.join(location, binary + '.sig')
+            status, out, err = utils.runscript('sourmash',
+                                               ['compute', '-k', '21,31',
+                                                '--binary', binary,
+                                                '-o', sigfile, testdata1],
+                                               in_directory=location)
+
+            with open(sigfile, 'rb') as fp:
+                assert fp.read(6) == b'\x89SMSIG'
+            sigs = list(signature.load_signatures(sigfile))
+            assert sigs == jsonsigs
+
+            status, out, err = utils.runscript('sourmash',
+                                               ['search', sigfile, sigfile,
+                                                '-k', '21'],
+                                               in_directory=location)
+            assert '1 matches' in out
+
+
+def test_do_sourmash_archive():
+    with utils.TempDirectory() as location:
+        testdata = glob.glob(utils.get_test_data('gather/GCF*.sig'))
+        archive = os.path.join(location, 'all.sig')
+
+        status, out, err = utils.runscript('sourmash',
+                                           ['archive', archive, '-k', '21'] +
+                                           testdata,
+                                           in_directory=location)
+        assert 'saving {} signatures'.format(len(testdata)) in err
+
+        status, out, err = utils.runscript('sourmash',
+                                           ['compare', archive],
+                                           in_directory=location)
+        assert 'loaded {} signatures total.'.format(len(testdata)) in err
+
+        query = utils.get_test_data('gather/combined.sig')
+        status, out, err = utils.runscript('sourmash',
+                                           ['gather', query, archive,
+                                            '-k', '21'],
+                                           in_directory=location)
+        assert 'found 12 matches total' in out
+
+
 def test_do_sourmash_compute_output_valid_file():
     """ Trigger bug #123 """
     with utils.TempDirectory() as location:
@@ -163,6 +217,137 @@ def test_do_sourmash_compute_singleton():
         assert sig.name().endswith('shortName')
 
 
+def test_do_sourmash_compute_processes():
+    with utils.TempDirectory() as location:
+        testdata1 = utils.get_test_data('short.fa')
+        testdata2 = utils.get_test_data('short2.fa')
+        for processes in ('1', '2'):
+            status, out, err = utils.runscript('sourmash',
+                                               ['compute', '-k', '21,30',
+                                                '--protein', '--scaled', '10',
+                                                '--track-abundance',
+                                                '-p', processes,
+                                                testdata1, testdata2,
+                                                '-o', processes + '.sig'],
+                                               in_directory=location)
+
+        serial = list(signature.load_signatures(os.path.join(location,
+                                                             '1.sig')))
+        parallel = list(signature.load_signatures(os.path.join(location,
+                                                               '2.sig')))
+        assert len(serial) == 8
+        assert serial == parallel
+        assert [ s.d['filename'] for s in serial ] == \
+            [ s.d['filename'] for s in parallel ]
+
+
+def test_do_sourmash_compute_processes_chunked():
+    # split one file into many chunks, and check that merging the partial
+    # sketches gives the same signature as sketching it in one go.
+    with utils.TempDirectory() as location:
+        testdata1 = utils.get_test_data('ecoli.genes.fna')
+        for processes in ('1', '2'):
+            status, out, err = utils.runscript('sourmash',
+                                               ['compute', '-k', '21,31',
+                                                '-n', '100',
+                                                '--track-abundance',
+                                                '-p', processes,
+                                                '--chunk-size', '1000',
+                                                '--name-from-first',
+                                                testdata1,
+                                                '-o', processes + '.sig'],
+                                               in_directory=location)
+
+        serial = list(signature.load_signatures(os.path.join(location,
+                                                             '1.sig')))
+        parallel = list(signature.load_signatures(os.path.join(location,
+                                                               '2.sig')))
+        assert len(serial) == 2
+        assert serial == parallel
+        assert serial[0].name() == parallel[0].name()
+        assert 'calculated 2 signatures for 2 sequences' in err
+
+
+def test_compute_split_file(monkeypatch):
+    from sourmash_lib import commands
+
+    testdata1 = utils.get_test_data('short.fa')
+
+    # split files only when there are too few to go around, or big ones.
+    assert commands._split_file(testdata1, 1, 2)
+    assert not commands._split_file(testdata1, 2, 2)
+    assert not commands._split_file('-', 2, 2)
+
+    monkeypatch.setattr(commands, 'LARGE_FILE_SIZE', 10)
+    assert commands._split_file(testdata1, 2, 2)
+
+
+def test_do_sourmash_compute_processes_mixed():
+    # with more processes than files, the files are split into chunks;
+    # with as many, each one is sketched whole.
+    with utils.TempDirectory() as location:
+        testdata1 = utils.get_test_data('ecoli.genes.fna')
+        testdata2 = utils.get_test_data('short.fa')
+        for processes in ('1', '2', '3'):
+            status, out, err = utils.runscript('sourmash',
+                                               ['compute', '-k', '21',
+                                                '-n', '100',
+                                                '-p', processes,
+                                                '--chunk-size', '1000',
+                                                testdata1, testdata2,
+                                                '-o', processes + '.sig'],
+                                               in_directory=location)
+
+        serial = list(signature.load_signatures(os.path.join(location,
+                                                             '1.sig')))
+        for processes in ('2', '3'):
+            parallel = list(signature.load_signatures(
+                os.path.join(location, processes + '.sig')))
+            assert len(parallel) == 2
+            assert serial == parallel
+
+
+def test_do_sourmash_compute_singleton_processes():
+    with utils.TempDirectory() as location:
+        testdata1 = utils.get_test_data('short.fa')
+        testdata2 = utils.get_test_data('short2.fa')
+        status, out, err = utils.runscript('sourmash',
+                                           ['compute', '-k', '31', '--singleton',
+                                            '-p', '2', testdata1, testdata2,
+                                            '-o', 'out.sig'],
+                                           in_directory=location)
+
+        sigfile = os.path.join(location, 'out.sig')
+        siglist = list(signature.load_signatures(sigfile))
+        # one signature for each record in each file.
+        assert len(siglist) == 2
+        assert siglist[0].d['filename'] == testdata1
+        assert siglist[1].d['filename'] == testdata2
+
+
+def test_do_sourmash_compute_merge_processes():
+    with utils.TempDirectory() as location:
+        testdata1 = utils.get_test_data('short.fa')
+        testdata2 = utils.get_test_data('short2.fa')
+        for processes in ('1', '2'):
+            status, out, err = utils.runscript('sourmash',
+                                               ['compute', '-k', '31',
+                                                '--scaled', '10',
+                                                '--track-abundance',
+                                                '--merge', 'foo',
+                                                '-p', processes,
+                                                testdata1, testdata2,
+                                                '-o', processes + '.sig'],
+                                               in_directory=location)
+
+        serial = next(signature.load_signatures(os.path.join(location,
+                                                             '1.sig')))
+        parallel = next(signature.load_signatures(os.path.join(location,
+                                                               '2.sig')))
+        assert serial.name() == 'foo'
+        assert serial == parallel
+
+
 def test_do_sourmash_compute_name():
     with utils.TempDirectory() as location:
         testdata1 = utils.get_test_data('short.fa')
@@ -722,6 +907,40 @@ def test_do_plot_comparison():
         assert os.path.exists(os.path.join(location, "cmp.matrix.png"))
 
 
+def test_do_plot_comparison_upper_triangle():
+    import numpy
+
+    with utils.TempDirectory() as location:
+        testdata1 = utils.get_test_data('short.fa')
+        testdata2 = utils.get_test_data('short2.fa')
+        testdata3 = utils.get_test_data('short3.fa')
+        status, out, err = utils.runscript('sourmash',
+                                           ['compute', '-k', '31', testdata1,
+                                            testdata2, testdata3],
+                                           in_directory=location)
+
+        sigs = ['short.fa.sig', 'short2.fa.sig', 'short3.fa.sig']
+        status, out, err = utils.runscript('sourmash',
+                                           ['compare', '-o', 'cmp'] + sigs,
+                                           in_directory=location)
+        status, out2, err = utils.runscript('sourmash',
+                                            ['compare', '-o', 'cmp_upper',
+                                             '--dtype', 'float32',
+                                             '--upper-triangle'] + sigs,
+                                            in_directory=location)
+        assert 'min similarity in matrix: 0.896' in out
+        assert 'min similarity in matrix: 0.896' in out2
+
+        D = numpy.load(os.path.join(location, 'cmp'))
+        D_upper = numpy.load(os.path.join(location, 'cmp_upper'))
+        assert D_upper.dtype == numpy.float32
+        assert (D_upper == numpy.triu(D).astype(numpy.float32)).all()
+
+        status, out, err = utils.runscript('sourmash', ['plot', 'cmp_upper'],
+                                           in_directory=location)
+        assert os.path.exists(os.path.join(location, "cmp_upper.matrix.png"))
+
+
 def test_do_plot_comparison_2():
     with utils.TempDirectory() as location:
         testdata1 = utils.get_test_data('short.fa')
@@ -884,6 +1103,35 @@ def test_search_csv():
             assert row['md5'] == '914591cd1130aa915fe0c0c63db8f19d'
 
 
+def test_compare_processes():
+    with utils.TempDirectory() as location:
+        testdata1 = utils.get_test_data('short.fa')
+        testdata2 = utils.get_test_data('short2.fa')
+        testdata3 = utils.get_test_data('short3.fa')
+        status, out, err = utils.runscript('sourmash',
+                                           ['compute', '-k', '31',
+                                            '--track-abundance',
+                                            testdata1, testdata2, testdata3],
+                                           in_directory=location)
+
+        sigs = ['short.fa.sig', 'short2.fa.sig', 'short3.fa.sig']
+        status, out, err = utils.runscript('sourmash',
+                                           ['compare', '--csv', 'serial.csv']
+                                           + sigs,
+                                           in_directory=location)
+        status, out2, err = utils.runscript('sourmash',
+                                            ['compare', '-p', '2',
+                                             '--csv', 'parallel.csv'] + sigs,
+                                            in_directory=location)
+        assert 'compared 6 of 6 pairs' in err
+        assert out == out2
+
+        with open(os.path.join(location, 'serial.csv')) as fp:
+            serial = fp.read()
+        with open(os.path.join(location, 'parallel.csv')) as fp:
+            assert fp.read() == serial
+
+
 def test_compare_deduce_molecule():
     # deduce DNA vs protein from query, if it is unique
     with utils.TempDirectory() as location:
@@ -1225,6 +1473,72 @@ def test_search_3():
         assert '2 matches; showing first 1' in out
 
 
+def test_search_top():
+    with utils.TempDirectory() as location:
+        testdata_glob = utils.get_test_data('gather/GCF*.sig')
+        testdata_sigs = glob.glob(testdata_glob)
+
+        query_sig = utils.get_test_data('gather/combined.sig')
+
+        cmd = ['index', 'gcf_all', '-k', '21']
+        cmd.extend(testdata_sigs)
+        status, out, err = utils.runscript('sourmash', cmd,
+                                           in_directory=location)
+
+        def search(*extra):
+            cmd = ['search', query_sig, 'gcf_all', '-k', '21', '-n', '3',
+                   '--containment', '-o', 'out.csv'] + list(extra)
+            status, out, err = utils.runscript('sourmash', cmd,
+                                               in_directory=location)
+            print(out)
+            print(err)
+            with open(os.path.join(location, 'out.csv'), 'rt') as fp:
+                return [ (row['similarity'], row['name'])
+                         for row in csv.DictReader(fp) ]
+
+        all_matches = search()
+        top_matches = search('--top')
+
+        assert len(all_matches) == 12
+        assert top_matches == all_matches[:3]
+
+        best_match = search('--best-only')
+        assert best_match == all_matches[:1]
+
+
+def test_search_top_downsampled_query():
+    # the query is downsampled to the scaled of the tree for each leaf,
+    # so the fraction of the full query in a node no longer bounds the
+    # similarity of the leaves below it.
+    # only 1, 2 and 3 are left of the query at scaled=4.
+    query = utils.make_signature('query', [1, 2, 3] +
+                                 [ 2**62 + i for i in range(1, 11) ],
+                                 scaled=2)
+    # 'c' and 'a' end up under different internal nodes.
+    sigs = [ utils.make_signature(name, hashes, scaled=4) for name, hashes in
+             (('c', range(1, 11)), ('a', [1, 2, 3]), ('d', [100]),
+              ('b', [200])) ]
+
+    with utils.TempDirectory() as location:
+        utils.save_signature(location, query, 'q.sig')
+        utils.index_signatures(location, sigs)
+
+        def search(*extra):
+            cmd = ['search', 'q.sig', 'zzz', '-k', '21',
+                   '-o', 'out.csv'] + list(extra)
+            status, out, err = utils.runscript('sourmash', cmd,
+                                               in_directory=location)
+            print(out)
+            print(err)
+            with open(os.path.join(location, 'out.csv'), 'rt') as fp:
+                return [ (row['similarity'], row['name'])
+                         for row in csv.DictReader(fp) ]
+
+        all_matches = search()
+        assert all_matches[0][1] == 'a'
+        assert search('--best-only') == all_matches[:1]
+
+
 def test_search_metagenome():
     with utils.TempDirectory() as location:
         testdata_glob = utils.get_test_data('gather/GCF*.sig')
@@ -2029,6 +2343,81 @@ def test_gather_metagenome():
         assert '4.7 Mbp      32.1%    1.5%      NC_011294.1 Salmonella enterica subsp...' in out
 
 
+def test_gather_metagenome_sbt_cache():
+    with utils.TempDirectory() as location:
+        testdata_glob = utils.get_test_data('gather/GCF*.sig')
+        testdata_sigs = glob.glob(testdata_glob)
+
+        query_sig = utils.get_test_data('gather/combined.sig')
+
+        cmd = ['index', 'gcf_all', '-k', '21']
+        cmd.extend(testdata_sigs)
+
+        status, out, err = utils.runscript('sourmash', cmd,
+                                           in_directory=location)
+
+        cmd = 'gather {} gcf_all -k 21 --sbt-cache-nodes 2'.format(query_sig)
+        status, out, err = utils.runscript('sourmash', cmd.split(' '),
+                                           in_directory=location)
+
+        print(out)
+        print(err)
+
+        assert 'found 12 matches total' in out
+        assert 'the recovered matches hit 100.0% of the query' in out
+        assert 'SBT node cache: ' in err
+
+        # searching reports the cache, too.
+        cmd = 'search {} gcf_all -k 21 --containment --sbt-cache-nodes 2 ' \
+              '--sbt-cache-size 1e6'.format(query_sig)
+        status, out, err = utils.runscript('sourmash', cmd.split(' '),
+                                           in_directory=location)
+
+        print(out)
+        print(err)
+
+        assert '12 matches' in out
+        assert 'SBT node cache: ' in err
+
+
+def test_gather_metagenome_hash_index():
+    with utils.TempDirectory() as location:
+        testdata_glob = utils.get_test_data('gather/GCF*.sig')
+        testdata_sigs = glob.glob(testdata_glob)
+
+        query_sig = utils.get_test_data('gather/combined.sig')
+
+        cmd = ['index', 'gcf_all', '-k', '21', '--hash-index']
+        cmd.extend(testdata_sigs)
+
+        status, out, err = utils.runscript('sourmash', cmd,
+                                           in_directory=location)
+
+        assert os.path.exists(os.path.join(location, 'gcf_all.hidx.json'))
+
+        cmd = 'gather {} gcf_all -k 21'.format(query_sig)
+        status, out, err = utils.runscript('sourmash', cmd.split(' '),
+                                           in_directory=location)
+
+        print(out)
+        print(err)
+
+        assert 'loaded hash index gcf_all' in err
+        assert 'found 12 matches total' in out
+        assert 'the recovered matches hit 100.0% of the query' in out
+        assert '4.9 Mbp      33.2%  100.0%      NC_003198.1 Salmonella enterica subsp...' in out
+        assert '4.7 Mbp      32.1%    1.5%      NC_011294.1 Salmonella enterica subsp...' in out
+
+        cmd = 'categorize gcf_all {} -k 21 --csv out.csv'.format(query_sig)
+        status, out, err = utils.runscript('sourmash', cmd.split(' '),
+                                           in_directory=location)
+
+        print(out)
+        print(err)
+
+        assert 'found: 0.' in err
+
+
 def test_gather_metagenome_output_unassigned():
     with utils.TempDirectory() as location:
         testdata_glob = utils.get_test_data('gather/GCF_000195995*g')
@@ -2253,6 +2642,27 @@ def test_sbt_categorize():
         assert './4.sig,genome-s10.fa.gz,0.50' in out_csv
 
 
+def test_sbt_categorize_ranks_by_similarity():
+    # 'big' holds all of the query, but 'close' is more similar to it.
+    query = utils.make_signature('query', range(1, 11))
+    big = utils.make_signature('big',
+                               list(range(1, 11)) + list(range(100, 1100)))
+    close = utils.make_signature('close', list(range(1, 9)) + [2000, 2001])
+
+    with utils.TempDirectory() as location:
+        utils.save_signature(location, query, 'q.sig')
+        utils.index_signatures(location, [big, close])
+
+        args = ['categorize', 'zzz', 'q.sig', '--ksize', '21', '--dna',
+                '--threshold', '0.5']
+        status, out, err = utils.runscript('sourmash', args,
+                                           in_directory=location)
+
+        print(out)
+        print(err)
+        assert 'for query, found: 0.67 close' in err
+
+
 def test_sbt_categorize_already_done():
     with utils.TempDirectory() as location:
         testdata1 = utils.get_test_data('genome-s10.fa.gz.sig')
@@ -2361,6 +2771,39 @@ def test_watch():
         assert 'FOUND: genome-s10.fa.gz, at 1.000' in out
 
 
+def test_watch_ranks_by_similarity():
+    # 'big' holds all of the input, but 'close' is more similar to it.
+    import random
+    rng = random.Random(1)
+    seq = ''.join(rng.choice('ACGT') for _ in range(1000))
+    extra = ''.join(rng.choice('ACGT') for _ in range(3000))
+
+    with utils.TempDirectory() as location:
+        for name, sequence in (('input', seq), ('big', seq + extra),
+                               ('close', seq[:800])):
+            with open(os.path.join(location, name + '.fa'), 'wt') as fp:
+                fp.write('>{}\n{}\n'.format(name, sequence))
+
+        # enough hashes to hold every k-mer.
+        args = ['compute', '-k', '21', '-n', '5000', '--name-from-first',
+                'big.fa', 'close.fa']
+        status, out, err = utils.runscript('sourmash', args,
+                                           in_directory=location)
+
+        args = ['index', '--dna', '-k', '21', 'zzz', 'big.fa.sig',
+                'close.fa.sig']
+        status, out, err = utils.runscript('sourmash', args,
+                                           in_directory=location)
+
+        args = ['watch', '--dna', '-k', '21', '-n', '5000', 'zzz', 'input.fa']
+        status, out, err = utils.runscript('sourmash', args,
+                                           in_directory=location)
+
+        print(out)
+        print(err)
+        assert 'FOUND: close, at 0.796' in out
+
+
 def test_watch_deduce_ksize():
     with utils.TempDirectory() as location:
         testdata0 = utils.get_test_data('genome-s10.fa.gz')